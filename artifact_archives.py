@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Streaming ZIP archives of generated artifacts.
+
+Archives are written entry by entry to a non-seekable sink, so a download
+never holds more than one read chunk of the archive in memory. PDFs are
+already compressed and are stored as-is (no CPU spent deflating them again);
+CSVs are deflated.
+
+The same writer also builds period archives ahead of time
+(<root>/archives/<name>_<period>.zip). These are static files, so they can be
+served with ETag and Range support and downloads of a finished month cost a
+single sendfile.
+"""
+
+import io
+import zipfile
+from pathlib import Path
+
+
+ARCHIVE_CHUNK_SIZE = 256 * 1024
+ARCHIVE_DIRNAME = "archives"
+ARCHIVE_NAMES = {"pdf": "invoices", "csv": "exports"}
+STORED_SUFFIXES = {".pdf", ".zip", ".gz", ".png", ".jpg", ".jpeg"}  # already compressed
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable buffer that zipfile writes into and the generator drains."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def compress_type_for(path):
+    """ZIP_STORED for already-compressed files, ZIP_DEFLATED otherwise."""
+    return zipfile.ZIP_STORED if Path(path).suffix.lower() in STORED_SUFFIXES else zipfile.ZIP_DEFLATED
+
+
+def iter_zip(files, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """
+    Yield a ZIP archive of files as byte chunks, reading each file as it goes.
+
+    Args:
+        files: Iterable of (path, arcname) pairs
+        chunk_size: Bytes read from each file at a time
+
+    Yields:
+        Non-empty bytes chunks that concatenate to a valid ZIP file
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w") as archive:
+        for path, arcname in files:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = compress_type_for(path)
+            with open(path, "rb") as source, archive.open(info, "w") as entry:
+                while True:
+                    data = source.read(chunk_size)
+                    if not data:
+                        break
+                    entry.write(data)
+                    chunk = sink.drain()
+                    if chunk:
+                        yield chunk
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    chunk = sink.drain()  # central directory
+    if chunk:
+        yield chunk
+
+
+def archive_files(manifest, kind, period=None, integrator=None):
+    """
+    (path, arcname) pairs for the manifest entries matching the selection,
+    in path order, skipping files that have since been removed.
+    """
+    entries = [
+        entry
+        for entry in manifest.entries()
+        if entry["kind"] == kind
+        and (period is None or entry.get("period") == period)
+        and (integrator is None or entry.get("integrator") == integrator)
+    ]
+    files = []
+    for entry in sorted(entries, key=lambda entry: entry["path"]):
+        path = manifest.root / entry["path"]
+        if path.is_file():
+            files.append((path, entry["path"]))
+    return files
+
+
+def period_archive_path(manifest, kind, period):
+    """Where the prebuilt archive of one period lives."""
+    return manifest.root / ARCHIVE_DIRNAME / f"{ARCHIVE_NAMES[kind]}_{period}.zip"
+
+
+def build_period_archive(manifest, kind, period):
+    """
+    Write the archive of every `kind` artifact in `period` (atomically).
+
+    Returns:
+        Path of the archive, or None when the period has no artifacts
+    """
+    files = archive_files(manifest, kind, period=period)
+    if not files:
+        return None
+    archive_path = period_archive_path(manifest, kind, period)
+    archive_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = archive_path.with_suffix(".tmp")
+    with open(temp_path, "wb") as target:
+        for chunk in iter_zip(files):
+            target.write(chunk)
+    temp_path.replace(archive_path)
+    return archive_path
+
+
+def current_period_archive(manifest, kind, period):
+    """
+    The prebuilt archive of a period if it is at least as new as every
+    artifact in it, else None (the caller streams a fresh archive instead).
+    """
+    archive_path = period_archive_path(manifest, kind, period)
+    try:
+        built = archive_path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    newest = max(
+        (entry["mtime"] for entry in manifest.entries() if entry["kind"] == kind and entry.get("period") == period),
+        default=None,
+    )
+    if newest is None or newest > built:
+        return None
+    return archive_path
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Manifest of generated artifacts (invoice PDFs and export CSVs).
+
+Each artifact root (invoices/, exports/) keeps an append-only JSON Lines
+journal, .artifacts.jsonl, with one entry per written file: relative path,
+kind, size, mtime, integrator, country and billing period. Writers append an
+entry when they produce a file, so listing the dashboard never has to glob and
+stat thousands of files.
+
+Readers hold the entries in memory and detect changes with a single stat of
+the journal: appended lines are parsed incrementally, and a replaced journal
+(after compaction or a rebuild) is reloaded. A root that has artifacts but no
+journal yet (files generated before the manifest existed) is scanned once to
+bootstrap it.
+"""
+
+import csv
+import json
+import re
+import threading
+from datetime import datetime
+from pathlib import Path
+
+
+MANIFEST_FILENAME = ".artifacts.jsonl"
+ARTIFACT_KINDS = {".pdf": "pdf", ".csv": "csv"}
+COMPACT_MIN_LINES = 1000  # journals shorter than this are never compacted
+COMPACT_RATIO = 2  # compact once lines outnumber live entries by this factor
+
+PDF_NAME_PATTERN = re.compile(r"^(?P<integrator>.+)_(?P<year>\d{4})_(?P<month>[A-Za-z]+)$")
+PERIOD_PATTERN = re.compile(r"^(?P<year>\d{4})_(?P<month>[a-z]+)$")
+
+
+def period_sort_key(period):
+    """Chronological sort key for a period label; unknown labels sort first."""
+    match = PERIOD_PATTERN.match(period or "")
+    if not match:
+        return (0, 0, period or "")
+    try:
+        month = datetime.strptime(match["month"], "%B").month
+    except ValueError:
+        month = 0
+    return (int(match["year"]), month, period)
+
+
+def artifact_entry(root, path, integrator=None, country=None, period=None):
+    """Manifest entry for a file under root, with its current size and mtime."""
+    path = Path(path)
+    stat = path.stat()
+    return {
+        "path": path.relative_to(root).as_posix(),
+        "kind": ARTIFACT_KINDS.get(path.suffix.lower(), path.suffix.lower().lstrip(".")),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "integrator": integrator,
+        "country": country,
+        "period": period,
+    }
+
+
+def _export_row_metadata(path):
+    """Integration Name and Country of an export CSV's first row ({} if unreadable or empty)."""
+    try:
+        with open(path, newline="", encoding="utf-8") as handle:
+            row = next(csv.DictReader(handle), None) or {}
+    except (OSError, UnicodeDecodeError, csv.Error):
+        return {}
+    return {
+        key: row[column].strip()
+        for key, column in (("integrator", "Integration Name"), ("country", "Country"))
+        if (row.get(column) or "").strip()
+    }
+
+
+def infer_metadata(relative_path, root=None):
+    """
+    Best-effort integrator/country/period for a file found by a scan, from the
+    naming schemes used by InvoiceGenerator and generate_invoices.export_csv_path.
+
+    Integrators are display names, as writers record them ("TLBT UrbanPiper
+    Plugin"). Export folders only carry the slug, so with a root the display
+    name and country are read from the CSV's first row; the slug-derived
+    values are the fallback.
+    """
+    # Imported here: generate_invoices imports this module
+    from generate_invoices import billing_period_label
+
+    path = Path(relative_path)
+    if path.suffix.lower() == ".pdf":
+        match = PDF_NAME_PATTERN.match(path.stem)
+        if match:
+            return {
+                "integrator": match["integrator"].replace("_", " "),
+                "country": None,
+                "period": billing_period_label(match["month"], match["year"]),
+            }
+    elif path.suffix.lower() == ".csv" and len(path.parts) >= 3:
+        period, integrator = path.parts[-3], path.parts[-2]
+        country = path.stem
+        if country.startswith(f"{integrator}_"):
+            country = country[len(integrator) + 1:]
+        if country.endswith(f"_{period}"):
+            country = country[:-len(period) - 1]
+        country = country.replace("_", " ")
+        # Country slugs are lower-cased names; short ones are abbreviations ("uae")
+        country = country.upper() if len(country) <= 3 else country.title()
+        metadata = {"integrator": integrator, "country": country, "period": period}
+        if root is not None:
+            metadata.update(_export_row_metadata(Path(root) / path))
+        return metadata
+    return {"integrator": None, "country": None, "period": None}
+
+
+class ArtifactManifest:
+    """In-memory view of one artifact root's journal, refreshed on change."""
+
+    def __init__(self, root, filename=MANIFEST_FILENAME):
+        """
+        Args:
+            root: Directory the artifacts (and the journal) live in
+            filename: Journal file name inside root
+        """
+        self.root = Path(root)
+        self.path = self.root / filename
+        self._lock = threading.RLock()
+        self._reset(None)
+
+    def _reset(self, file_id):
+        self._file_id = file_id
+        self._offset = 0
+        self._lines = 0
+        self._entries = {}
+        self._listing = None
+        self._stats = None
+
+    def record(self, entries):
+        """Append entries for files that were just written (later entries replace earlier ones)."""
+        entries = list(entries)
+        if not entries:
+            return
+        payload = "".join(json.dumps(entry, sort_keys=True) + "\n" for entry in entries)
+        with self._lock:
+            self._bootstrap()
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as journal:
+                journal.write(payload)
+            self._refresh()
+            if self._lines > max(COMPACT_MIN_LINES, COMPACT_RATIO * len(self._entries)):
+                self._write_journal(self._entries.values())
+
+    def record_file(self, path, integrator=None, country=None, period=None):
+        """Append the entry for a single file under root."""
+        self.record([artifact_entry(self.root, path, integrator, country, period)])
+
+    def rebuild(self):
+        """
+        Rescan root and rewrite the journal: drops entries for deleted files,
+        refreshes sizes/mtimes and keeps recorded metadata for files still present.
+        """
+        with self._lock:
+            self._refresh()
+            known = self._entries
+            entries = []
+            for path in sorted(self.root.rglob("*")):
+                if path.suffix.lower() not in ARTIFACT_KINDS or not path.is_file():
+                    continue
+                relative = path.relative_to(self.root).as_posix()
+                metadata = known.get(relative) or infer_metadata(relative, self.root)
+                entries.append(
+                    artifact_entry(
+                        self.root, path, metadata.get("integrator"), metadata.get("country"), metadata.get("period")
+                    )
+                )
+            self._write_journal(entries)
+            return len(entries)
+
+    def _bootstrap(self):
+        """Scan a root that has artifacts from before the manifest existed, once."""
+        if self._file_id is not None or self.path.exists() or not self.root.is_dir():
+            return
+        if any(path.suffix.lower() in ARTIFACT_KINDS for path in self.root.rglob("*")):
+            self.rebuild()
+
+    def _write_journal(self, entries):
+        """Atomically replace the journal with one line per live entry."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_suffix(".tmp")
+        temp_path.write_text("".join(json.dumps(entry, sort_keys=True) + "\n" for entry in entries), encoding="utf-8")
+        temp_path.replace(self.path)
+        self._reset(None)
+        self._refresh()
+
+    def _refresh(self):
+        """Pick up journal changes: parse appended lines, or reload a replaced journal."""
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            if self._file_id is not None:
+                self._reset(None)
+            return
+        file_id = (stat.st_dev, stat.st_ino)
+        if file_id != self._file_id or stat.st_size < self._offset:
+            self._reset(file_id)
+        if stat.st_size == self._offset:
+            return
+
+        with open(self.path, "rb") as journal:
+            journal.seek(self._offset)
+            data = journal.read()
+        complete = data.rfind(b"\n") + 1  # a concurrent writer may have left a partial line
+        for line in data[:complete].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            self._entries[entry["path"]] = entry
+            self._lines += 1
+        self._offset += complete
+        self._listing = None
+        self._stats = None
+
+    def entries(self):
+        """All entries, newest first (cached until the journal changes)."""
+        with self._lock:
+            self._bootstrap()
+            self._refresh()
+            if self._listing is None:
+                self._listing = sorted(self._entries.values(), key=lambda entry: (-entry["mtime"], entry["path"]))
+            return self._listing
+
+    def query(self, kind=None, period=None, integrator=None, country=None, search=None, page=1, per_page=50):
+        """
+        Filtered, paginated listing (newest first).
+
+        Returns:
+            dict with items, total, page, per_page and pages
+        """
+        items = self.entries()
+        if kind:
+            items = [entry for entry in items if entry["kind"] == kind]
+        if period:
+            items = [entry for entry in items if entry.get("period") == period]
+        if integrator:
+            items = [entry for entry in items if entry.get("integrator") == integrator]
+        if country:
+            items = [entry for entry in items if entry.get("country") == country]
+        if search:
+            needle = search.lower()
+            items = [entry for entry in items if needle in entry["path"].lower()]
+
+        per_page = max(1, per_page)
+        pages = max(1, -(-len(items) // per_page))
+        page = min(max(1, page), pages)
+        start = (page - 1) * per_page
+        return {
+            "items": items[start:start + per_page],
+            "total": len(items),
+            "page": page,
+            "per_page": per_page,
+            "pages": pages,
+        }
+
+    def stats(self):
+        """Count, total size and newest mtime per kind (cached until the journal changes)."""
+        entries = self.entries()
+        with self._lock:
+            if self._stats is None:
+                stats = {}
+                for entry in entries:
+                    kind_stats = stats.setdefault(entry["kind"], {"count": 0, "size": 0, "last_mtime": 0})
+                    kind_stats["count"] += 1
+                    kind_stats["size"] += entry["size"]
+                    kind_stats["last_mtime"] = max(kind_stats["last_mtime"], entry["mtime"])
+                self._stats = stats
+            return self._stats
+
+    def facets(self):
+        """Distinct periods (newest first), integrators and countries, for filter menus."""
+        entries = self.entries()
+        return {
+            "periods": sorted({e["period"] for e in entries if e.get("period")}, key=period_sort_key, reverse=True),
+            "integrators": sorted({e["integrator"] for e in entries if e.get("integrator")}),
+            "countries": sorted({e["country"] for e in entries if e.get("country")}),
+        }
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark PDF invoice rendering for very large integrators.
+
+Renders synthetic invoices with 10k and 50k branches in large-invoice
+(chunked table) mode and reports per-invoice wall time and peak traced
+memory. Use --compare-single to also time the single-table layout (slow above
+a few thousand branches), and --renderers platypus canvas to time the
+low-level canvas renderer side by side with the platypus path.
+
+Usage: python benchmark_invoices.py [--sizes 10000 50000] [--compare-single]
+                                    [--renderers platypus canvas] [--repeat N]
+"""
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from generate_invoices import InvoiceGenerator
+
+
+ENTITY_IDS = ["TB_AE", "TB_KW", "TB_QA", "TB_BH", "TB_OM", "TB_JO", "HF_EG"]
+DELIVERY_TYPES = ["OWN_DELIVERY", "VENDOR_DELIVERY"]
+
+
+def synthetic_branches(count):
+    """Build a branch frame shaped like the deduplicated billing rows."""
+    return pd.DataFrame(
+        {
+            "vendor_code": range(600000, 600000 + count),
+            "Branch Name": [f"Synthetic Kitchen {i % 997}, District {i}" for i in range(count)],
+            "Delivery Type": [DELIVERY_TYPES[i % 2] for i in range(count)],
+            "Entity ID": [ENTITY_IDS[i % len(ENTITY_IDS)] for i in range(count)],
+        }
+    )
+
+
+def time_invoice(generator, branches_df, repeat=1):
+    """
+    Render the invoice `repeat` times; return (mean seconds, peak traced MB, PDF size in KB).
+
+    Timing runs are untraced (tracemalloc slows rendering several-fold); peak
+    memory comes from one extra traced render.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        pdf_path = generator.generate_invoice("Benchmark Integrator", branches_df, "September", 2025)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    generator.generate_invoice("Benchmark Integrator", branches_df, "September", 2025)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / (1024 * 1024), pdf_path.stat().st_size / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark large PDF invoice rendering.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000], help="Branch counts to render")
+    parser.add_argument("--compare-single", action="store_true", help="Also time the single-table layout")
+    parser.add_argument(
+        "--renderers", nargs="+", choices=InvoiceGenerator.RENDERERS, default=["platypus"],
+        help="Renderers to time side by side (default: platypus)",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="Invoices rendered per size and mode (time is averaged)")
+    args = parser.parse_args()
+
+    output_dir = tempfile.mkdtemp(prefix="invoice_bench_")
+    layouts = [("chunked", {})]
+    if args.compare_single:
+        layouts.append(("single", {"large_invoice_threshold": None}))
+    modes = [
+        (layout, renderer, InvoiceGenerator(output_dir, renderer=renderer, **options))
+        for layout, options in layouts
+        for renderer in args.renderers
+    ]
+
+    print(f"\n{'='*70}")
+    print("LARGE INVOICE BENCHMARK")
+    print(f"{'='*70}")
+    print(
+        f"{'Branches':>9} {'Layout':>8} {'Renderer':>9} {'s/invoice':>10} {'ms/branch':>10} "
+        f"{'Peak MB':>8} {'PDF KB':>7} {'Speedup':>8}"
+    )
+
+    for size in args.sizes:
+        branches_df = synthetic_branches(size)
+        baseline = {}
+        for layout, renderer, generator in modes:
+            elapsed, peak_mb, pdf_kb = time_invoice(generator, branches_df, args.repeat)
+            baseline.setdefault(layout, elapsed)
+            print(
+                f"{size:>9} {layout:>8} {renderer:>9} {elapsed:>10.3f} {elapsed * 1000 / max(size, 1):>10.3f} "
+                f"{peak_mb:>8.1f} {pdf_kb:>7.0f} {baseline[layout] / elapsed:>7.1f}x"
+            )
+
+    print(f"{'='*70}\n")
+
+
+if __name__ == "__main__":
+    main()
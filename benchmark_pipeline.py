@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Benchmark the billing pipeline stage by stage on synthetic exports.
+
+Generates source CSVs in the POS Dashboard export schema (10k, 100k and 1M
+rows by default) with a skewed integrator mix, near-duplicate branch names,
+mixed delivery types, Snap branches and block-listed names, then times each
+stage separately:
+
+    ingest      process_uploaded_csv
+    exclusions  apply_integrator_exclusions (per integrator)
+    dedup       BranchDeduplicator.deduplicate_branches (per integrator)
+    csv_export  write_partitioned_exports (all integrators and countries at once)
+    invoice     InvoiceGenerator.generate_invoice (per integrator)
+
+Each stage records wall time and the peak process RSS sampled while it ran.
+--traced-memory adds a second pass under tracemalloc for the peak memory each
+stage allocates on its own. That pass is roughly 10x slower, so it is only
+practical up to about 100k rows. Results are written as JSON; pass an earlier
+file with --compare to print the per-stage speedup against it.
+
+Usage: python benchmark_pipeline.py [--sizes 10000 100000 1000000] [--output results.json]
+                                    [--compare previous.json] [--invoice-limit N]
+                                    [--renderer platypus|canvas] [--traced-memory]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from generate_invoices import (
+    INTEGRATOR_RULES,
+    BranchDeduplicator,
+    InvoiceGenerator,
+    apply_integrator_exclusions,
+    get_exclusion_matcher,
+    process_uploaded_csv,
+    slugify,
+    write_partitioned_exports,
+)
+from run_metrics import RSSSampler
+
+
+STAGES = ["ingest", "exclusions", "dedup", "csv_export", "invoice"]
+
+SOURCE_COLUMNS = [
+    "Region", "Entity ID", "vendor_code", "Delivery Type", "remote_id", "Branch Name",
+    "Integration Name", "Integration Flow", "Chain ID", "Chain Name", "Activation date",
+    "GMV(eur)", "orders", "MENU API (request)", "Menu API(done)", "Menu API(failed)",
+]
+
+# Integrators in rough order of size in real exports; rows follow a Zipf-like skew over them
+INTEGRATORS = [
+    "TLBT GrubTech Plugin", "TLBT UrbanPiper Plugin", "TLBT-BySHWK-Plugin", "TLBT Kitopi Plugin -New",
+    "Tlbt-Americana-Digital", "gfs-pepper-prod-me", "TLBT-Qikserve", "TLBT-KFG-SelfIntegration",
+    "TLBT LimeTray", "TLBT Dimension Plugin", "Tlbt-Posist", "Wi-Q", "TLBT iiko Plugin",
+    "Simply Delivery Me", "Mcd UAE", "Tlbt-Ishbek", "Simply Delivery", "Mcd Kuwait", "Petpooja",
+    "TLBT Sapaad Plugin", "Tlbt-Lineten", "Mcd Bahrain", "Mcd Oman", "Tlbt-Orderking",
+]
+INTEGRATOR_SKEW = 1.1
+
+# Entity mix of real exports, plus KSA rows the ingest drops
+ENTITY_WEIGHTS = {
+    "TB_AE": 0.64, "TB_KW": 0.165, "HF_EG": 0.055, "TB_QA": 0.043, "TB_BH": 0.035,
+    "TB_OM": 0.024, "TB_JO": 0.018, "HS_SA": 0.02,
+}
+VENDOR_DELIVERY_SHARE = 0.12
+NEAR_DUPLICATE_SHARE = 0.12  # rows that repeat an earlier branch under a variant name
+SNAP_SHARE = 0.02
+BLOCKLISTED_SHARE = 0.005
+NO_INTEGRATION_SHARE = 0.01
+
+BRANDS = [
+    "McDonald's", "Burger Fuel", "Shake Shack", "Papa Kanafa", "Operation Falafel", "Al Baik",
+    "Zaatar w Zeit", "Pizza Hut", "Kitopi Kitchen", "Sushi Art", "Salt", "Five Guys", "Wingstop",
+    "Tim Hortons Express", "Starbucks", "Jollibee", "Texas Roadhouse", "Bait Maryam", "Al Reef Bakery",
+    "Manoushe Street", "Allo Beirut", "Nando's", "Chicken Tikka", "Hardee's", "Baskin Robbins",
+    "Krispy Kreme", "Paul", "Eataly", "Wagamama", "Taco Bell", "Subway", "Caribou Coffee",
+    "Hummus Bar", "Lebanese Corner", "Poke Bowl Co", "Bayt Al Shawarma", "Ravi Restaurant",
+    "Karak House", "Pinza", "Frying Pan", "Chili's", "Applebee's", "Burger King", "KFC",
+    "Cinnabon", "Dunkin", "Domino's", "Little Caesars", "Fuddruckers", "Tikka Hut",
+]
+DISTRICTS = [
+    "Al Barsha", "Jumeirah 1", "Al Warqa 1", "Deira", "Bur Dubai", "Dubai Marina", "JLT", "Al Qusais",
+    "Mirdif", "Al Nahda", "Karama", "Satwa", "Business Bay", "Downtown", "Al Khail", "Silicon Oasis",
+    "Sharjah Al Majaz", "Sharjah Al Taawun", "Ajman Corniche", "Abu Dhabi Khalidiya", "Mussafah",
+    "Al Ain", "Salmiya", "Hawally", "Jabriya", "Farwaniya", "Sabah Al Salem", "Mangaf", "Fintas",
+    "West Bay", "Al Sadd", "Al Wakra", "Juffair", "Seef", "Riffa", "Muharraq", "Qurum", "Al Khuwair",
+    "Seeb", "Abdoun", "Sweifieh", "Khalda", "Nasr City", "Maadi", "Zamalek", "Heliopolis",
+    "New Cairo", "Sheikh Zayed", "6th of October", "Dokki",
+]
+
+
+def _variant_name(name, kind):
+    """A near-duplicate spelling of a branch name (punctuation, case, order or suffix)."""
+    brand, _, district = name.partition(", ")
+    if kind == 0:
+        return f"{brand} - {district}"
+    if kind == 1:
+        return name.upper()
+    if kind == 2:
+        return f"{district}, {brand}"
+    if kind == 3:
+        return f"{brand} {district.replace(' ', '-')}"
+    return f"{name} Branch"
+
+
+def synthetic_source_frame(rows, seed=0):
+    """
+    A frame in the POS Dashboard export schema with realistic skew and noise.
+
+    About NEAR_DUPLICATE_SHARE of the rows repeat an earlier branch (same
+    vendor code, integrator and entity) under a variant name and sometimes the
+    other delivery type, so both the exact-key and fuzzy dedup passes have work.
+    """
+    rng = np.random.default_rng(seed)
+    base_rows = max(1, int(rows * (1 - NEAR_DUPLICATE_SHARE)))
+    duplicate_rows = rows - base_rows
+
+    integrator_weights = 1 / np.arange(1, len(INTEGRATORS) + 1) ** INTEGRATOR_SKEW
+    integrators = rng.choice(len(INTEGRATORS), size=base_rows, p=integrator_weights / integrator_weights.sum())
+    entity_ids = np.array(list(ENTITY_WEIGHTS))
+    entity_weights = np.array(list(ENTITY_WEIGHTS.values()))
+    entities = rng.choice(len(entity_ids), size=base_rows, p=entity_weights / entity_weights.sum())
+    brands = rng.integers(len(BRANDS), size=base_rows)
+    districts = rng.integers(len(DISTRICTS), size=base_rows)
+    names = [f"{BRANDS[b]}, {DISTRICTS[d]}" for b, d in zip(brands, districts)]
+    vendor_delivery = rng.random(base_rows) < VENDOR_DELIVERY_SHARE
+
+    # Snap branches and block-listed names exercise the integrator exclusion rules
+    for position in np.flatnonzero(rng.random(base_rows) < SNAP_SHARE):
+        names[position] = f"Snap Kitchen, {DISTRICTS[districts[position]]}"
+    blocklisted_names = sorted({name for rule in get_exclusion_matcher().rules for name in rule["exact"]})
+    for position in np.flatnonzero(rng.random(base_rows) < BLOCKLISTED_SHARE):
+        names[position] = blocklisted_names[position % len(blocklisted_names)]
+
+    # Near duplicates of earlier rows
+    sources = rng.integers(base_rows, size=duplicate_rows)
+    variants = rng.integers(5, size=duplicate_rows)
+    flip_delivery = rng.random(duplicate_rows) < 0.5
+    positions = np.concatenate([np.arange(base_rows), sources])
+    all_names = names + [_variant_name(names[s], v) for s, v in zip(sources, variants)]
+    delivery = np.concatenate([vendor_delivery, vendor_delivery[sources] ^ flip_delivery])
+
+    integration_names = np.array(INTEGRATORS, dtype=object)[integrators[positions]]
+    integration_names[rng.random(rows) < NO_INTEGRATION_SHARE] = ""
+
+    frame = pd.DataFrame(
+        {
+            "Region": "mena",
+            "Entity ID": entity_ids[entities[positions]],
+            "vendor_code": 600000 + positions,
+            "Delivery Type": np.where(delivery, "VENDOR_DELIVERY", "OWN_DELIVERY"),
+            "remote_id": (1800000 + rng.integers(1_000_000, size=rows)).astype(str),
+            "Branch Name": all_names,
+            "Integration Name": integration_names,
+            "Integration Flow": np.where(rng.random(rows) < 0.06, "INDIRECT", "DIRECT"),
+            "Chain ID": 600000 + brands[positions],
+            "Chain Name": np.array(BRANDS, dtype=object)[brands[positions]],
+            "Activation date": "Jan 1, 2024",
+            "GMV(eur)": rng.gamma(2.0, 5000.0, size=rows).round(2),
+            "orders": rng.integers(0, 30000, size=rows),
+            "MENU API (request)": rng.integers(0, 200, size=rows),
+            "Menu API(done)": rng.integers(0, 200, size=rows),
+            "Menu API(failed)": rng.integers(0, 5, size=rows),
+        },
+        columns=SOURCE_COLUMNS,
+    )
+    return frame.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def synthetic_source_csv(rows, data_dir, seed=0):
+    """Write (or reuse) the synthetic export for `rows` rows; return its path."""
+    path = Path(data_dir) / f"synthetic_{rows}_{seed}.csv"
+    if not path.exists():
+        temp_path = path.with_suffix(".tmp")
+        synthetic_source_frame(rows, seed).to_csv(temp_path, index=False)
+        temp_path.replace(path)
+    return path
+
+
+class StageRecorder:
+    """Accumulates wall time, calls, row counts and peak memory per stage."""
+
+    def __init__(self, trace=False):
+        """
+        Args:
+            trace: Record the peak tracemalloc allocation per stage (tracemalloc
+                must be running) instead of the sampled RSS
+        """
+        self.trace = trace
+        self.stages = {name: {"seconds": 0.0, "calls": 0} for name in STAGES}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        record = self.stages[name]
+        if self.trace:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            sampler = contextlib.nullcontext()
+        else:
+            sampler = RSSSampler()
+        start = time.perf_counter()
+        try:
+            with sampler:
+                yield record
+        finally:
+            record["seconds"] += time.perf_counter() - start
+            record["calls"] += 1
+            if self.trace:
+                peak = (tracemalloc.get_traced_memory()[1] - baseline) / (1024 * 1024)
+                record["traced_peak_mb"] = max(record.get("traced_peak_mb", 0.0), peak)
+            else:
+                record["peak_rss_mb"] = max(record.get("peak_rss_mb", 0.0), sampler.peak_mb)
+
+    @staticmethod
+    def add(record, **counts):
+        for key, value in counts.items():
+            record[key] = record.get(key, 0) + value
+
+
+def run_pipeline_stages(csv_path, output_dir, trace=False, invoice_limit=None, renderer="platypus"):
+    """
+    Run every stage over one source CSV, the way process_csv_and_generate_invoices does.
+
+    Args:
+        csv_path: Source CSV
+        output_dir: Scratch folder for the CSV exports and PDFs
+        trace: Measure peak traced allocations per stage instead of RSS (slow)
+        invoice_limit: Render invoices for at most this many integrators (largest first)
+        renderer: InvoiceGenerator renderer
+
+    Returns:
+        dict of stage name to its record
+    """
+    recorder = StageRecorder(trace)
+    deduplicator = BranchDeduplicator(similarity_threshold=85)
+    (Path(output_dir) / "invoices").mkdir(parents=True, exist_ok=True)
+    generator = InvoiceGenerator(Path(output_dir) / "invoices", renderer=renderer)
+
+    with open(csv_path, encoding="utf-8") as source:
+        source_rows = sum(1 for _ in source) - 1  # synthetic names never contain newlines
+
+    # The pipeline's console output is not part of the measurement
+    with contextlib.redirect_stdout(io.StringIO()):
+        with recorder.stage("ingest") as record:
+            df = process_uploaded_csv(csv_path)
+            recorder.add(record, rows_in=source_rows, rows_out=len(df))
+
+        # Only integrators with billing rules are exported, as in the real run (not timed: one isin)
+        df = df[df["IntegratorSlug"].isin(list(INTEGRATOR_RULES.keys()))]
+
+        deduped = []
+        for integrator_name, integrator_df in df.groupby("Integration Name", sort=True, observed=True):
+            rules = INTEGRATOR_RULES.get(slugify(integrator_name), set())
+            with recorder.stage("exclusions") as record:
+                filtered_df = apply_integrator_exclusions(integrator_df, integrator_name, rules)
+                recorder.add(record, rows_in=len(integrator_df), rows_out=len(filtered_df))
+            if filtered_df.empty:
+                continue
+
+            with recorder.stage("dedup") as record:
+                deduped_df = deduplicator.deduplicate_branches(filtered_df, ignore_delivery_type="grubtech" in rules)
+                recorder.add(record, rows_in=len(filtered_df), rows_out=len(deduped_df))
+
+            deduped.append((integrator_name, deduped_df))
+
+        if deduped:
+            with recorder.stage("csv_export") as record:
+                cleaned_df = pd.concat([deduped_df for _, deduped_df in deduped])
+                partitions = write_partitioned_exports(cleaned_df, Path(output_dir) / "exports", [("September", 2025)])
+                recorder.add(
+                    record,
+                    rows_in=len(cleaned_df),
+                    files=len(partitions),
+                    bytes=sum(partition["bytes"] for partition in partitions),
+                )
+
+        deduped.sort(key=lambda item: len(item[1]), reverse=True)
+        for integrator_name, deduped_df in deduped[:invoice_limit]:
+            with recorder.stage("invoice") as record:
+                path = generator.generate_invoice(integrator_name, deduped_df, "September", 2025)
+                recorder.add(record, rows_in=len(deduped_df), files=1, bytes=path.stat().st_size)
+
+    return recorder.stages
+
+
+def benchmark_size(rows, data_dir, traced_memory, invoice_limit, renderer, seed=0):
+    """Timed (and optionally traced) runs for one source size; returns the JSON record."""
+    csv_path = synthetic_source_csv(rows, data_dir, seed)
+    scratch = tempfile.mkdtemp(prefix="pipeline_bench_")
+    try:
+        stages = run_pipeline_stages(csv_path, Path(scratch) / "timed", False, invoice_limit, renderer)
+        if traced_memory:
+            tracemalloc.start()
+            try:
+                traced = run_pipeline_stages(csv_path, Path(scratch) / "traced", True, invoice_limit, renderer)
+            finally:
+                tracemalloc.stop()
+            for name, record in traced.items():
+                stages[name]["traced_peak_mb"] = round(record.get("traced_peak_mb", 0.0), 2)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    for record in stages.values():
+        record["seconds"] = round(record["seconds"], 4)
+        if "peak_rss_mb" in record:
+            record["peak_rss_mb"] = round(record["peak_rss_mb"], 1)
+    return {
+        "rows": rows,
+        "source_bytes": csv_path.stat().st_size,
+        "total_seconds": round(sum(record["seconds"] for record in stages.values()), 4),
+        "stages": stages,
+    }
+
+
+def print_results(results, baseline=None):
+    """Console table of per-stage times, with the speedup against a baseline run if given."""
+    baseline_runs = {run["rows"]: run for run in (baseline or {}).get("runs", [])}
+    print(f"\n{'='*87}")
+    print("PIPELINE BENCHMARK")
+    print(f"{'='*87}")
+    print(
+        f"{'Rows':>9} {'Stage':>11} {'Seconds':>9} {'Rows in':>9} {'Rows out':>9} "
+        f"{'RSS MB':>8} {'Alloc MB':>8} {'vs base':>8}"
+    )
+    for run in results["runs"]:
+        base_stages = baseline_runs.get(run["rows"], {}).get("stages", {})
+        for name in STAGES + ["total"]:
+            record = run["stages"].get(name) if name != "total" else {"seconds": run["total_seconds"]}
+            base = base_stages.get(name) if name != "total" else baseline_runs.get(run["rows"], {}).get("total_seconds")
+            base_seconds = base.get("seconds") if isinstance(base, dict) else base
+            speedup = f"{base_seconds / record['seconds']:.2f}x" if base_seconds and record["seconds"] else "-"
+            rss = f"{record['peak_rss_mb']:.0f}" if "peak_rss_mb" in record else "-"
+            traced = f"{record['traced_peak_mb']:.1f}" if "traced_peak_mb" in record else "-"
+            print(
+                f"{run['rows']:>9} {name:>11} {record['seconds']:>9.3f} {record.get('rows_in', ''):>9} "
+                f"{record.get('rows_out', ''):>9} {rss:>8} {traced:>8} {speedup:>8}"
+            )
+    print(f"{'='*87}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the billing pipeline stage by stage.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Source rows")
+    parser.add_argument("--output", default="benchmark_pipeline.json", help="JSON results file")
+    parser.add_argument("--compare", help="Earlier JSON results to compare against")
+    parser.add_argument("--data-dir", default=None, help="Where synthetic CSVs are kept (reused between runs)")
+    parser.add_argument("--seed", type=int, default=0, help="Synthetic data seed")
+    parser.add_argument("--invoice-limit", type=int, default=None, help="Render invoices for the N largest integrators only")
+    parser.add_argument("--renderer", choices=InvoiceGenerator.RENDERERS, default="platypus", help="Invoice renderer")
+    parser.add_argument(
+        "--traced-memory", action="store_true",
+        help="Add a tracemalloc pass for per-stage allocation peaks (about 10x slower)",
+    )
+    args = parser.parse_args()
+
+    data_dir = Path(args.data_dir or Path(tempfile.gettempdir()) / "pos_billing_bench")
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    results = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "config": {
+            "seed": args.seed,
+            "invoice_limit": args.invoice_limit,
+            "renderer": args.renderer,
+            "traced_memory": args.traced_memory,
+        },
+        "runs": [],
+    }
+    for rows in args.sizes:
+        print(f"⏱️  {rows} rows...")
+        results["runs"].append(
+            benchmark_size(rows, data_dir, args.traced_memory, args.invoice_limit, args.renderer, args.seed)
+        )
+
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_results(results, baseline)
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    print(f"📊 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+In-process background jobs for the dashboard.
+
+Billing runs and bulk email sends are queued on a small thread pool so
+/generate and /email/bulk can return a job ID immediately. Each job keeps an
+append-only list of progress events that the /jobs/<id> status endpoint
+summarises and the Server-Sent Events stream replays. Jobs are keyed (billing
+runs by period): submitting a key that already has a queued or running job
+returns that job instead of starting another.
+"""
+
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+JOB_WORKERS = 2  # concurrent billing runs (different periods)
+JOB_HISTORY_LIMIT = 50  # finished jobs kept for status lookups
+SSE_KEEPALIVE_SECONDS = 15
+
+ACTIVE_STATUSES = ("queued", "running")
+PROGRESS_STAGES = ("integrator", "recipient")  # per-item events; the stage names the item field
+
+
+class BillingJob:
+    """One queued billing run and its progress events."""
+
+    def __init__(self, key, description):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.description = description
+        self.status = "queued"
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.events = []
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status not in ACTIVE_STATUSES
+
+    def publish(self, event):
+        """Append a progress event (a JSON-serialisable dict) and wake stream readers."""
+        with self._changed:
+            self.events.append(dict(event, at=datetime.now().isoformat(timespec="seconds")))
+            self._changed.notify_all()
+
+    def _set_status(self, status, **fields):
+        with self._changed:
+            self.status = status
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self._changed.notify_all()
+
+    def wait_for_events(self, after, timeout):
+        """Block until there are events past index `after` or the job finishes; return (events, finished)."""
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.events) > after or self.finished, timeout=timeout)
+            return self.events[after:], self.finished
+
+    def to_dict(self):
+        """Status snapshot for the /jobs/<id> endpoint."""
+        with self._changed:
+            progress = next(
+                (event for event in reversed(self.events) if event.get("stage") in PROGRESS_STAGES),
+                None,
+            )
+            started = next((event for event in self.events if event.get("stage") == "started"), None)
+            return {
+                "job_id": self.id,
+                "description": self.description,
+                "status": self.status,
+                "created_at": self.created_at.isoformat(timespec="seconds"),
+                "started_at": self.started_at.isoformat(timespec="seconds") if self.started_at else None,
+                "finished_at": self.finished_at.isoformat(timespec="seconds") if self.finished_at else None,
+                "done": progress["done"] if progress else 0,
+                "total": started["total"] if started else None,
+                "current": progress[progress["stage"]] if progress else None,
+                "result": self.result,
+                "error": self.error,
+            }
+
+
+class BillingJobQueue:
+    """Thread-pool job runner with per-key coalescing and a bounded job history."""
+
+    def __init__(self, max_workers=JOB_WORKERS, history_limit=JOB_HISTORY_LIMIT):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="billing-job")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._active = {}
+        self.history_limit = history_limit
+
+    def submit(self, key, description, run):
+        """
+        Queue run(job) unless a job with the same key is still queued or running.
+
+        Args:
+            key: Coalescing key, e.g. "2025_september" (billing_period_label)
+            description: Human-readable label shown in status responses
+            run: Callable taking the BillingJob; its return value becomes job.result
+                and it can report progress with job.publish(...)
+
+        Returns:
+            (job, created) - created is False when an active job was reused
+        """
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None and not job.finished:
+                return job, False
+            job = BillingJob(key, description)
+            self._jobs[job.id] = job
+            self._active[key] = job
+            self._prune()
+        self._executor.submit(self._run, job, run)
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, run):
+        job._set_status("running", started_at=datetime.now())
+        try:
+            result = run(job)
+        except Exception as e:
+            job._set_status("failed", error=str(e), finished_at=datetime.now())
+        else:
+            job._set_status("succeeded", result=result, finished_at=datetime.now())
+        finally:
+            with self._lock:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+
+    def _prune(self):
+        """Drop the oldest finished jobs beyond history_limit (active jobs are always kept)."""
+        excess = len(self._jobs) - self.history_limit
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:max(excess, 0)]:
+            del self._jobs[job_id]
+
+
+def sse_stream(job, last_event_id=None, keepalive=SSE_KEEPALIVE_SECONDS):
+    """
+    Yield Server-Sent Events for a job: one "progress" event per published
+    event (ids are event indexes, so reconnects resume via Last-Event-ID),
+    comment keepalives while idle, and a final "done" event with the status.
+    """
+    position = 0
+    if last_event_id is not None:
+        try:
+            position = int(last_event_id) + 1
+        except ValueError:
+            position = 0
+
+    while True:
+        events, finished = job.wait_for_events(position, keepalive)
+        for event in events:
+            yield f"id: {position}\nevent: progress\ndata: {json.dumps(event)}\n\n"
+            position += 1
+        if finished and not events:
+            yield f"event: done\ndata: {json.dumps(job.to_dict())}\n\n"
+            return
+        if not events:
+            yield ": keepalive\n\n"
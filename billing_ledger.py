@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Ledger of billed branches per month, in a local SQLite file.
+
+Every billing run records the rows of each integrator's export CSVs in
+exports/.billing_ledger.sqlite3, one row per billed branch per period. A
+re-run replaces an integrator's rows for that period, so the ledger always
+matches the latest exports. The table is indexed on period, integrator,
+country, vendor_code and remote_id. Questions like "when did vendor 677011
+start being billed to Mcd Kuwait?" are then answered from an index instead of
+by parsing every CSV under exports/.
+
+Export trees written before the ledger existed are imported with
+
+    python billing_ledger.py backfill [exports_dir]
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+from artifact_manifest import period_sort_key
+
+
+LEDGER_FILENAME = ".billing_ledger.sqlite3"
+SQLITE_TIMEOUT_SECONDS = 30
+DEFAULT_QUERY_LIMIT = 1000
+
+# Export CSV column -> ledger column
+LEDGER_COLUMNS = {
+    "Integration Name": "integrator",
+    "Country": "country",
+    "Entity ID": "entity_id",
+    "vendor_code": "vendor_code",
+    "remote_id": "remote_id",
+    "Branch Name": "branch_name",
+    "Chain ID": "chain_id",
+    "Chain Name": "chain_name",
+    "Delivery Type": "delivery_type",
+}
+LEDGER_FIELDS = ["period", "period_key", *LEDGER_COLUMNS.values()]
+
+
+def period_key(period):
+    """Sortable integer for a period label, e.g. 202509 for "2025_september"."""
+    year, month, _ = period_sort_key(period)
+    if not year or not month:
+        raise ValueError(f"Unrecognised billing period label: {period!r} (expected e.g. 2025_september)")
+    return year * 100 + month
+
+
+def _sql_value(value):
+    """Plain Python value for SQLite (missing values become NULL)."""
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+class BillingLedger:
+    """Indexed SQLite store of the branches billed per period, integrator and country."""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: SQLite file (created on first use)
+        """
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def __getstate__(self):
+        # Worker processes open their own connection
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _connect(self):
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT_SECONDS, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS billed_branches ("
+                    " period TEXT NOT NULL, period_key INTEGER NOT NULL, integrator TEXT NOT NULL,"
+                    " country TEXT, entity_id TEXT, vendor_code INTEGER, remote_id TEXT, branch_name TEXT,"
+                    " chain_id INTEGER, chain_name TEXT, delivery_type TEXT)"
+                )
+                for name, columns in (
+                    ("period", "period, integrator"),
+                    ("integrator", "integrator, period_key"),
+                    ("country", "country, period_key"),
+                    ("vendor_code", "vendor_code, period_key"),
+                    ("remote_id", "remote_id, period_key"),
+                ):
+                    connection.execute(
+                        f"CREATE INDEX IF NOT EXISTS billed_branches_{name} ON billed_branches ({columns})"
+                    )
+            self._connection = connection
+        return self._connection
+
+    def replace_integrator_period(self, period, integrator, branches_df):
+        """
+        Make branches_df (export rows of one integrator, every country) the
+        ledger's rows for that integrator and period. Returns the rows written.
+
+        Raises:
+            ValueError: period is not a billing period label
+        """
+        key = period_key(period)
+        columns = [column for column in LEDGER_COLUMNS if column in branches_df.columns]
+        values = branches_df.loc[:, columns].rename(columns=LEDGER_COLUMNS).assign(integrator=integrator)
+        missing = {field: None for field in LEDGER_FIELDS if field not in values.columns}
+        rows = [
+            {**missing, "period": period, "period_key": key,
+             **{column: _sql_value(value) for column, value in zip(values.columns, row)}}
+            for row in values.itertuples(index=False, name=None)
+        ]
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "DELETE FROM billed_branches WHERE period = ? AND integrator = ?", (period, integrator)
+                )
+                connection.executemany(
+                    f"INSERT INTO billed_branches ({', '.join(LEDGER_FIELDS)})"
+                    f" VALUES ({', '.join(':' + field for field in LEDGER_FIELDS)})",
+                    rows,
+                )
+        return len(rows)
+
+    def _select(self, sql, params):
+        with self._lock:
+            return [dict(row) for row in self._connect().execute(sql, params).fetchall()]
+
+    @staticmethod
+    def _where(period=None, integrator=None, country=None, vendor_code=None, remote_id=None):
+        clauses = []
+        params = []
+        for column, value in (
+            ("period", period),
+            ("integrator", integrator),
+            ("country", country),
+            ("vendor_code", None if vendor_code is None else int(vendor_code)),
+            ("remote_id", None if remote_id is None else str(remote_id)),
+        ):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, period=None, integrator=None, country=None, vendor_code=None, remote_id=None,
+              limit=DEFAULT_QUERY_LIMIT):
+        """Billed branch rows matching every given filter, oldest period first."""
+        where, params = self._where(period, integrator, country, vendor_code, remote_id)
+        return self._select(
+            f"SELECT {', '.join(LEDGER_FIELDS)} FROM billed_branches{where}"
+            " ORDER BY period_key, integrator, country, branch_name, vendor_code LIMIT ?",
+            [*params, int(limit)],
+        )
+
+    def first_billed(self, vendor_code=None, remote_id=None, integrator=None):
+        """
+        First and last period each matching branch was billed, per integrator
+        and vendor code, with the number of periods it was billed in.
+        """
+        where, params = self._where(
+            integrator=integrator, vendor_code=vendor_code, remote_id=remote_id
+        )
+        rows = self._select(
+            "SELECT integrator, vendor_code, MIN(period_key) AS first_key, MAX(period_key) AS last_key,"
+            " COUNT(DISTINCT period) AS periods FROM billed_branches"
+            f"{where} GROUP BY integrator, vendor_code ORDER BY first_key, integrator, vendor_code",
+            params,
+        )
+        labels = self.periods()
+        by_key = {period_key(label): label for label in labels}
+        for row in rows:
+            row["first_period"] = by_key.get(row.pop("first_key"))
+            row["last_period"] = by_key.get(row.pop("last_key"))
+        return rows
+
+    def summary(self, period=None, integrator=None, country=None):
+        """Billed branch counts per period, integrator and country, newest period first."""
+        where, params = self._where(period, integrator, country)
+        return self._select(
+            "SELECT period, integrator, country, COUNT(*) AS branches FROM billed_branches"
+            f"{where} GROUP BY period_key, period, integrator, country"
+            " ORDER BY period_key DESC, integrator, country",
+            params,
+        )
+
+    def billed_integrators(self, period):
+        """Integrators with rows in the ledger for a period."""
+        return {
+            row["integrator"] for row in self._select(
+                "SELECT DISTINCT integrator FROM billed_branches WHERE period = ?", [period]
+            )
+        }
+
+    def periods(self):
+        """Distinct periods in the ledger, newest first."""
+        return [
+            row["period"] for row in self._select(
+                "SELECT period FROM billed_branches GROUP BY period ORDER BY MAX(period_key) DESC", []
+            )
+        ]
+
+    def backfill(self, exports_dir):
+        """
+        Import an existing export tree (<period>/<integrator>/*.csv). Each
+        integrator's rows for a period replace whatever the ledger had for it.
+
+        Returns:
+            dict with periods, integrators and rows imported
+        """
+        files = {}
+        for path in sorted(Path(exports_dir).glob("*/*/*.csv")):
+            period = path.parts[-3]
+            if period_sort_key(period)[1]:  # skip folders that aren't billing periods
+                files.setdefault((period, path.parent.name), []).append(path)
+
+        stats = {"periods": len({period for period, _ in files}), "integrators": 0, "rows": 0}
+        for (period, _), paths in files.items():
+            frames = [
+                pd.read_csv(path, dtype={"Entity ID": str, "remote_id": str, "vendor_code": "Int64", "Chain ID": "Int64"})
+                for path in paths
+            ]
+            frames = [frame for frame in frames if not frame.empty and "Integration Name" in frame.columns]
+            if not frames:
+                continue
+            branches_df = pd.concat(frames, ignore_index=True)
+            for integrator, integrator_df in branches_df.groupby("Integration Name", sort=True):
+                stats["integrators"] += 1
+                stats["rows"] += self.replace_integrator_period(period, integrator, integrator_df)
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+if __name__ == "__main__":
+    default_exports = Path(__file__).parent / "exports"
+
+    parser = argparse.ArgumentParser(description="Billing ledger of per-month billed branches.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subcommands.add_parser("backfill", help="Import an existing export tree into the ledger")
+    backfill_parser.add_argument("exports_dir", nargs="?", default=default_exports, type=Path)
+    history_parser = subcommands.add_parser("history", help="First and last period a vendor was billed")
+    history_parser.add_argument("vendor_code", type=int)
+    history_parser.add_argument("--integrator")
+    history_parser.add_argument("--exports-dir", default=default_exports, type=Path)
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        ledger = BillingLedger(args.exports_dir / LEDGER_FILENAME)
+        stats = ledger.backfill(args.exports_dir)
+        print(
+            f"📒 Imported {stats['rows']} billed branches for {stats['integrators']} integrator-periods "
+            f"across {stats['periods']} periods into {ledger.path}"
+        )
+    else:
+        ledger = BillingLedger(args.exports_dir / LEDGER_FILENAME)
+        print(json.dumps(ledger.first_billed(args.vendor_code, integrator=args.integrator), indent=2))
+    ledger.close()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Bulk invoice email delivery.
+
+Month-end distribution sends one or more messages per recipient over a small
+pool of reused SMTP connections, with a bounded number of concurrent sends.
+A recipient's attachments are split across several messages ("part 1 of 3")
+once a size cap is reached, so large invoice sets stay under provider message
+limits. Attachments are read from disk when their message is built, so at
+most `workers` messages are held in memory at a time.
+
+Only the standard library is used, so the mailer can be run against any SMTP
+server, including a local stand-in (test_bulk_mailer.py runs one in-process):
+
+    python -m aiosmtpd -n -l localhost:1025   # pip install aiosmtpd
+    python bulk_mailer.py --server localhost --port 1025 \\
+        --sender billing@example.com --to ops@example.com invoices/*.pdf
+"""
+
+import argparse
+import contextlib
+import mimetypes
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+from pathlib import Path
+
+
+BULK_EMAIL_WORKERS = 4
+# Attachment bytes per message; base64 adds about a third, which keeps
+# messages under the common 25 MB provider limit
+MAX_MESSAGE_ATTACHMENT_BYTES = 15 * 1024 * 1024
+SMTP_TIMEOUT_SECONDS = 60
+
+# Errors after which a pooled connection is dropped and the send retried once
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+# Rejections of one message; the session itself stays usable
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def split_attachments(paths, max_bytes=MAX_MESSAGE_ATTACHMENT_BYTES):
+    """
+    Group attachment paths into per-message batches of at most max_bytes
+    (in order; a single file above the cap gets a message of its own).
+
+    Returns:
+        List of lists of Paths
+    """
+    batches = []
+    current = []
+    current_bytes = 0
+    for path in map(Path, paths):
+        size = path.stat().st_size
+        if current and current_bytes + size > max_bytes:
+            batches.append(current)
+            current = []
+            current_bytes = 0
+        current.append(path)
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+class SMTPConnectionPool:
+    """Reusable SMTP sessions, created on demand and shared by the send workers."""
+
+    def __init__(self, server, port, use_tls=False, use_ssl=False, username=None, password=None,
+                 timeout=SMTP_TIMEOUT_SECONDS):
+        self.server = server
+        self.port = port
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0  # sessions opened over the pool's lifetime
+
+    def _connect(self):
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        host = smtp_class(self.server, self.port, timeout=self.timeout)
+        if self.use_tls:
+            host.starttls()
+        if self.username and self.password:
+            host.login(self.username, self.password)
+        with self._lock:
+            self.opened += 1
+        return host
+
+    @contextlib.contextmanager
+    def connection(self, fresh=False):
+        """
+        Borrow an idle session (or open one); it goes back to the pool unless the session broke.
+
+        With fresh=True a new session is always opened, e.g. to retry after an
+        idle one turned out to be closed (the other idle ones may be as well).
+        """
+        host = None
+        if not fresh:
+            with self._lock:
+                host = self._idle.pop() if self._idle else None
+        if host is None:
+            host = self._connect()
+        try:
+            yield host
+        except MESSAGE_ERRORS:
+            with self._lock:
+                self._idle.append(host)
+            raise
+        except BaseException:
+            with contextlib.suppress(Exception):
+                host.close()
+            raise
+        with self._lock:
+            self._idle.append(host)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for host in idle:
+            with contextlib.suppress(Exception):
+                host.quit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BulkMailer:
+    """Sends invoice deliveries concurrently over an SMTPConnectionPool."""
+
+    def __init__(self, pool, sender, workers=BULK_EMAIL_WORKERS, max_attachment_bytes=MAX_MESSAGE_ATTACHMENT_BYTES):
+        """
+        Args:
+            pool: SMTPConnectionPool the messages are sent through
+            sender: From address
+            workers: Messages sent concurrently (and SMTP sessions opened at most)
+            max_attachment_bytes: Attachment bytes per message before splitting
+        """
+        self.pool = pool
+        self.sender = sender
+        self.workers = max(1, workers)
+        self.max_attachment_bytes = max_attachment_bytes
+
+    def build_message(self, recipient, subject, body, attachments):
+        """EmailMessage with the given attachment paths read from disk."""
+        message = EmailMessage()
+        message["Subject"] = subject
+        message["From"] = self.sender
+        message["To"] = recipient
+        message["Date"] = formatdate(localtime=True)
+        message["Message-ID"] = make_msgid()
+        message.set_content(body)
+        for path in attachments:
+            content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            maintype, subtype = content_type.split("/", 1)
+            message.add_attachment(path.read_bytes(), maintype=maintype, subtype=subtype, filename=path.name)
+        return message
+
+    def _send_part(self, delivery, part, parts, attachments):
+        subject = delivery["subject"]
+        if parts > 1:
+            subject = f"{subject} (part {part} of {parts})"
+        message = self.build_message(delivery["recipient"], subject, delivery["body"], attachments)
+        try:
+            with self.pool.connection() as host:
+                host.send_message(message)
+        except RECONNECT_ERRORS:
+            # The pooled session was closed by the server; retry once on a new one
+            with self.pool.connection(fresh=True) as host:
+                host.send_message(message)
+
+    def send(self, deliveries, progress=None):
+        """
+        Send every delivery and report per-recipient status.
+
+        Args:
+            deliveries: Iterable of dicts with recipient, subject, body and
+                attachments (paths)
+            progress: Optional callable, called with {"stage": "recipient",
+                "recipient", "status", "done", "total"} as each recipient finishes
+
+        Returns:
+            List of dicts (in delivery order) with recipient, status ("sent",
+            "partial" or "failed"), messages, sent, attachments, bytes and errors
+        """
+        deliveries = list(deliveries)
+        results = []
+        parts = []
+        for delivery in deliveries:
+            result = {
+                "recipient": delivery["recipient"],
+                "status": "failed",
+                "messages": 0,
+                "sent": 0,
+                "attachments": len(delivery["attachments"]),
+                "bytes": 0,
+                "errors": [],
+            }
+            results.append(result)
+            try:
+                batches = split_attachments(delivery["attachments"], self.max_attachment_bytes) or [[]]
+            except OSError as e:
+                result["errors"].append(str(e))
+                continue
+            result["messages"] = len(batches)
+            result["bytes"] = sum(path.stat().st_size for batch in batches for path in batch)
+            for part, batch in enumerate(batches, start=1):
+                parts.append((delivery, result, part, len(batches), batch))
+
+        lock = threading.Lock()
+        pending = {id(result): result["messages"] for result in results}
+        done = sum(1 for result in results if not result["messages"])
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bulk-mail") as pool:
+            futures = {
+                pool.submit(self._send_part, delivery, part, total_parts, batch): (result, part)
+                for delivery, result, part, total_parts, batch in parts
+            }
+            for future in as_completed(futures):
+                result, part = futures[future]
+                with lock:
+                    try:
+                        future.result()
+                        result["sent"] += 1
+                    except Exception as e:
+                        result["errors"].append(f"part {part}: {e}")
+                    pending[id(result)] -= 1
+                    if pending[id(result)]:
+                        continue
+                    result["status"] = (
+                        "sent" if result["sent"] == result["messages"] else "partial" if result["sent"] else "failed"
+                    )
+                    done += 1
+                if progress is not None:
+                    progress({
+                        "stage": "recipient",
+                        "recipient": result["recipient"],
+                        "status": result["status"],
+                        "done": done,
+                        "total": len(results),
+                    })
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Email files to one or more recipients in size-capped messages.")
+    parser.add_argument("files", nargs="+", help="Attachments (e.g. invoices/*.pdf)")
+    parser.add_argument("--to", action="append", required=True, help="Recipient (repeat for several)")
+    parser.add_argument("--sender", required=True, help="From address")
+    parser.add_argument("--server", default="localhost", help="SMTP server (default: localhost)")
+    parser.add_argument("--port", type=int, default=1025, help="SMTP port (default: 1025)")
+    parser.add_argument("--tls", action="store_true", help="Use STARTTLS")
+    parser.add_argument("--username", help="SMTP username")
+    parser.add_argument("--password", help="SMTP password")
+    parser.add_argument("--workers", type=int, default=BULK_EMAIL_WORKERS, help="Concurrent sends")
+    parser.add_argument(
+        "--max-mb", type=float, default=MAX_MESSAGE_ATTACHMENT_BYTES / (1024 * 1024),
+        help="Attachment MB per message before splitting",
+    )
+    parser.add_argument("--subject", default="POS Integration Invoices", help="Message subject")
+    args = parser.parse_args()
+
+    with SMTPConnectionPool(args.server, args.port, use_tls=args.tls, username=args.username,
+                            password=args.password) as smtp_pool:
+        mailer = BulkMailer(smtp_pool, args.sender, args.workers, int(args.max_mb * 1024 * 1024))
+        results = mailer.send(
+            {
+                "recipient": recipient,
+                "subject": args.subject,
+                "body": f"Please find attached {len(args.files)} file(s).",
+                "attachments": args.files,
+            }
+            for recipient in args.to
+        )
+
+    for result in results:
+        icon = "✅" if result["status"] == "sent" else "⚠️" if result["status"] == "partial" else "❌"
+        print(f"{icon} {result['recipient']}: {result['sent']}/{result['messages']} message(s), "
+              f"{result['attachments']} attachment(s), {result['bytes'] / 1024:.0f} KB")
+        for error in result["errors"]:
+            print(f"    - {error}")
+    print(f"SMTP sessions opened: {smtp_pool.opened}")
@@ -4,15 +4,23 @@ POS Billing Dashboard - Web Interface
 A simple Flask web application for managing invoices
 """
 
-from flask import Flask, render_template, send_file, request, jsonify, redirect, url_for, flash
+from flask import Flask, Response, render_template, send_file, request, jsonify, redirect, url_for, flash
 from flask_mail import Mail, Message
+from werkzeug.utils import secure_filename
 import os
 from pathlib import Path
 import pandas as pd
 from datetime import datetime
-import zipfile
-import io
-from generate_invoices import process_csv_and_generate_invoices, InvoiceGenerator
+from generate_invoices import (
+    process_csv_and_generate_invoices, load_source_frame, billing_period_label, InvoiceGenerator, OUTPUT_DIR
+)
+from billing_jobs import BillingJobQueue, sse_stream
+from artifact_manifest import ArtifactManifest
+from artifact_archives import ARCHIVE_NAMES, archive_files, current_period_archive, iter_zip
+from bulk_mailer import BulkMailer, SMTPConnectionPool, BULK_EMAIL_WORKERS, MAX_MESSAGE_ATTACHMENT_BYTES
+from run_metrics import RUN_HISTORY_LIMIT, RUN_METRICS_FILENAME, load_run_records
+from billing_ledger import DEFAULT_QUERY_LIMIT, LEDGER_FILENAME, BillingLedger
+from source_upload import UploadError, receive_source_upload
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'  # Change this in production
@@ -25,102 +33,241 @@ app.config['MAIL_USERNAME'] = 'your-email@gmail.com'  # Update this
 app.config['MAIL_PASSWORD'] = 'your-app-password'  # Update this
 app.config['MAIL_DEFAULT_SENDER'] = 'your-email@gmail.com'  # Update this
 
+# Bulk email (/email/bulk): concurrent sends over pooled SMTP sessions, attachments
+# split across messages above the size cap. Point MAIL_SERVER/MAIL_PORT at a local
+# SMTP stand-in (e.g. localhost:1025, MAIL_USE_TLS False) to try it out.
+app.config['MAIL_BULK_WORKERS'] = BULK_EMAIL_WORKERS
+app.config['MAIL_MAX_ATTACHMENT_BYTES'] = MAX_MESSAGE_ATTACHMENT_BYTES
+
+# Zip each period's exports once at generation time so period downloads are static files
+app.config['BUILD_PERIOD_ARCHIVES'] = True
+
 mail = Mail(app)
 
 # Paths
 BASE_DIR = Path(__file__).parent
 INVOICES_DIR = BASE_DIR / 'invoices'
+EXPORTS_DIR = OUTPUT_DIR
 CSV_FILE = BASE_DIR / 'POS Dashboard_Vendor Status Overview(CHECKIN)_Table.csv'
 
+# Listing pages
+INVOICES_PER_PAGE = 50
+MAX_PER_PAGE = 500
+METRICS_RUNS = 10  # runs returned by /api/metrics unless ?limit= is given
+
+# Billing runs execute in the background; one active job per billing period
+job_queue = BillingJobQueue()
+
+# Listings and stats come from the artifact manifests written at generation
+# time (kept in memory, reloaded when the journal changes) instead of globbing
+manifests = {
+    'pdf': ArtifactManifest(INVOICES_DIR),
+    'csv': ArtifactManifest(EXPORTS_DIR),
+}
+
+# Billing history queries go to the SQLite ledger written by every billing run
+ledger = BillingLedger(EXPORTS_DIR / LEDGER_FILENAME)
+
+
+def listing_filters():
+    """Period/integrator/country/search filters from the query string (empty values dropped)"""
+    return {
+        key: request.args[key].strip()
+        for key in ('period', 'integrator', 'country', 'q')
+        if request.args.get(key, '').strip()
+    }
+
+
+def query_artifacts(kind, filters, per_page):
+    """One page of a manifest listing for the current request"""
+    filters = dict(filters)
+    return manifests[kind].query(
+        kind=kind,
+        search=filters.pop('q', None),
+        page=request.args.get('page', 1, type=int),
+        per_page=min(max(per_page, 1), MAX_PER_PAGE),
+        **filters
+    )
+
+
+def format_timestamp(mtime):
+    return datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M') if mtime else 'Never'
+
 
 @app.route('/')
 def index():
     """Main dashboard page"""
-    # Check if invoices exist
-    if not INVOICES_DIR.exists() or not list(INVOICES_DIR.glob('*.pdf')):
-        summary = {
-            'total_invoices': 0,
-            'total_size': 0,
-            'last_generated': 'Never'
+    filters = listing_filters()
+    listing = query_artifacts('pdf', filters, request.args.get('per_page', INVOICES_PER_PAGE, type=int))
+    invoices = [
+        {
+            'name': Path(entry['path']).stem,
+            'filename': entry['path'],
+            'size': f"{entry['size'] / 1024:.1f} KB",
+            'modified': format_timestamp(entry['mtime']),
+            'integrator': entry.get('integrator'),
+            'period': entry.get('period')
         }
-        return render_template('index.html', invoices=[], has_invoices=False, summary=summary)
-    
-    # Get all invoice files
-    invoices = []
-    for pdf_file in sorted(INVOICES_DIR.glob('*.pdf')):
-        stat = pdf_file.stat()
-        invoices.append({
-            'name': pdf_file.stem,
-            'filename': pdf_file.name,
-            'size': f"{stat.st_size / 1024:.1f} KB",
-            'modified': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M'),
-            'path': str(pdf_file)
-        })
+        for entry in listing['items']
+    ]
     
-    # Calculate summary
+    # Summary covers every invoice, independent of the filters
+    stats = manifests['pdf'].stats().get('pdf', {'count': 0, 'size': 0, 'last_mtime': 0})
     summary = {
-        'total_invoices': len(invoices),
-        'total_size': sum(Path(inv['path']).stat().st_size for inv in invoices) / (1024 * 1024),
-        'last_generated': max((Path(inv['path']).stat().st_mtime for inv in invoices), default=0)
+        'total_invoices': stats['count'],
+        'total_size': stats['size'] / (1024 * 1024),
+        'last_generated': format_timestamp(stats['last_mtime'])
     }
     
-    if summary['last_generated']:
-        summary['last_generated'] = datetime.fromtimestamp(summary['last_generated']).strftime('%Y-%m-%d %H:%M')
-    else:
-        summary['last_generated'] = 'Never'
-    
-    return render_template('index.html', invoices=invoices, summary=summary, has_invoices=True)
+    return render_template(
+        'index.html',
+        invoices=invoices,
+        summary=summary,
+        has_invoices=stats['count'] > 0,
+        listing=listing,
+        filters=filters,
+        facets=manifests['pdf'].facets()
+    )
+
+
+def run_ingest_job(job):
+    """Worker body for an ingest job: parse the new source into the ingest snapshot cache."""
+    df = load_source_frame(str(CSV_FILE))
+    return {'message': f'Ingested {len(df)} usable records', 'rows': len(df)}
 
 
 @app.route('/upload-csv', methods=['POST'])
 def upload_csv():
-    """Upload a new CSV file"""
+    """
+    Upload a new CSV file
+    
+    Accepts a multipart form with a `file` field (spooled to a temporary file
+    by werkzeug before this runs), or the raw CSV as the request body
+    (Content-Type text/csv, name in ?filename=), which is streamed to disk
+    without being buffered. The content is hashed and the header checked as it
+    arrives; a re-upload of the current source is recognised and changes nothing.
+    A new source is ingested in a background job right away.
+    """
     try:
-        if 'file' not in request.files:
+        if 'file' in request.files:
+            file = request.files['file']
+            filename, stream = file.filename, file.stream
+        elif request.mimetype in ('text/csv', 'application/octet-stream'):
+            filename, stream = request.args.get('filename', CSV_FILE.name), request.stream
+        else:
             return jsonify({'success': False, 'error': 'No file provided'}), 400
         
-        file = request.files['file']
-        
-        if file.filename == '':
+        if filename == '':
             return jsonify({'success': False, 'error': 'No file selected'}), 400
         
-        if not file.filename.endswith('.csv'):
+        if not filename.endswith('.csv'):
             return jsonify({'success': False, 'error': 'File must be a CSV'}), 400
         
-        # Save the uploaded file
-        file.save(CSV_FILE)
+        try:
+            upload = receive_source_upload(stream, CSV_FILE, original_filename=filename)
+        except UploadError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        if upload['duplicate']:
+            return jsonify({
+                'success': True,
+                'duplicate': True,
+                'sha256': upload['sha256'],
+                'message': f'{filename} is identical to the current source; existing results are kept'
+            })
+        
+        # Uploads of the same content coalesce onto one ingest job
+        job, _ = job_queue.submit(
+            ('ingest', upload['sha256']),
+            f'Ingest {filename}',
+            run_ingest_job
+        )
         
         return jsonify({
             'success': True,
-            'message': f'CSV file uploaded successfully: {file.filename}'
+            'duplicate': False,
+            'sha256': upload['sha256'],
+            'size': upload['size'],
+            'message': f'CSV file uploaded successfully: {filename} (ingesting in the background)',
+            'job_id': job.id,
+            'status_url': url_for('job_status', job_id=job.id),
+            'events_url': url_for('job_events', job_id=job.id)
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def run_generate_job(job, billing_month, billing_year):
+    """Worker body for a /generate job: run the pipeline, streaming per-integrator progress."""
+    summary_df = process_csv_and_generate_invoices(
+        str(CSV_FILE), billing_month, billing_year, progress=job.publish,
+        build_archive=app.config['BUILD_PERIOD_ARCHIVES']
+    )
+    return {
+        'message': f'Generated {len(summary_df)} invoices for {billing_month} {billing_year}',
+        'count': len(summary_df)
+    }
+
+
 @app.route('/generate', methods=['POST'])
 def generate_invoices():
-    """Generate new invoices"""
+    """Queue invoice generation and return the job ID straight away"""
     try:
         if not CSV_FILE.exists():
             return jsonify({'success': False, 'error': 'CSV file not found. Please upload a CSV first.'}), 400
         
         # Get billing period from request or use current month
-        data = request.get_json() or {}
+        data = request.get_json(silent=True) or {}
         billing_month = data.get('month', datetime.now().strftime("%B"))
-        billing_year = data.get('year', datetime.now().year)
+        try:
+            billing_year = int(data.get('year', datetime.now().year))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Year must be a number'}), 400
         
-        summary_df = process_csv_and_generate_invoices(str(CSV_FILE), billing_month, billing_year)
+        # Clicks for a period that is already queued or running join that job,
+        # however the month is capitalised ("September" and "september" share a key)
+        job, created = job_queue.submit(
+            billing_period_label(billing_month, billing_year),
+            f'{billing_month} {billing_year}',
+            lambda job: run_generate_job(job, billing_month, billing_year)
+        )
         
         return jsonify({
             'success': True,
-            'message': f'Generated {len(summary_df)} invoices for {billing_month} {billing_year}',
-            'count': len(summary_df)
-        })
+            'message': f'{"Started" if created else "Already generating"} invoices for {billing_month} {billing_year}',
+            'job_id': job.id,
+            'coalesced': not created,
+            'status_url': url_for('job_status', job_id=job.id),
+            'events_url': url_for('job_events', job_id=job.id)
+        }), 202
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Status of a background generate job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    return jsonify(dict(job.to_dict(), success=True))
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-Sent Events stream of a job's per-integrator progress"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    return Response(
+        sse_stream(job, request.headers.get('Last-Event-ID')),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/download/<filename>')
 def download_invoice(filename):
     """Download a single invoice"""
@@ -134,27 +281,46 @@ def download_invoice(filename):
 
 @app.route('/download-all')
 def download_all():
-    """Download all invoices as a ZIP file"""
-    if not INVOICES_DIR.exists():
-        flash('No invoices found', 'error')
-        return redirect(url_for('index'))
+    """
+    Download invoices (or kind=csv exports) as a ZIP file, optionally limited
+    to one period and/or integrator.
     
-    # Create ZIP file in memory
-    memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for pdf_file in INVOICES_DIR.glob('*.pdf'):
-            zf.write(pdf_file, pdf_file.name)
+    A period download uses the archive prebuilt at generation time when it is
+    up to date (served with ETag and Range support). Otherwise the archive is
+    streamed as it is written, with PDFs stored rather than recompressed.
+    """
+    kind = request.args.get('kind', 'pdf')
+    if kind not in manifests:
+        return jsonify({'success': False, 'error': f'Unknown kind: {kind}'}), 400
+    period = request.args.get('period') or None
+    integrator = request.args.get('integrator') or None
+    manifest = manifests[kind]
     
-    memory_file.seek(0)
+    if period and not integrator:
+        archive_path = current_period_archive(manifest, kind, period)
+        if archive_path is not None:
+            return send_file(
+                archive_path,
+                mimetype='application/zip',
+                as_attachment=True,
+                download_name=archive_path.name,
+                conditional=True,
+                etag=True
+            )
     
-    # Generate filename with current date
-    zip_filename = f"invoices_{datetime.now().strftime('%Y%m%d')}.zip"
+    files = archive_files(manifest, kind, period=period, integrator=integrator)
+    if not files:
+        flash('No invoices found' if kind == 'pdf' else 'No exports found', 'error')
+        return redirect(url_for('index'))
+    
+    # Generate filename from the selection, or the current date for everything
+    selection = '_'.join(part for part in (period, integrator) if part)
+    zip_filename = secure_filename(f"{ARCHIVE_NAMES[kind]}_{selection or datetime.now().strftime('%Y%m%d')}.zip")
     
-    return send_file(
-        memory_file,
+    return Response(
+        iter_zip(files),
         mimetype='application/zip',
-        as_attachment=True,
-        download_name=zip_filename
+        headers={'Content-Disposition': f'attachment; filename="{zip_filename}"'}
     )
 
 
@@ -168,6 +334,25 @@ def preview_invoice(filename):
     return send_file(file_path, mimetype='application/pdf')
 
 
+def invoice_email_subject():
+    """Subject line for invoice emails"""
+    return f"POS Integration Invoices - {datetime.now().strftime('%B %Y')}"
+
+
+def invoice_email_body(count):
+    """Body text for an invoice email with `count` attachments"""
+    return f"""
+Hello,
+
+Please find attached the POS integration invoices for {datetime.now().strftime('%B %Y')}.
+
+Total invoices: {count}
+
+Best regards,
+POS Billing Team
+            """
+
+
 @app.route('/email', methods=['POST'])
 def email_invoice():
     """Email invoice(s) to recipient"""
@@ -184,18 +369,9 @@ def email_invoice():
         
         # Create email
         msg = Message(
-            subject=f"POS Integration Invoices - {datetime.now().strftime('%B %Y')}",
+            subject=invoice_email_subject(),
             recipients=[recipient],
-            body=f"""
-Hello,
-
-Please find attached the POS integration invoices for {datetime.now().strftime('%B %Y')}.
-
-Total invoices: {len(filenames)}
-
-Best regards,
-POS Billing Team
-            """
+            body=invoice_email_body(len(filenames))
         )
         
         # Attach invoices
@@ -215,6 +391,107 @@ POS Billing Team
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def resolve_delivery(delivery):
+    """Recipient and attachment paths for one /email/bulk delivery (raises ValueError if invalid)"""
+    recipient = (delivery.get('recipient') or '').strip()
+    if not recipient:
+        raise ValueError('Every delivery needs a recipient')
+    
+    if delivery.get('filenames'):
+        attachments = []
+        for filename in delivery['filenames']:
+            if Path(filename).name != filename or not (INVOICES_DIR / filename).is_file():
+                raise ValueError(f'Invoice not found: {filename}')
+            attachments.append(INVOICES_DIR / filename)
+    elif delivery.get('integrator'):
+        attachments = [
+            path for path, _ in archive_files(
+                manifests['pdf'], 'pdf', period=delivery.get('period'), integrator=delivery['integrator']
+            )
+        ]
+        if not attachments:
+            raise ValueError(f"No invoices found for {delivery['integrator']}")
+    else:
+        raise ValueError(f'No invoices selected for {recipient}')
+    return recipient, attachments
+
+
+def run_bulk_email_job(job, deliveries):
+    """Worker body for an /email/bulk job: send every delivery over one SMTP pool"""
+    job.publish({'stage': 'started', 'total': len(deliveries)})
+    config = app.config
+    with SMTPConnectionPool(
+        config['MAIL_SERVER'],
+        config['MAIL_PORT'],
+        use_tls=config.get('MAIL_USE_TLS', False),
+        use_ssl=config.get('MAIL_USE_SSL', False),
+        username=config.get('MAIL_USERNAME'),
+        password=config.get('MAIL_PASSWORD')
+    ) as pool:
+        mailer = BulkMailer(
+            pool,
+            config['MAIL_DEFAULT_SENDER'],
+            workers=config['MAIL_BULK_WORKERS'],
+            max_attachment_bytes=config['MAIL_MAX_ATTACHMENT_BYTES']
+        )
+        results = mailer.send(deliveries, progress=job.publish)
+    
+    sent = sum(1 for result in results if result['status'] == 'sent')
+    return {
+        'message': f'Sent invoices to {sent} of {len(results)} recipient(s)',
+        'count': sent,
+        'results': results
+    }
+
+
+@app.route('/email/bulk', methods=['POST'])
+def email_bulk():
+    """
+    Queue a bulk email send and return the job ID straight away.
+    
+    Body: {"deliveries": [{"recipient": ..., "filenames": [...]} or
+    {"recipient": ..., "integrator": ..., "period": ...}], "subject": optional}.
+    Per-recipient status is in the job result.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        if not data.get('deliveries'):
+            return jsonify({'success': False, 'error': 'No deliveries given'}), 400
+        
+        subject = data.get('subject') or invoice_email_subject()
+        deliveries = []
+        for delivery in data['deliveries']:
+            try:
+                recipient, attachments = resolve_delivery(delivery)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            deliveries.append({
+                'recipient': recipient,
+                'subject': subject,
+                'body': invoice_email_body(len(attachments)),
+                'attachments': attachments
+            })
+        
+        # Resubmitting the same send while it is still running joins that job
+        key = ('email', subject, tuple((d['recipient'], tuple(map(str, d['attachments']))) for d in deliveries))
+        job, created = job_queue.submit(
+            key,
+            f'Email to {len(deliveries)} recipient(s)',
+            lambda job: run_bulk_email_job(job, deliveries)
+        )
+        
+        return jsonify({
+            'success': True,
+            'message': f'{"Sending" if created else "Already sending"} invoices to {len(deliveries)} recipient(s)',
+            'job_id': job.id,
+            'coalesced': not created,
+            'status_url': url_for('job_status', job_id=job.id),
+            'events_url': url_for('job_events', job_id=job.id)
+        }), 202
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/tax-config')
 def tax_config():
     """Show tax configuration"""
@@ -225,15 +502,102 @@ def tax_config():
 @app.route('/api/stats')
 def api_stats():
     """API endpoint for dashboard statistics"""
-    if not INVOICES_DIR.exists():
-        return jsonify({'total_invoices': 0, 'total_size': 0})
+    invoices = manifests['pdf'].stats().get('pdf', {'count': 0, 'size': 0, 'last_mtime': 0})
+    exports = manifests['csv'].stats().get('csv', {'count': 0, 'size': 0, 'last_mtime': 0})
     
-    invoices = list(INVOICES_DIR.glob('*.pdf'))
-    total_size = sum(f.stat().st_size for f in invoices)
+    return jsonify({
+        'total_invoices': invoices['count'],
+        'total_size': f"{invoices['size'] / (1024 * 1024):.2f} MB",
+        'last_generated': format_timestamp(invoices['last_mtime']),
+        'total_exports': exports['count'],
+        'exports_size': f"{exports['size'] / (1024 * 1024):.2f} MB"
+    })
+
+
+@app.route('/api/artifacts')
+def api_artifacts():
+    """
+    Paginated, filterable artifact listing from the manifest.
+    
+    Query parameters: kind (pdf or csv), period, integrator, country, q (path
+    search), page, per_page, and refresh=1 to rescan the folder first.
+    """
+    kind = request.args.get('kind', 'pdf')
+    if kind not in manifests:
+        return jsonify({'success': False, 'error': f'Unknown kind: {kind}'}), 400
+    
+    if request.args.get('refresh') == '1':
+        manifests[kind].rebuild()
     
+    listing = query_artifacts(kind, listing_filters(), request.args.get('per_page', INVOICES_PER_PAGE, type=int))
+    items = [
+        dict(entry, modified=format_timestamp(entry['mtime']))
+        for entry in listing['items']
+    ]
+    if kind == 'pdf':
+        for item in items:
+            item['download_url'] = url_for('download_invoice', filename=item['path'])
+    
+    return jsonify(dict(listing, items=items, facets=manifests[kind].facets(), success=True))
+
+
+@app.route('/api/metrics')
+def api_metrics():
+    """
+    Metrics of the latest billing runs, newest first.
+    
+    Query parameters: limit (runs, default 10), and integrator to keep only
+    that integrator's entry in each run.
+    """
+    limit = min(max(1, request.args.get('limit', METRICS_RUNS, type=int)), RUN_HISTORY_LIMIT)
+    runs = load_run_records(EXPORTS_DIR / RUN_METRICS_FILENAME, limit)
+    
+    integrator = request.args.get('integrator')
+    if integrator:
+        runs = [
+            dict(run, integrators=[item for item in run.get('integrators', []) if item.get('integrator') == integrator])
+            for run in runs
+        ]
+    
+    return jsonify({'success': True, 'runs': runs})
+
+
+def ledger_filters(*keys):
+    """Ledger filters from the query string (empty values dropped)"""
+    return {key: request.args[key].strip() for key in keys if request.args.get(key, '').strip()}
+
+
+@app.route('/api/ledger/branches')
+def api_ledger_branches():
+    """
+    Billed branches from the ledger, oldest period first.
+    
+    Query parameters: period, integrator, country, vendor_code, remote_id,
+    limit (rows, default 1000), and first=1 to get the first and last period
+    each matching vendor was billed per integrator instead of every row.
+    """
+    filters = ledger_filters('period', 'integrator', 'country', 'vendor_code', 'remote_id')
+    try:
+        if request.args.get('first') == '1':
+            rows = ledger.first_billed(
+                filters.get('vendor_code'), filters.get('remote_id'), filters.get('integrator')
+            )
+        else:
+            limit = min(max(1, request.args.get('limit', DEFAULT_QUERY_LIMIT, type=int)), DEFAULT_QUERY_LIMIT)
+            rows = ledger.query(limit=limit, **filters)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify({'success': True, 'rows': rows})
+
+
+@app.route('/api/ledger/summary')
+def api_ledger_summary():
+    """Billed branch counts per period, integrator and country; filtered by period, integrator, country."""
     return jsonify({
-        'total_invoices': len(invoices),
-        'total_size': f"{total_size / (1024 * 1024):.2f} MB"
+        'success': True,
+        'periods': ledger.periods(),
+        'rows': ledger.summary(**ledger_filters('period', 'integrator', 'country')),
     })
 
 
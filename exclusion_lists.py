@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Entity-scoped exclusion lists, loaded from data files and compiled for matching.
+
+Each INTEGRATOR_RULES rule set can have a CSV file in exclusion_lists/, named
+after the rule set (e.g. exclusion_lists/limetray_uae.csv). Each row has these
+columns:
+
+    entity_id  entity the entry applies to (e.g. TB_AE); empty for every entity
+    rule       audit label of the rule (e.g. blocklist); rows with the same
+               rule and entity_id form one rule, in order of first appearance
+    match      "exact" for a brand or branch name, compared after normalize_name,
+               or "contains" for a case-insensitive substring
+    value      the name or substring
+
+All lists are compiled into one ExclusionMatcher: a hash table of the exact
+names and an Aho-Corasick automaton of the substrings. Matching a name takes
+one hash lookup and one pass over its characters, however long the lists are,
+and returns a bitmask of the rules it hits. Compiled matchers are pickled in
+.exclusion_cache/ under a hash of the list files, so later runs (and worker
+processes) skip compilation until a list changes.
+"""
+
+import csv
+import hashlib
+import pickle
+from collections import deque
+from pathlib import Path
+
+
+EXCLUSION_LIST_COLUMNS = ["entity_id", "rule", "match", "value"]
+MATCH_KINDS = ("exact", "contains")
+
+# Bump whenever ExclusionMatcher or SubstringAutomaton change shape, so old pickles are rebuilt
+MATCHER_VERSION = 1
+MATCHER_CACHE_MAX_FILES = 8
+
+
+def read_exclusion_lists(directory):
+    """
+    Read every <rule_set>.csv in directory (sorted by name).
+
+    Returns:
+        list of rules in file order, each a dict with rule_set, kind,
+        entity_id (None for every entity), exact (names) and contains
+        (substrings)
+    """
+    rules = []
+    for path in sorted(Path(directory).glob("*.csv")):
+        rule_set = path.stem
+        by_scope = {}
+        with open(path, newline="", encoding="utf-8") as handle:
+            reader = csv.DictReader(handle)
+            if reader.fieldnames != EXCLUSION_LIST_COLUMNS:
+                raise ValueError(
+                    f"{path.name}: expected columns {', '.join(EXCLUSION_LIST_COLUMNS)}, "
+                    f"got {', '.join(reader.fieldnames or [])}"
+                )
+            for line_number, row in enumerate(reader, start=2):
+                kind = (row["rule"] or "").strip()
+                match = (row["match"] or "").strip().lower()
+                value = row["value"] or ""
+                if not kind or not value.strip():
+                    raise ValueError(f"{path.name}:{line_number}: rule and value are required")
+                if match not in MATCH_KINDS:
+                    raise ValueError(f"{path.name}:{line_number}: match must be one of {', '.join(MATCH_KINDS)}")
+                entity_id = (row["entity_id"] or "").strip() or None
+                rule = by_scope.get((kind, entity_id))
+                if rule is None:
+                    rule = by_scope[(kind, entity_id)] = {
+                        "rule_set": rule_set,
+                        "kind": kind,
+                        "entity_id": entity_id,
+                        "exact": [],
+                        "contains": [],
+                    }
+                    rules.append(rule)
+                rule[match].append(value)
+    return rules
+
+
+def exclusion_lists_fingerprint(directory):
+    """SHA-256 of the list files' names and contents, plus MATCHER_VERSION."""
+    digest = hashlib.sha256(f"exclusion-matcher-{MATCHER_VERSION}".encode())
+    for path in sorted(Path(directory).glob("*.csv")):
+        digest.update(path.name.encode() + b"\0")
+        digest.update(path.read_bytes() + b"\0")
+    return digest.hexdigest()
+
+
+class SubstringAutomaton:
+    """Aho-Corasick automaton that ORs together the bits of every pattern found in a string."""
+
+    def __init__(self, patterns):
+        """
+        Args:
+            patterns: dict of non-empty substring -> bits to report when it occurs
+        """
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [0]
+        for pattern, bits in patterns.items():
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(0)
+                state = next_state
+            self._output[state] |= bits
+
+        # Failure links, breadth first; each state also reports the patterns ending at its fallback
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def search(self, text):
+        """Return the bits of every pattern that occurs in text (0 for none)."""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        bits = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            bits |= output[state]
+        return bits
+
+
+class ExclusionMatcher:
+    """All exclusion lists compiled into one exact-name table and one substring automaton."""
+
+    def __init__(self, rules, normalize, fingerprint=None):
+        """
+        Args:
+            rules: Rules from read_exclusion_lists; rule i is reported as bit 1 << i
+            normalize: Normalization applied to exact names (normalize_name)
+            fingerprint: exclusion_lists_fingerprint of the files the rules came from
+        """
+        self.rules = rules
+        self.fingerprint = fingerprint
+        self.exact = {}
+        substrings = {}
+        for index, rule in enumerate(rules):
+            bit = 1 << index
+            for name in rule["exact"]:
+                key = normalize(name)
+                if not key:
+                    raise ValueError(f"{rule['rule_set']} {rule['kind']}: {name!r} normalizes to an empty name")
+                self.exact[key] = self.exact.get(key, 0) | bit
+            for substring in rule["contains"]:
+                substring = substring.lower()
+                substrings[substring] = substrings.get(substring, 0) | bit
+        self.automaton = SubstringAutomaton(substrings) if substrings else None
+
+    def match(self, names, normalized_names):
+        """
+        Return, for each name, the bits of the rules it matches (0 for none).
+
+        Args:
+            names: Raw names (missing values never match a substring)
+            normalized_names: The same names after normalize_name
+        """
+        exact = self.exact
+        automaton = self.automaton
+        bits = []
+        for name, normalized in zip(names, normalized_names):
+            hit = exact.get(normalized, 0)
+            if automaton is not None and isinstance(name, str):
+                hit |= automaton.search(name.lower())
+            bits.append(hit)
+        return bits
+
+
+def load_exclusion_matcher(directory, normalize, cache_dir=None):
+    """
+    Return the ExclusionMatcher for the lists in directory.
+
+    With a cache_dir, the compiled matcher is pickled there as
+    <fingerprint>.pickle and reused while the list files are unchanged. Only
+    the MATCHER_CACHE_MAX_FILES most recent pickles are kept.
+    """
+    fingerprint = exclusion_lists_fingerprint(directory)
+    if cache_dir is None:
+        return ExclusionMatcher(read_exclusion_lists(directory), normalize, fingerprint)
+
+    cache_dir = Path(cache_dir)
+    cache_path = cache_dir / f"{fingerprint}.pickle"
+    if cache_path.exists():
+        try:
+            with open(cache_path, "rb") as handle:
+                return pickle.load(handle)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            print(f"⚠️  Ignoring unreadable exclusion matcher {cache_path.name}: {e}")
+
+    matcher = ExclusionMatcher(read_exclusion_lists(directory), normalize, fingerprint)
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        temp_path = cache_path.with_suffix(".tmp")
+        with open(temp_path, "wb") as handle:
+            pickle.dump(matcher, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        temp_path.replace(cache_path)
+    except OSError as e:
+        print(f"⚠️  Could not cache the exclusion matcher: {e}")
+        return matcher
+
+    cached = sorted(cache_dir.glob("*.pickle"), key=lambda path: path.stat().st_mtime, reverse=True)
+    for stale in cached[MATCHER_CACHE_MAX_FILES:]:
+        stale.unlink(missing_ok=True)
+    return matcher
@@ -5,12 +5,23 @@ Automatically generates monthly invoices for integrators based on branch count.
 Rate: $15 per branch per month
 """
 
+import argparse
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import numpy as np
+import os
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import re
 import sys
-from fuzzywuzzy import fuzz
+import tempfile
+from fuzzywuzzy import fuzz, utils as fuzz_utils
+from rapidfuzz import fuzz as rapid_fuzz, process as rapid_process
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -18,10 +29,27 @@ from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
 from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
 from collections import defaultdict
+from invoice_canvas import CanvasInvoiceRenderer
+from artifact_manifest import ArtifactManifest, artifact_entry
+from artifact_archives import build_period_archive
+from run_metrics import RUN_METRICS_FILENAME, RunMetrics, append_run_record, measure
+from similarity_cache import SimilarityCache
+from exclusion_lists import load_exclusion_matcher
+from billing_ledger import LEDGER_FILENAME, BillingLedger
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # The ingest snapshot cache is skipped without pyarrow
+    pa = None
 
 
 BASE_DIR = Path(__file__).parent
 OUTPUT_DIR = BASE_DIR / "exports"
+INGEST_CACHE_DIR = BASE_DIR / ".ingest_cache"
+EXCLUSION_LISTS_DIR = BASE_DIR / "exclusion_lists"
+EXCLUSION_CACHE_DIR = BASE_DIR / ".exclusion_cache"
+SCORE_CACHE_PATH = BASE_DIR / ".score_cache.sqlite3"
 
 ALLOWED_COLUMNS = [
     "Entity ID",
@@ -35,6 +63,44 @@ ALLOWED_COLUMNS = [
     "Orders",
 ]
 
+# Parse types for the columns we keep; everything else in the export is never parsed
+INGEST_DTYPES = {
+    "Entity ID": str,
+    "vendor_code": str,
+    "remote_id": str,
+    "Branch Name": str,
+    "Integration Name": str,
+    "Chain ID": str,
+    "Chain Name": str,
+    "Delivery Type": str,
+    "Orders": str,
+}
+
+INGEST_CHUNK_ROWS = 50_000
+
+# Read as text and coerced to nullable integers per chunk, so a stray "N/A"
+# becomes a missing value instead of failing the whole read
+INGEST_INTEGER_COLUMNS = ["vendor_code", "Chain ID", "Orders"]
+
+# Low-cardinality columns kept dictionary-encoded (categorical) after ingest;
+# lookups on them run once per category and are broadcast through the codes
+CATEGORICAL_COLUMNS = ["Entity ID", "Integration Name", "Delivery Type", "Country", "Chain Name"]
+
+# Bump whenever process_uploaded_csv changes what it returns for the same input
+INGEST_SCHEMA_VERSION = 4
+INGEST_CACHE_MAX_SNAPSHOTS = 8
+
+# Export CSVs are rendered and written on a small thread pool, with large write buffers
+EXPORT_WRITE_WORKERS = 4
+EXPORT_WRITE_BUFFER_BYTES = 1024 * 1024
+
+# Bump whenever exclusion or dedup logic changes what the same rows bill to
+BILLING_RULES_VERSION = 1
+BILLING_STATE_FILENAME = ".billing_state.json"
+
+# Similarity thresholds compared by --sweep-thresholds when none are given
+SWEEP_THRESHOLDS = (80, 85, 90)
+
 COUNTRY_MAP = {
     "TB_KW": "Kuwait",
     "TB_AE": "UAE",
@@ -68,25 +134,65 @@ def slugify(value):
     return re.sub(r"[^A-Za-z0-9]+", "_", str(value)).strip("_").lower()
 
 
-URBAN_PIPER_UAE_EXCLUSION_NAMES = {
-    "Edo Sushi and Poke",
-    "Else Burger",
-}
-
-LIMETRAY_UAE_EXCLUSION_NAMES = {
-    "Toss & Co.",
-    "World of Asia",
-    "Biryani Boy",
-    "Tim Hortons",
-    "Chef Lanka",
-    "Steers",
-    "Debonairs Pizza , Dibba",
-    "Tim Hortons home select",
-    "The Kebab Shop",
-}
+def map_unique_values(series, transform):
+    """Apply a vectorised transform once per distinct value and broadcast it back by position."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Already encoded: transform the categories, plus a trailing missing value for code -1
+        codes = series.cat.codes.to_numpy()
+        uniques = pd.Series([*series.cat.categories, None], dtype=object)
+        mapped = transform(uniques)
+        return pd.Series(mapped.to_numpy()[codes], index=series.index, name=series.name)
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    mapped = transform(pd.Series(uniques, dtype=series.dtype))
+    return pd.Series(mapped.to_numpy()[codes], index=series.index, name=series.name)
+
+
+def map_categories(series, mapping):
+    """
+    Look each category of a categorical up in mapping once and return the
+    results as a categorical (sorted categories; unmapped values are missing).
+    """
+    category_codes, uniques = pd.factorize(pd.Series(series.cat.categories, dtype=object).map(mapping), sort=True)
+    codes = np.append(category_codes, -1)[series.cat.codes.to_numpy()]  # code -1 stays missing
+    return pd.Series(pd.Categorical.from_codes(codes, categories=uniques), index=series.index, name=series.name)
+
+
+def unify_categories(frames, columns):
+    """
+    Give the categorical columns of frames the same, sorted categories (in
+    place), so concatenating them keeps the columns categorical.
+    """
+    for column in columns:
+        categories = sorted(set().union(*(frame[column].cat.categories for frame in frames)))
+        for frame in frames:
+            frame[column] = frame[column].cat.set_categories(categories)
+
+
+def snap_flags(series):
+    """Vectorised check for 'snap' anywhere in the value, case-insensitive."""
+    return series.str.contains("snap", case=False, na=False)
+
+
+def add_derived_columns(df):
+    """
+    Add the columns every rule and the deduplicator work from.
+
+    BranchNameNorm/ChainNameNorm hold normalize_name of the branch and chain,
+    IsSnap flags rows whose branch or chain mention "snap" and IntegratorSlug is
+    the slugified integrator. Each transform runs once per distinct value.
+    """
+    df["BranchNameNorm"] = map_unique_values(df["Branch Name"], normalize_series)
+    df["ChainNameNorm"] = map_unique_values(df["Chain Name"], normalize_series)
+    df["IsSnap"] = (
+        map_unique_values(df["Branch Name"], snap_flags)
+        | map_unique_values(df["Chain Name"], snap_flags)
+    ).astype(bool)
+    if "Integration Name" in df.columns:
+        df["IntegratorSlug"] = map_unique_values(
+            df["Integration Name"], lambda names: names.map(slugify)
+        )
+    return df
 
-URBAN_PIPER_UAE_EXCLUSIONS = {normalize_name(name) for name in URBAN_PIPER_UAE_EXCLUSION_NAMES}
-LIMETRAY_UAE_EXCLUSIONS = {normalize_name(name) for name in LIMETRAY_UAE_EXCLUSION_NAMES}
 
 INTEGRATOR_RULES = {
     # Grubtech
@@ -108,31 +214,99 @@ INTEGRATOR_RULES = {
 }
 
 
-def remove_snap_rows(df, entity_ids=None):
-    """Remove rows whose branch or chain include 'snap'."""
-    snap_mask = (
-        df["Branch Name"].str.contains("snap", case=False, na=False)
-        | df["Chain Name"].str.contains("snap", case=False, na=False)
-    )
-    if entity_ids:
-        entity_mask = df["Entity ID"].isin(set(entity_ids))
-        snap_mask = snap_mask & entity_mask
-    return df[~snap_mask].copy()
+@functools.lru_cache(maxsize=None)
+def get_exclusion_matcher():
+    """
+    The ExclusionMatcher for the INTEGRATOR_RULES rule sets, one
+    exclusion_lists/<rule set>.csv each. Loaded on first use, so a bad list
+    file fails the billing run rather than every import of this module.
+    """
+    return load_exclusion_matcher(EXCLUSION_LISTS_DIR, normalize_name, EXCLUSION_CACHE_DIR)
+
+
+def compile_exclusion_rules(integrator_rules=None, matcher=None):
+    """
+    Attach the integrator slugs of INTEGRATOR_RULES to the rules of an ExclusionMatcher.
+
+    Each compiled rule carries its audit reason (e.g. "limetray_uae blocklist"),
+    the integrator slugs it applies to and its bit in the matcher's results, so
+    evaluate_exclusions can check the whole frame rule by rule instead of
+    integrator by integrator.
+    """
+    if integrator_rules is None:
+        integrator_rules = INTEGRATOR_RULES
+    if matcher is None:
+        matcher = get_exclusion_matcher()
+
+    compiled = []
+    for index, rule in enumerate(matcher.rules):
+        slugs = {slug for slug, rule_sets in integrator_rules.items() if rule["rule_set"] in rule_sets}
+        compiled.append(
+            {
+                "rule_set": rule["rule_set"],
+                "reason": f"{rule['rule_set']} {rule['kind']}",
+                "kind": rule["kind"],
+                "entity_id": rule["entity_id"],
+                "bit": 1 << index,
+                "slugs": frozenset(slugs),
+            }
+        )
+    return compiled
+
+
+@functools.lru_cache(maxsize=None)
+def get_compiled_exclusion_rules():
+    """compile_exclusion_rules() for INTEGRATOR_RULES and get_exclusion_matcher(), compiled once."""
+    return compile_exclusion_rules()
 
 
-def exclude_named_locations(df, entity_id, exclusions):
-    """Exclude rows for a specific entity whose branch/chain match block list."""
+def evaluate_exclusions(df, rule_sets=None, compiled_rules=None, matcher=None):
+    """
+    Return, for every row, the reason it is excluded ("" for rows that are kept).
+
+    By default each row is checked against the rule sets of its IntegratorSlug,
+    so one call covers the whole post-ingest frame. Passing rule_sets applies
+    those rule sets to every row instead. The first matching rule is reported.
+
+    Branch and chain names are matched against every list at once, once per
+    distinct name; compiled_rules must come from the same matcher.
+    """
+    if compiled_rules is None:
+        compiled_rules = get_compiled_exclusion_rules()
+    if matcher is None:
+        matcher = get_exclusion_matcher()
+
+    reasons = np.full(len(df), "", dtype=object)
     if df.empty:
-        return df
-    entity_mask = df["Entity ID"] == entity_id
-    if not entity_mask.any():
-        return df
-    branch_norm = normalize_series(df["Branch Name"])
-    chain_norm = normalize_series(df["Chain Name"])
-    block_mask = entity_mask & (
-        branch_norm.isin(exclusions) | chain_norm.isin(exclusions)
+        return pd.Series(reasons, index=df.index, name="ExcludedBy")
+
+    if rule_sets is None and "IntegratorSlug" not in df.columns:
+        df = add_derived_columns(df.copy())
+
+    def match_names(names):
+        return pd.Series(matcher.match(names, normalize_series(names)), index=names.index, dtype=object)
+
+    row_bits = (
+        map_unique_values(df["Branch Name"], match_names).to_numpy()
+        | map_unique_values(df["Chain Name"], match_names).to_numpy()
     )
-    return df[~block_mask].copy()
+    # Few distinct bit combinations occur, so each rule is tested once per combination
+    bit_codes, bit_values = pd.factorize(row_bits)
+
+    for rule in compiled_rules:
+        if rule_sets is not None:
+            if rule["rule_set"] not in rule_sets:
+                continue
+            mask = np.ones(len(df), dtype=bool)
+        else:
+            mask = df["IntegratorSlug"].isin(rule["slugs"]).to_numpy()
+        if rule["entity_id"] is not None:
+            mask = mask & (df["Entity ID"] == rule["entity_id"]).to_numpy(dtype=bool, na_value=False)
+        hits = np.array([value & rule["bit"] != 0 for value in bit_values], dtype=bool)
+        mask = mask & hits[bit_codes]
+        reasons[mask & (reasons == "")] = rule["reason"]
+
+    return pd.Series(reasons, index=df.index, name="ExcludedBy")
 
 
 def apply_integrator_exclusions(df, integrator_name, rules):
@@ -140,34 +314,47 @@ def apply_integrator_exclusions(df, integrator_name, rules):
     if df.empty or not rules:
         return df
 
-    result = df.copy()
-
-    if "grubtech" in rules:
-        result = remove_snap_rows(result)
-
-    if "urbanpiper_uae" in rules:
-        result = remove_snap_rows(result, entity_ids={"TB_AE"})
-        result = exclude_named_locations(result, "TB_AE", URBAN_PIPER_UAE_EXCLUSIONS)
-
-    if "limetray_uae" in rules:
-        result = remove_snap_rows(result, entity_ids={"TB_AE"})
-        result = exclude_named_locations(result, "TB_AE", LIMETRAY_UAE_EXCLUSIONS)
+    return df[evaluate_exclusions(df, rule_sets=rules).to_numpy() == ""]
 
-    return result
 
+def apply_business_rules(integrator_name, integrator_df, deduplicator, metrics=None):
+    """
+    Apply all business rules for a given integrator.
 
-def apply_business_rules(integrator_name, integrator_df, deduplicator):
-    """Apply all business rules for a given integrator."""
+    If a metrics dict is given, it is filled with rows_in, rows_excluded,
+    excluded_by_rule, rows_after_exclusions, rows_out and fuzzy_comparisons
+    (plus score_cache_hits and score_cache_misses when the deduplicator has a
+    score cache).
+    """
+    if metrics is None:
+        metrics = {}
     slug = slugify(integrator_name)
     rules = INTEGRATOR_RULES.get(slug, set())
 
     print(f"Processing integrator: {integrator_name} ({len(integrator_df)} rows)")
 
-    # Apply integrator-specific exclusions
-    filtered_df = apply_integrator_exclusions(integrator_df, integrator_name, rules)
-    removed_due_to_rules = len(integrator_df) - len(filtered_df)
+    # Apply integrator-specific exclusions; the pipeline evaluates them for the whole frame up front
+    if "ExcludedBy" in integrator_df.columns:
+        excluded_by = integrator_df["ExcludedBy"]
+    else:
+        excluded_by = evaluate_exclusions(integrator_df, rule_sets=rules)
+    excluded_mask = (excluded_by != "").to_numpy()
+    filtered_df = integrator_df[~excluded_mask]
+    removed_due_to_rules = int(excluded_mask.sum())
+    excluded_by_rule = {
+        reason: int(count) for reason, count in excluded_by[excluded_mask].value_counts().sort_index().items()
+    }
+    metrics.update(
+        rows_in=len(integrator_df),
+        rows_excluded=removed_due_to_rules,
+        excluded_by_rule=excluded_by_rule,
+        rows_after_exclusions=len(filtered_df),
+        rows_out=0,
+        fuzzy_comparisons=0,
+    )
     if removed_due_to_rules:
-        print(f"  • Excluded {removed_due_to_rules} rows due to integrator-specific rules")
+        breakdown = ", ".join(f"{reason}: {count}" for reason, count in excluded_by_rule.items())
+        print(f"  • Excluded {removed_due_to_rules} rows due to integrator-specific rules ({breakdown})")
 
     if filtered_df.empty:
         print("  • No data left after exclusions, skipping\n")
@@ -176,45 +363,271 @@ def apply_business_rules(integrator_name, integrator_df, deduplicator):
     # Deduplicate branches
     # For Grubtech, we ignore delivery type to handle TGO vs TMP duplicates (assumed to be own delivery vs restaurant delivery)
     ignore_delivery_type = "grubtech" in rules
-    unique_keys = deduplicator.deduplicate_branches(
-        filtered_df, ignore_delivery_type=ignore_delivery_type
-    )
-
-    if unique_keys.empty:
+    if deduplicator.blocking_index is not None:
+        deduplicator.blocking_index.reset_counters()
+    comparisons_before = deduplicator.comparisons
+    score_cache = deduplicator.score_cache
+    if score_cache is not None:
+        hits_before, misses_before = score_cache.hits, score_cache.misses
+    dedup_result = deduplicator.deduplicate(filtered_df, ignore_delivery_type=ignore_delivery_type)
+    metrics["fuzzy_comparisons"] = deduplicator.comparisons - comparisons_before
+    if score_cache is not None:
+        metrics["score_cache_hits"] = score_cache.hits - hits_before
+        metrics["score_cache_misses"] = score_cache.misses - misses_before
+
+    if len(dedup_result.keep_positions) == 0:
         print("  • No unique branches identified, skipping\n")
         return pd.DataFrame()
 
-    # Merge to get final unique branches
-    deduped_df = filtered_df.merge(
-        unique_keys,
-        on=list(unique_keys.columns),
-        how="inner",
-    )
+    # Select surviving rows by position; duplicates map to the row they were merged into
+    deduped_df = dedup_result.survivors(filtered_df)
+    metrics["rows_out"] = len(deduped_df)
 
     print(
         f"  • Unique branches after dedupe: {len(deduped_df)} (from {len(filtered_df)})"
         + (" [delivery type ignored]" if ignore_delivery_type else "")
     )
+    if deduplicator.blocking_index is not None:
+        stats = deduplicator.blocking_index.stats
+        print(
+            f"  • Cross-key blocking: {stats['candidate_pairs']} candidate pairs scored, "
+            f"{stats['pruned_pairs']} pruned, {stats['matched_pairs']} near-duplicates removed"
+        )
+    if score_cache is not None and (metrics["score_cache_hits"] or metrics["score_cache_misses"]):
+        print(
+            f"  • Score cache: {metrics['score_cache_hits']} pairs reused, "
+            f"{metrics['score_cache_misses']} scored"
+        )
     
     return deduped_df
 
 
+class BranchBlockingIndex:
+    """
+    Token inverted index that proposes candidate pairs for cross-key fuzzy matching.
+
+    Every token of a token-sorted branch name is a block, scoped by an optional
+    block key (Entity ID in the pipeline so branches in different countries are
+    never paired). Blocks bigger than max_block_size are generic tokens such as
+    "mcdonald" or "s" and are skipped, so the number of candidate pairs grows
+    with n * max_block_size instead of n².
+    """
+
+    def __init__(self, max_block_size=50):
+        """
+        Args:
+            max_block_size: Blocks with more rows than this are not expanded into pairs
+        """
+        self.max_block_size = max_block_size
+        self.reset_counters()
+
+    def reset_counters(self):
+        """Zero the counters accumulated across candidate_pairs calls."""
+        self.stats = {
+            "rows": 0,
+            "total_pairs": 0,
+            "candidate_pairs": 0,
+            "pruned_pairs": 0,
+            "skipped_blocks": 0,
+            "matched_pairs": 0,
+        }
+
+    def candidate_pairs(self, sorted_names, block_keys=None, group_keys=None):
+        """
+        Return sorted (i, j) position pairs, i < j, that share at least one block.
+
+        Args:
+            sorted_names: Token-sorted branch names (see BranchDeduplicator.sort_tokens)
+            block_keys: Optional per-row scope; rows are only paired within the same scope
+            group_keys: Optional per-row dedup key; pairs inside one key are left out
+                because the exact-key pass has already compared them
+        """
+        blocks = defaultdict(list)
+        for position, name in enumerate(sorted_names):
+            scope = block_keys[position] if block_keys is not None else None
+            for token in set(name.split()):
+                blocks[(scope, token)].append(position)
+
+        pairs = set()
+        for members in blocks.values():
+            if len(members) < 2:
+                continue
+            if len(members) > self.max_block_size:
+                self.stats["skipped_blocks"] += 1
+                continue
+            for offset, first in enumerate(members):
+                for second in members[offset + 1:]:
+                    if group_keys is not None and group_keys[first] == group_keys[second]:
+                        continue
+                    pairs.add((first, second))
+
+        row_count = len(sorted_names)
+        total_pairs = row_count * (row_count - 1) // 2
+        self.stats["rows"] += row_count
+        self.stats["total_pairs"] += total_pairs
+        self.stats["candidate_pairs"] += len(pairs)
+        self.stats["pruned_pairs"] += total_pairs - len(pairs)
+        return sorted(pairs, key=lambda pair: (pair[1], pair[0]))
+
+
+class DedupResult:
+    """Outcome of BranchDeduplicator.deduplicate, expressed as row positions."""
+
+    def __init__(self, keep_positions, duplicate_of):
+        """
+        Args:
+            keep_positions: Sorted positions of the rows that survive deduplication
+            duplicate_of: Dict mapping each removed row position to the kept position it duplicates
+        """
+        self.keep_positions = keep_positions
+        self.duplicate_of = duplicate_of
+
+    def survivors(self, branches_df):
+        """Return the surviving rows of the frame the result was computed on."""
+        return branches_df.take(self.keep_positions)
+
+    def duplicate_pairs(self, branches_df):
+        """Return one row per removed branch with the index label and name of the branch it duplicates."""
+        removed = sorted(self.duplicate_of)
+        kept = [self.duplicate_of[position] for position in removed]
+        return pd.DataFrame(
+            {
+                "removed_index": branches_df.index[removed],
+                "removed_branch": branches_df["Branch Name"].to_numpy()[removed],
+                "kept_index": branches_df.index[kept],
+                "kept_branch": branches_df["Branch Name"].to_numpy()[kept],
+            }
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def _group_pairs(size):
+    """(earlier, later) positions of every pair in a key group of this size."""
+    earlier, later = np.triu_indices(size, 1)
+    return earlier.tolist(), later.tolist()
+
+
 class BranchDeduplicator:
     """Handles fuzzy matching to identify duplicate branches with similar names."""
+
+    # Label of sort_tokens + score_matrix in the score cache; bump when either changes
+    SCORER_VERSION = "token_sort_ratio-1"
+    # Key groups above this size are scored as one matrix rather than looked up pair by pair
+    CACHED_GROUP_LIMIT = 200
     
-    def __init__(self, similarity_threshold=85):
+    def __init__(self, similarity_threshold=85, batch_scoring=True, blocking_index=None, score_cache=None):
         """
         Args:
             similarity_threshold: Minimum similarity score (0-100) to consider branches as duplicates
+            batch_scoring: If True, pre-process every branch name once and score each key
+                group as a whole matrix instead of calling fuzzywuzzy pair by pair
+            blocking_index: Optional BranchBlockingIndex; when set, branches that survive
+                the exact-key pass are also fuzzy matched across keys
+            score_cache: Optional SimilarityCache; pair scores found there are not
+                computed again (batch scoring only)
         """
         self.similarity_threshold = similarity_threshold
+        self.batch_scoring = batch_scoring
+        self.blocking_index = blocking_index
+        self.score_cache = score_cache
+        self.comparisons = 0  # fuzzy scores computed so far (a matrix counts each distinct pair once)
     
     def are_similar(self, name1, name2):
         """Check if two branch names are similar using fuzzy matching."""
         # Use token sort ratio to handle word order differences
         similarity = fuzz.token_sort_ratio(name1.lower(), name2.lower())
         return similarity >= self.similarity_threshold
-    
+
+    @staticmethod
+    def sort_tokens(name):
+        """Return the lower-cased, token-sorted form token_sort_ratio compares."""
+        processed = fuzz_utils.full_process(str(name).lower(), force_ascii=True)
+        return " ".join(sorted(processed.split())).strip()
+
+    @staticmethod
+    def score_matrix(sorted_names):
+        """
+        Score every pair of pre-sorted names at once.
+
+        Returns an integer matrix equal to calling token_sort_ratio on each pair.
+        """
+        scores = rapid_process.cdist(
+            sorted_names, sorted_names, scorer=rapid_fuzz.ratio, dtype=np.float64
+        )
+        # fuzzywuzzy rounds with the builtin round(), which is half-to-even like rint
+        return np.rint(scores).astype(np.int16)
+
+    def pair_scores(self, firsts, seconds):
+        """
+        Score pre-sorted name pairs (firsts[i] against seconds[i]) like
+        score_matrix, taking whatever score_cache already has.
+
+        Returns:
+            int16 array of scores
+        """
+        if self.score_cache is None:
+            self.comparisons += len(firsts)
+            scores = rapid_process.cpdist(firsts, seconds, scorer=rapid_fuzz.ratio, dtype=np.float64)
+            return np.rint(scores).astype(np.int16)
+
+        keys = [SimilarityCache.pair_key(first, second) for first, second in zip(firsts, seconds)]
+        scores = self.score_cache.get_many(keys)
+        missing = [key for key in dict.fromkeys(keys) if key not in scores]
+        if missing:
+            computed = rapid_process.cpdist(
+                [first for first, _ in missing], [second for _, second in missing],
+                scorer=rapid_fuzz.ratio, dtype=np.float64,
+            )
+            computed = dict(zip(missing, np.rint(computed).astype(np.int16).tolist()))
+            self.score_cache.put_many(computed)
+            scores.update(computed)
+            self.comparisons += len(missing)
+        return np.fromiter((scores[key] for key in keys), dtype=np.int16, count=len(keys))
+
+    def _cached_group_scores(self, sorted_names, groups):
+        """
+        Lower-triangle score matrices for the key groups small enough to go
+        through the score cache, looked up in one batch.
+
+        Returns:
+            dict of group index -> matrix (only [later, earlier] cells are filled)
+        """
+        cached_groups = [
+            (index, positions) for index, positions in enumerate(groups)
+            if 1 < len(positions) <= self.CACHED_GROUP_LIMIT
+        ]
+        firsts = []
+        seconds = []
+        for _, positions in cached_groups:
+            earlier, later = _group_pairs(len(positions))
+            firsts.extend(sorted_names[positions[i]] for i in earlier)
+            seconds.extend(sorted_names[positions[j]] for j in later)
+        scores = self.pair_scores(firsts, seconds)
+
+        matrices = {}
+        start = 0
+        for index, positions in cached_groups:
+            earlier, later = _group_pairs(len(positions))
+            matrix = np.zeros((len(positions), len(positions)), dtype=np.int16)
+            matrix[later, earlier] = scores[start:start + len(earlier)]
+            start += len(earlier)
+            matrices[index] = matrix
+        return matrices
+
+    def _group_keys(self, branches_df, ignore_delivery_type):
+        """Return the exact key each row is grouped under before fuzzy comparison."""
+        if not ignore_delivery_type:
+            return branches_df["vendor_code"]
+        if "BranchNameNorm" in branches_df.columns:
+            return branches_df["BranchNameNorm"]
+        return map_unique_values(branches_df["Branch Name"], normalize_series)
+
+    def _sorted_names(self, branches_df):
+        """Token-sort every branch name, once per distinct value."""
+        codes, uniques = pd.factorize(branches_df["Branch Name"])
+        sorted_uniques = [self.sort_tokens(name) for name in uniques]
+        return [sorted_uniques[code] if code >= 0 else "" for code in codes]
+
     def deduplicate_branches(self, branches_df, ignore_delivery_type=False):
         """
         Deduplicate branches based on vendor_code and similar branch names.
@@ -228,30 +641,176 @@ class BranchDeduplicator:
         """
         if branches_df.empty:
             return pd.DataFrame(columns=branches_df.columns)
+        return self.deduplicate(branches_df, ignore_delivery_type).survivors(branches_df)
 
-        unique_branches = []
-        seen_groups = {}
+    def deduplicate(self, branches_df, ignore_delivery_type=False):
+        """
+        Deduplicate branches and return the surviving positions with a duplicate-of mapping.
 
-        for _, row in branches_df.iterrows():
-            branch_name = row["Branch Name"]
-            key = normalize_name(branch_name) if ignore_delivery_type else row["vendor_code"]
+        Args:
+            branches_df: DataFrame with branch information
+            ignore_delivery_type: If True, treat same branch with different delivery types as one
 
-            if key not in seen_groups:
-                seen_groups[key] = [row]
-                unique_branches.append(row)
+        Returns:
+            DedupResult whose positions refer to branches_df
+        """
+        if branches_df.empty:
+            return DedupResult(np.empty(0, dtype=np.intp), {})
+
+        keys = self._group_keys(branches_df, ignore_delivery_type)
+        if self.batch_scoring:
+            keep_positions, duplicate_of = self._batched_dedup(branches_df, keys)
+        else:
+            keep_positions, duplicate_of = self._pairwise_dedup(branches_df, keys)
+
+        if self.blocking_index is not None:
+            keep_positions = self._drop_cross_key_duplicates(
+                branches_df, keys, keep_positions, duplicate_of
+            )
+        return DedupResult(keep_positions, duplicate_of)
+
+    def _pairwise_dedup(self, branches_df, keys):
+        """Reference row-by-row path: compare each row with the kept rows of its key using are_similar."""
+        keep_positions = []
+        duplicate_of = {}
+        seen_groups = {}
+        branch_names = branches_df["Branch Name"].tolist()
+
+        for position, (key, branch_name) in enumerate(zip(keys, branch_names)):
+            if pd.isna(key) or key not in seen_groups:
+                if not pd.isna(key):
+                    seen_groups[key] = [position]
+                keep_positions.append(position)
                 continue
 
-            is_duplicate = False
-            for seen_branch in seen_groups[key]:
-                if self.are_similar(branch_name, seen_branch["Branch Name"]):
-                    is_duplicate = True
+            for seen_position in seen_groups[key]:
+                self.comparisons += 1
+                if self.are_similar(branch_name, branch_names[seen_position]):
+                    duplicate_of[position] = seen_position
                     break
-            
-            if not is_duplicate:
-                seen_groups[key].append(row)
-                unique_branches.append(row)
+            else:
+                seen_groups[key].append(position)
+                keep_positions.append(position)
+
+        return np.asarray(keep_positions, dtype=np.intp), duplicate_of
 
-        return pd.DataFrame(unique_branches) if unique_branches else pd.DataFrame(columns=branches_df.columns)
+    def _batched_dedup(self, branches_df, keys):
+        """
+        Batched path: score each key group as one matrix.
+
+        Rows are still walked in order within each key group so a row is only
+        compared against branches that were kept before it, and is recorded as a
+        duplicate of the first of them it matches, exactly like the pairwise path.
+        """
+        return self._keep_at_threshold(self._scored_groups(branches_df, keys), self.similarity_threshold)
+
+    def _scored_groups(self, branches_df, keys):
+        """
+        Yield (positions, scores) for every key group, in first-seen order.
+
+        scores is the group's score matrix, or None for rows that are kept
+        without comparison (a missing key, or alone under their key).
+        """
+        sorted_names = self._sorted_names(branches_df)
+        # Rows with a missing key never match an earlier row
+        yield np.flatnonzero(keys.isna().to_numpy()), None
+        groups = list(pd.Series(np.arange(len(keys))).groupby(keys.to_numpy(), sort=False).indices.values())
+        cached_scores = self._cached_group_scores(sorted_names, groups) if self.score_cache is not None else {}
+
+        for index, positions in enumerate(groups):
+            if len(positions) == 1:
+                yield positions, None
+                continue
+
+            scores = cached_scores.get(index)
+            if scores is None:
+                scores = self.score_matrix([sorted_names[pos] for pos in positions])
+                self.comparisons += len(positions) * (len(positions) - 1) // 2
+            yield positions, scores
+
+    @staticmethod
+    def _keep_at_threshold(scored_groups, threshold):
+        """Walk each scored key group in order and keep the rows that match no earlier kept row."""
+        keep_positions = []
+        duplicate_of = {}
+        for positions, scores in scored_groups:
+            if scores is None:
+                keep_positions.extend(positions)
+                continue
+            kept = [0]
+            for offset in range(1, len(positions)):
+                matches = np.flatnonzero(scores[offset, kept] >= threshold)
+                if len(matches):
+                    duplicate_of[int(positions[offset])] = int(positions[kept[matches[0]]])
+                else:
+                    kept.append(offset)
+            keep_positions.extend(positions[kept])
+        return np.sort(np.asarray(keep_positions, dtype=np.intp)), duplicate_of
+
+    def sweep_thresholds(self, branches_df, thresholds, ignore_delivery_type=False):
+        """
+        Deduplicate at several similarity thresholds, scoring every key group once.
+
+        Only the exact-key pass is swept: the cross-key pass scores different
+        pairs at each threshold, so a deduplicator with a blocking index is
+        rejected.
+
+        Returns:
+            dict of threshold -> DedupResult, each equal to deduplicate() with
+            that similarity_threshold
+        """
+        if self.blocking_index is not None:
+            raise ValueError("Threshold sweeps cover exact-key dedup only; use a deduplicator without a blocking index")
+        if branches_df.empty:
+            return {threshold: DedupResult(np.empty(0, dtype=np.intp), {}) for threshold in thresholds}
+
+        keys = self._group_keys(branches_df, ignore_delivery_type)
+        scored_groups = list(self._scored_groups(branches_df, keys))
+        return {
+            threshold: DedupResult(*self._keep_at_threshold(scored_groups, threshold))
+            for threshold in thresholds
+        }
+
+    def _drop_cross_key_duplicates(self, branches_df, keys, keep_positions, duplicate_of):
+        """
+        Drop surviving branches that fuzzy match an earlier survivor filed under a different key.
+
+        Only the candidate pairs proposed by the blocking index are scored. Rows
+        are walked in order, so a branch is dropped only when it matches an
+        earlier branch that is itself kept. Returns the new keep positions and
+        records the drops in duplicate_of.
+        """
+        if len(keep_positions) < 2:
+            return keep_positions
+
+        unique_df = branches_df.take(keep_positions)
+        sorted_names = self._sorted_names(unique_df)
+        block_keys = (
+            unique_df["Entity ID"].tolist() if "Entity ID" in unique_df.columns else None
+        )
+        group_keys = keys.take(keep_positions).tolist()
+
+        pairs = self.blocking_index.candidate_pairs(sorted_names, block_keys, group_keys)
+        if not pairs:
+            return keep_positions
+
+        scores = self.pair_scores(
+            [sorted_names[first] for first, _ in pairs],
+            [sorted_names[second] for _, second in pairs],
+        )
+
+        dropped = set()
+        for (first, second), score in zip(pairs, scores):
+            if score >= self.similarity_threshold and first not in dropped and second not in dropped:
+                dropped.add(second)
+                duplicate_of[int(keep_positions[second])] = int(keep_positions[first])
+        self.blocking_index.stats["matched_pairs"] += len(dropped)
+
+        if not dropped:
+            return keep_positions
+        keep_mask = np.ones(len(keep_positions), dtype=bool)
+        keep_mask[list(dropped)] = False
+        return keep_positions[keep_mask]
 
 
 class InvoiceGenerator:
@@ -271,11 +830,40 @@ class InvoiceGenerator:
         'HS_SA': 0.15,   # Saudi Arabia - 15% VAT (excluded anyway)
     }
     
-    def __init__(self, output_dir="invoices"):
+    INVOICE_TITLE = "MONTHLY INTEGRATION INVOICE"
+    BRANCH_SECTION_TITLE = "Branch Details"
+    PAYMENT_TERMS = "<i>Payment terms: Net 30 days from invoice date</i>"
+    
+    BRANCH_TABLE_HEADER = ['#', 'Vendor Code', 'Branch Name', 'Delivery Type', 'Rate (EUR)']
+    BRANCH_COL_WIDTHS = [0.5*inch, 1*inch, 3*inch, 1.2*inch, 1*inch]
+    
+    # Branch tables longer than this are streamed as fixed-size chunks
+    LARGE_INVOICE_THRESHOLD = 500
+    ROWS_PER_CHUNK = 24  # one letter page of rows; even so alternating row colours line up
+    
+    # "platypus" builds flowables; "canvas" draws the same layout directly (see invoice_canvas.py)
+    RENDERERS = ("platypus", "canvas")
+    
+    def __init__(self, output_dir="invoices", large_invoice_threshold=LARGE_INVOICE_THRESHOLD, rows_per_chunk=ROWS_PER_CHUNK, renderer="platypus"):
+        """
+        Args:
+            output_dir: Folder the PDFs are written to
+            large_invoice_threshold: Branch count above which the branch table is built
+                as a sequence of small tables instead of one (None disables chunking)
+            rows_per_chunk: Branch rows per table chunk in large-invoice mode
+            renderer: "platypus" (default) or "canvas" for the low-level fast path
+        """
+        if renderer not in self.RENDERERS:
+            raise ValueError(f"Unknown renderer {renderer!r}; expected one of {', '.join(self.RENDERERS)}")
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
+        self.large_invoice_threshold = large_invoice_threshold
+        self.rows_per_chunk = rows_per_chunk
+        self.renderer = renderer
+        self.manifest = ArtifactManifest(self.output_dir)
         self.styles = getSampleStyleSheet()
         self._setup_custom_styles()
+        self._canvas_renderer = None
     
     def _setup_custom_styles(self):
         """Setup custom paragraph styles for the invoice."""
@@ -322,6 +910,14 @@ class InvoiceGenerator:
         filename = f"{integrator_name.replace(' ', '_')}_{billing_year}_{billing_month}.pdf"
         filepath = self.output_dir / filename
         
+        if self.renderer == "canvas":
+            if self._canvas_renderer is None:
+                # Layout metrics are worked out once and reused for every invoice
+                self._canvas_renderer = CanvasInvoiceRenderer(self)
+            self._canvas_renderer.render(filepath, integrator_name, branches_df, billing_month, billing_year)
+            self._record_invoice(filepath, integrator_name, billing_month, billing_year)
+            return filepath
+        
         # Create PDF document
         doc = SimpleDocTemplate(
             str(filepath),
@@ -339,39 +935,64 @@ class InvoiceGenerator:
         elements.extend(self._create_header(integrator_name, billing_month, billing_year))
         
         # Add branch details table
-        elements.extend(self._create_branch_table(branches_df))
+        if self.use_chunked_tables(branches_df):
+            elements.extend(self._create_chunked_branch_tables(branches_df))
+        else:
+            elements.extend(self._create_branch_table(branches_df))
         
         # Add summary section
-        entity_breakdown = branches_df.groupby("Entity ID").size().to_dict()
+        entity_breakdown = branches_df.groupby("Entity ID", observed=True).size().to_dict()
         elements.extend(self._create_summary(branches_df, entity_breakdown))
         
         # Build PDF
         doc.build(elements)
+        self._record_invoice(filepath, integrator_name, billing_month, billing_year)
         
         return filepath
     
-    def _create_header(self, integrator_name, billing_month, billing_year):
-        """Create invoice header section."""
-        elements = []
-        
-        # Title
-        title = Paragraph(
-            "MONTHLY INTEGRATION INVOICE",
-            self.styles['CustomTitle']
+    def _record_invoice(self, filepath, integrator_name, billing_month, billing_year):
+        """Add a freshly written PDF to the output folder's artifact manifest."""
+        self.manifest.record_file(
+            filepath, integrator=integrator_name, period=billing_period_label(billing_month, billing_year)
         )
-        elements.append(title)
-        elements.append(Spacer(1, 0.3*inch))
+    
+    def build_period_archive(self, billing_month, billing_year):
+        """
+        Zip every invoice of a billing period once, after the month's invoices
+        are generated, into <output_dir>/archives/invoices_<year>_<month>.zip.
         
-        # Invoice details
+        Returns:
+            Path of the archive, or None if the period has no invoices
+        """
+        return build_period_archive(self.manifest, "pdf", billing_period_label(billing_month, billing_year))
+    
+    def use_chunked_tables(self, branches_df):
+        """Whether the branch table is laid out as fixed-size chunks (large-invoice mode); shared by both renderers."""
+        return self.large_invoice_threshold is not None and len(branches_df) > self.large_invoice_threshold
+    
+    def invoice_details(self, integrator_name, billing_month, billing_year):
+        """Label/value rows of the invoice details grid, for either renderer."""
         invoice_date = datetime.now().strftime("%B %d, %Y")
         invoice_number = f"INV-{billing_year}{datetime.now().month:02d}-{integrator_name.replace(' ', '')[:10].upper()}"
         
-        details_data = [
+        return [
             ['Invoice Number:', invoice_number],
             ['Invoice Date:', invoice_date],
             ['Billing Period:', f"{billing_month} {billing_year}"],
             ['Integrator:', integrator_name],
         ]
+    
+    def _create_header(self, integrator_name, billing_month, billing_year):
+        """Create invoice header section."""
+        elements = []
+        
+        # Title
+        title = Paragraph(self.INVOICE_TITLE, self.styles['CustomTitle'])
+        elements.append(title)
+        elements.append(Spacer(1, 0.3*inch))
+        
+        # Invoice details
+        details_data = self.invoice_details(integrator_name, billing_month, billing_year)
         
         details_table = Table(details_data, colWidths=[2*inch, 4*inch])
         details_table.setStyle(TableStyle([
@@ -395,11 +1016,11 @@ class InvoiceGenerator:
         elements = []
         
         # Section header
-        header = Paragraph("Branch Details", self.styles['SectionHeader'])
+        header = Paragraph(self.BRANCH_SECTION_TITLE, self.styles['SectionHeader'])
         elements.append(header)
         
         # Prepare table data
-        table_data = [['#', 'Vendor Code', 'Branch Name', 'Delivery Type', 'Rate (EUR)']]
+        table_data = [self.BRANCH_TABLE_HEADER]
         
         for idx, row in branches_df.iterrows():
             table_data.append([
@@ -411,11 +1032,59 @@ class InvoiceGenerator:
             ])
         
         # Create table
-        col_widths = [0.5*inch, 1*inch, 3*inch, 1.2*inch, 1*inch]
-        branch_table = Table(table_data, colWidths=col_widths, repeatRows=1)
+        branch_table = Table(table_data, colWidths=self.BRANCH_COL_WIDTHS, repeatRows=1)
+        branch_table.setStyle(self._branch_table_style())
         
-        # Style the table
-        branch_table.setStyle(TableStyle([
+        elements.append(branch_table)
+        elements.append(Spacer(1, 0.4*inch))
+        
+        return elements
+    
+    def _create_chunked_branch_tables(self, branches_df):
+        """
+        Create the branch details as a run of fixed-size tables, each with its own header.
+
+        Rows come straight from column arrays and every chunk is small enough
+        for the layout engine to place without splitting a huge table, so time
+        and memory stay roughly linear in the branch count.
+        """
+        elements = [Paragraph(self.BRANCH_SECTION_TITLE, self.styles['SectionHeader'])]
+        
+        numbers, vendor_codes, branch_names, delivery_types = self.branch_columns(branches_df)
+        rate = f"€{self.RATE_PER_BRANCH}"
+        style = self._branch_table_style()
+        
+        for start in range(0, len(branches_df), self.rows_per_chunk):
+            stop = start + self.rows_per_chunk
+            table_data = [self.BRANCH_TABLE_HEADER]
+            table_data.extend(
+                [number, vendor_code, branch_name, delivery_type, rate]
+                for number, vendor_code, branch_name, delivery_type in zip(
+                    numbers[start:stop],
+                    vendor_codes[start:stop],
+                    branch_names[start:stop],
+                    delivery_types[start:stop],
+                )
+            )
+            chunk_table = Table(table_data, colWidths=self.BRANCH_COL_WIDTHS, repeatRows=1)
+            chunk_table.setStyle(style)
+            elements.append(chunk_table)
+        
+        elements.append(Spacer(1, 0.4*inch))
+        return elements
+    
+    def branch_columns(self, branches_df):
+        """Row number, vendor code, branch name and delivery type columns as plain lists, for either renderer."""
+        return (
+            [str(idx + 1) for idx in branches_df.index],
+            branches_df['vendor_code'].astype(str).tolist(),
+            branches_df['Branch Name'].tolist(),
+            branches_df['Delivery Type'].tolist(),
+        )
+    
+    def _branch_table_style(self):
+        """Table style shared by the single branch table and its large-invoice chunks."""
+        return TableStyle([
             # Header row
             ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2c3e50')),
             ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
@@ -441,17 +1110,10 @@ class InvoiceGenerator:
             ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
             ('LEFTPADDING', (0, 0), (-1, -1), 6),
             ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-        ]))
-        
-        elements.append(branch_table)
-        elements.append(Spacer(1, 0.4*inch))
-        
-        return elements
+        ])
     
-    def _create_summary(self, branches_df, entity_breakdown):
-        """Create invoice summary section with tax calculation."""
-        elements = []
-        
+    def summary_data(self, branches_df, entity_breakdown):
+        """Label/value rows of the summary table (totals, per-entity tax, amount due), for either renderer."""
         # Calculate totals
         branch_count = len(branches_df)
         subtotal = branch_count * self.RATE_PER_BRANCH
@@ -496,6 +1158,13 @@ class InvoiceGenerator:
         summary_data.append(['', ''])
         summary_data.append(['TOTAL AMOUNT DUE:', f'€{total_amount:,.2f} EUR'])
         
+        return summary_data
+    
+    def _create_summary(self, branches_df, entity_breakdown):
+        """Create invoice summary section with tax calculation."""
+        elements = []
+        
+        summary_data = self.summary_data(branches_df, entity_breakdown)
         summary_table = Table(summary_data, colWidths=[4.5*inch, 2*inch])
         summary_table.setStyle(TableStyle([
             # Regular rows
@@ -521,168 +1190,968 @@ class InvoiceGenerator:
         elements.append(Spacer(1, 0.5*inch))
         
         # Footer note
-        footer_text = Paragraph(
-            "<i>Payment terms: Net 30 days from invoice date</i>",
-            self.styles['Normal']
-        )
+        footer_text = Paragraph(self.PAYMENT_TERMS, self.styles['Normal'])
         elements.append(footer_text)
         
         return elements
 
 
-def generate_integrator_csv(integrator_name, country_name, branches_df, output_root, billing_month, billing_year):
-    """Generate a CSV file for a specific integrator/country combination."""
-    period_dir = Path(output_root) / f"{billing_year}_{slugify(billing_month)}"
-    integrator_dir = period_dir / slugify(integrator_name)
-    integrator_dir.mkdir(parents=True, exist_ok=True)
+def export_csv_path(output_root, integrator_name, country_name, billing_month, billing_year):
+    """exports/<year>_<month>/<integrator>/<integrator>_<country>_<year>_<month>.csv"""
+    period_slug = billing_period_label(billing_month, billing_year)
+    integrator_slug = slugify(integrator_name)
+    filename = f"{integrator_slug}_{slugify(country_name)}_{period_slug}.csv"
+    return Path(output_root) / period_slug / integrator_slug / filename
 
-    filename = (
-        f"{slugify(integrator_name)}_{slugify(country_name)}_{billing_year}_{slugify(billing_month)}.csv"
-    )
-    filepath = integrator_dir / filename
 
+def export_columns(branches_df):
+    """Columns of an export CSV, in order: the ALLOWED_COLUMNS present, then Country."""
     ordered_columns = [col for col in ALLOWED_COLUMNS if col in branches_df.columns]
     if "Country" in branches_df.columns:
         ordered_columns.append("Country")
+    return ordered_columns
+
+
+def _write_partition(partition_df, paths):
+    """Render one partition to CSV once and write it to each of its paths; returns its size in bytes."""
+    data = partition_df.to_csv(index=False).encode("utf-8")
+    for path in paths:
+        with open(path, "wb", buffering=EXPORT_WRITE_BUFFER_BYTES) as handle:
+            handle.write(data)
+    return len(data)
+
+
+def write_partitioned_exports(cleaned_df, output_root, periods, workers=EXPORT_WRITE_WORKERS):
+    """
+    Write every integrator/country CSV of a cleaned frame in one sweep.
+
+    The frame is sorted once by (integrator, country, Branch Name, vendor_code)
+    and cut into contiguous partitions, which are rendered and written on a
+    thread pool. Each partition is rendered once and written to its file in
+    every period. File names come from export_csv_path; each file holds the
+    export_columns of its rows, sorted by Branch Name and vendor_code.
+
+    Args:
+        cleaned_df: Cleaned rows of one or more integrators
+        output_root: Export root (exports/)
+        periods: List of (billing_month, billing_year) pairs to write
+        workers: Writer threads
+
+    Returns:
+        List of dicts with integrator, country, rows, bytes and paths (a dict
+        keyed by period), in (integrator, country) order
+    """
+    countries = cleaned_df["Country"]
+    cleaned_df = cleaned_df[countries.notna() & (countries != "")]
+    if cleaned_df.empty:
+        return []
+
+    sort_columns = [
+        col for col in ("Integration Name", "Country", "Branch Name", "vendor_code") if col in cleaned_df.columns
+    ]
+    sorted_df = cleaned_df.sort_values(sort_columns, kind="stable")
+    export_df = sorted_df.loc[:, export_columns(sorted_df)]
+
+    # Partition boundaries from the (categorical) codes, not the strings
+    integrator_codes = pd.factorize(sorted_df["Integration Name"])[0]
+    country_codes = pd.factorize(sorted_df["Country"])[0]
+    boundaries = np.flatnonzero(
+        (integrator_codes[1:] != integrator_codes[:-1]) | (country_codes[1:] != country_codes[:-1])
+    ) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(sorted_df)]))
+
+    integrators = sorted_df["Integration Name"]
+    countries = sorted_df["Country"]
+    partitions = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        integrator_name, country_name = integrators.iloc[start], countries.iloc[start]
+        paths = {
+            (billing_month, billing_year): export_csv_path(
+                output_root, integrator_name, country_name, billing_month, billing_year
+            )
+            for billing_month, billing_year in periods
+        }
+        partitions.append(
+            {"integrator": integrator_name, "country": country_name, "rows": end - start, "paths": paths}
+        )
 
-    export_df = branches_df.loc[:, ordered_columns]
-    sort_columns = [col for col in ("Branch Name", "vendor_code") if col in export_df.columns]
-    if sort_columns:
-        export_df = export_df.sort_values(sort_columns)
-
-    export_df.to_csv(filepath, index=False)
-    return filepath
-
+    for directory in {path.parent for partition in partitions for path in partition["paths"].values()}:
+        directory.mkdir(parents=True, exist_ok=True)
 
-def process_uploaded_csv(csv_path):
-    """Load, validate, and filter the uploaded CSV."""
-    raw_df = pd.read_csv(csv_path)
-    print(f"📄 Loaded {len(raw_df)} total records from {csv_path}")
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="export-writer") as pool:
+        sizes = pool.map(
+            _write_partition,
+            [export_df.iloc[start:end] for start, end in zip(starts.tolist(), ends.tolist())],
+            [list(partition["paths"].values()) for partition in partitions],
+        )
+        for partition, size in zip(partitions, sizes):
+            partition["bytes"] = size
+    return partitions
+
+
+def resolve_source_columns(source_columns):
+    """
+    Map each ALLOWED_COLUMNS name to the header used for it in the source CSV.
+
+    An exact header wins; otherwise headers are matched case and punctuation
+    insensitively, so the export's "orders" header feeds "Orders".
+    """
+    normalized_headers = {}
+    for header in source_columns:
+        normalized_headers.setdefault(normalize_name(header), header)
+
+    resolved = {}
+    for column in ALLOWED_COLUMNS:
+        if column in source_columns:
+            resolved[column] = column
+        elif normalize_name(column) in normalized_headers:
+            resolved[column] = normalized_headers[normalize_name(column)]
+    return resolved
+
+
+def _filter_ingest_chunk(chunk, resolved, missing_columns):
+    """
+    Rename, type and filter one chunk of the source CSV.
+
+    Returns:
+        (chunk, KSA rows removed, {column: non-numeric values coerced to missing})
+    """
+    chunk = chunk.rename(columns={source: column for column, source in resolved.items()})
+    for col in missing_columns:
+        chunk[col] = pd.NA
+
+    chunk["Integration Name"] = chunk["Integration Name"].fillna("").astype(str)
+    coerced = {}
+    for column in INGEST_INTEGER_COLUMNS:
+        values = pd.to_numeric(chunk[column], errors="coerce")
+        values = values.where(values % 1 == 0)  # "12.5" is not a count or an ID either
+        present = chunk[column].notna() & (chunk[column].astype(str).str.strip() != "")
+        coerced[column] = int((values.isna() & present).sum())
+        chunk[column] = values.astype("Int64")
+    for column in CATEGORICAL_COLUMNS:
+        if column != "Country":
+            chunk[column] = chunk[column].astype("category")
+    chunk["Country"] = map_categories(chunk["Entity ID"], COUNTRY_MAP)
+
+    has_integration = map_unique_values(chunk["Integration Name"], lambda names: names.str.strip() != "")
+    is_ksa = chunk["Entity ID"] == "HS_SA"
+    keep = has_integration & ~is_ksa & chunk["Entity ID"].notna() & chunk["Country"].notna()
+    return chunk.loc[keep, ALLOWED_COLUMNS + ["Country"]], int((has_integration & is_ksa).sum()), coerced
+
+
+def process_uploaded_csv(csv_path, chunksize=INGEST_CHUNK_ROWS):
+    """
+    Load, validate, and filter the uploaded CSV.
+
+    Only the ALLOWED_COLUMNS are parsed, with the types in INGEST_DTYPES, and the
+    file is read in chunks of `chunksize` rows that are filtered before being
+    kept, so memory follows the billable rows rather than the size of the export.
+    The derived columns from add_derived_columns are added to the result.
+    """
+    source_columns = list(pd.read_csv(csv_path, nrows=0).columns)
+    resolved = resolve_source_columns(source_columns)
+
+    missing_columns = [col for col in ALLOWED_COLUMNS if col not in resolved]
+
+    reader = pd.read_csv(
+        csv_path,
+        usecols=list(resolved.values()),
+        dtype={source: INGEST_DTYPES[column] for column, source in resolved.items()},
+        chunksize=chunksize,
+    )
 
-    missing_columns = [col for col in ALLOWED_COLUMNS if col not in raw_df.columns]
+    total_rows = 0
+    ksa_rows = 0
+    coerced_rows = dict.fromkeys(INGEST_INTEGER_COLUMNS, 0)
+    chunks = []
+    for chunk in reader:
+        total_rows += len(chunk)
+        chunk, chunk_ksa_rows, chunk_coerced = _filter_ingest_chunk(chunk, resolved, missing_columns)
+        ksa_rows += chunk_ksa_rows
+        for column, count in chunk_coerced.items():
+            coerced_rows[column] += count
+        chunks.append(chunk)
+
+    print(f"📄 Loaded {total_rows} total records from {csv_path}")
     if missing_columns:
         print(f"⚠️  Missing columns in source CSV: {', '.join(missing_columns)} (will be created as empty)")
-    for col in missing_columns:
-        raw_df[col] = pd.NA
-
-    df = raw_df[ALLOWED_COLUMNS].copy()
-    df["Integration Name"] = df["Integration Name"].fillna("").astype(str)
-    df = df[df["Integration Name"].str.strip() != ""].copy()
-
-    df["Orders"] = pd.to_numeric(df["Orders"], errors="coerce")
-    df["Country"] = df["Entity ID"].map(COUNTRY_MAP)
-
-    # Exclude KSA rows
-    pre_filter_count = len(df)
-    df = df[df["Entity ID"] != "HS_SA"].copy()
-    print(f"✓ Removed {pre_filter_count - len(df)} KSA rows (Entity ID HS_SA)")
-
-    # Drop rows with no valid country
-    df = df.dropna(subset=["Entity ID", "Country"])
+    print(f"✓ Removed {ksa_rows} KSA rows (Entity ID HS_SA)")
+    for column, count in coerced_rows.items():
+        if count:
+            print(f"⚠️  {count} non-numeric {column} values read as missing")
+
+    if chunks:
+        unify_categories(chunks, CATEGORICAL_COLUMNS)
+        df = pd.concat(chunks)
+    else:
+        df = pd.DataFrame(columns=ALLOWED_COLUMNS + ["Country"])
     if df.empty:
         print("❌ No usable rows after initial filtering")
         return pd.DataFrame()
     
+    return add_derived_columns(df)
+
+
+def file_content_hash(path, block_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _ingest_schema_fingerprint():
+    """Short hash of everything that shapes the ingested frame besides the file itself."""
+    schema = repr((INGEST_SCHEMA_VERSION, ALLOWED_COLUMNS, sorted(INGEST_DTYPES.items(), key=str), sorted(COUNTRY_MAP.items())))
+    return hashlib.sha256(schema.encode()).hexdigest()[:12]
+
+
+def load_source_frame(csv_path, cache_dir=INGEST_CACHE_DIR, use_cache=True):
+    """
+    Return process_uploaded_csv(csv_path), reusing a cached snapshot when possible.
+
+    Snapshots are uncompressed Arrow (Feather) files named after the source
+    file's content hash and the ingest schema fingerprint. They are read back
+    memory-mapped, so a changed file or schema simply misses the cache. Only the
+    most recent INGEST_CACHE_MAX_SNAPSHOTS snapshots are kept.
+    """
+    if not use_cache or pa is None:
+        return process_uploaded_csv(csv_path)
+
+    cache_dir = Path(cache_dir)
+    content_hash = file_content_hash(csv_path)
+    snapshot_path = cache_dir / f"{content_hash}-{_ingest_schema_fingerprint()}.arrow"
+
+    if snapshot_path.exists():
+        try:
+            df = feather.read_table(snapshot_path, memory_map=True).to_pandas()
+        except (OSError, pa.ArrowInvalid) as e:
+            print(f"⚠️  Ignoring unreadable ingest snapshot {snapshot_path.name}: {e}")
+        else:
+            snapshot_path.touch()
+            print(f"⚡ Loaded {len(df)} usable records for {csv_path} from snapshot {content_hash[:12]}")
+            return df
+
+    df = process_uploaded_csv(csv_path)
+    if df.empty:
+        return df
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # A unique temp file per writer: concurrent jobs on the same source must not share one
+    with tempfile.NamedTemporaryFile(
+        dir=cache_dir, prefix=f".{snapshot_path.stem}-", suffix=".tmp", delete=False
+    ) as handle:
+        temp_path = Path(handle.name)
+    try:
+        feather.write_feather(
+            pa.Table.from_pandas(df, preserve_index=True), temp_path, compression="uncompressed"
+        )
+        os.replace(temp_path, snapshot_path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+    snapshots = sorted(cache_dir.glob("*.arrow"), key=lambda path: path.stat().st_mtime, reverse=True)
+    for stale_snapshot in snapshots[INGEST_CACHE_MAX_SNAPSHOTS:]:
+        stale_snapshot.unlink(missing_ok=True)
+
     return df
 
 
-def process_csv_and_generate_invoices(csv_path, billing_month=None, billing_year=None):
-    """Process the source CSV, enforce business rules, and export per-country CSVs."""
+def export_integrator_periods(integrator_name, integrator_df, deduplicator, output_root, periods, metrics=None,
+                              ledger=None):
+    """
+    Apply business rules to one integrator once and write its per-country CSVs
+    for each billing period. The cleaned rows don't depend on the period, so
+    extra periods only cost the CSV writes.
+
+    Args:
+        periods: List of distinct (billing_month, billing_year) pairs
+        metrics: Optional dict; receives the integrator's wall time, peak RSS,
+            row counts (see apply_business_rules), files and bytes_written
+        ledger: Optional BillingLedger; the exported rows replace the
+            integrator's rows there for each period
+
+    Returns:
+        dict mapping each (billing_month, billing_year) pair to its exports
+    """
+    if metrics is None:
+        metrics = {}
+    metrics.update(integrator=integrator_name, files=0, bytes_written=0)
+    with measure(metrics):
+        # Apply business rules and get the cleaned DataFrame
+        cleaned_df = apply_business_rules(integrator_name, integrator_df, deduplicator, metrics)
+
+        if ledger is not None:
+            # Same rows as the CSVs: write_partitioned_exports drops rows without a country
+            billed_df = cleaned_df
+            if not cleaned_df.empty:
+                billed_df = cleaned_df[cleaned_df["Country"].notna() & (cleaned_df["Country"] != "")]
+            for billing_month, billing_year in periods:
+                ledger.replace_integrator_period(
+                    billing_period_label(billing_month, billing_year), integrator_name, billed_df
+                )
+
+        if cleaned_df.empty:
+            return {period: [] for period in periods}
+
+        partitions = write_partitioned_exports(cleaned_df, output_root, periods)
+        exports = {}
+        for period in periods:
+            if len(periods) > 1:
+                print(f"  • {period[0]} {period[1]}:")
+            exports[period] = []
+            for partition in partitions:
+                csv_output_path = partition["paths"][period]
+                print(
+                    f"    - {partition['country']}: {partition['rows']} branches -> "
+                    f"{csv_output_path.relative_to(output_root)}"
+                )
+                metrics["files"] += 1
+                metrics["bytes_written"] += partition["bytes"]
+                exports[period].append(
+                    {
+                        "Integrator": integrator_name,
+                        "Country": partition["country"],
+                        "Branches": partition["rows"],
+                        "CSV": str(csv_output_path.relative_to(output_root)),
+                    }
+                )
+
+        print()
+        return exports
+
+
+def _export_integrator_buffered(job):
+    """Process-pool entry point: run export_integrator_periods and return its exports, console output and metrics."""
+    *arguments, ledger = job
+    buffer = io.StringIO()
+    metrics = {}
+    with contextlib.redirect_stdout(buffer):
+        exports = export_integrator_periods(*arguments, metrics=metrics, ledger=ledger)
+    return exports, buffer.getvalue(), metrics
+
+
+def submit_integrators(pool, integrator_groups, deduplicator, periods, ledger=None):
+    """
+    Submit integrators to a process pool, largest first, so they don't end up as
+    the long tail. periods maps each integrator name to the (billing_month,
+    billing_year) pairs to write for it. Returns futures keyed by integrator
+    name; each resolves to (exports by period, buffered console log,
+    integrator metrics). Workers write to ledger, if given, themselves.
+    """
+    futures = {}
+    for integrator_name, integrator_df in sorted(integrator_groups, key=lambda group: -len(group[1])):
+        futures[integrator_name] = pool.submit(
+            _export_integrator_buffered,
+            (integrator_name, integrator_df, deduplicator, OUTPUT_DIR, periods[integrator_name], ledger),
+        )
+    return futures
+
+
+def integrator_fingerprint(integrator_name, integrator_df, deduplicator):
+    """
+    Hash an integrator's input rows together with the rule and threshold config.
+
+    Rows are hashed in order: deduplication keeps the first of each duplicate
+    set, so reordered input may bill different rows.
+    """
+    blocking_index = deduplicator.blocking_index
+    config = (
+        BILLING_RULES_VERSION,
+        INGEST_SCHEMA_VERSION,
+        sorted(INTEGRATOR_RULES.get(slugify(integrator_name), set())),
+        [(rule["reason"], rule["entity_id"]) for rule in get_compiled_exclusion_rules()],
+        get_exclusion_matcher().fingerprint,
+        deduplicator.similarity_threshold,
+        blocking_index.max_block_size if blocking_index is not None else None,
+        list(integrator_df.columns),
+    )
+    digest = hashlib.sha256(repr(config).encode())
+    digest.update(pd.util.hash_pandas_object(integrator_df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def load_billing_state(state_path):
+    """Read the per-integrator fingerprints and exports saved by the previous run."""
+    try:
+        return json.loads(Path(state_path).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_billing_state(state_path, state):
+    """Atomically write the per-integrator fingerprints and exports for the next run."""
+    state_path = Path(state_path)
+    temp_path = state_path.with_suffix(".tmp")
+    temp_path.write_text(json.dumps(state, indent=2, sort_keys=True))
+    temp_path.replace(state_path)
+
+
+def _reusable_exports(previous, fingerprint, output_root, in_ledger=True):
+    """
+    Return the previous run's exports if the fingerprint matches and every CSV
+    is still on disk. Exports whose rows are missing from the billing ledger
+    (in_ledger False) are not reused, so the rerun records them.
+    """
+    if not previous or previous.get("fingerprint") != fingerprint:
+        return None
+    exports = previous.get("exports", [])
+    if not all((Path(output_root) / export["CSV"]).exists() for export in exports):
+        return None
+    if exports and not in_ledger:
+        return None
+    return exports
+
+
+def process_csv_and_generate_invoices(
+    csv_path,
+    billing_month=None,
+    billing_year=None,
+    cross_key_dedup=False,
+    workers=None,
+    use_cache=True,
+    incremental=False,
+    progress=None,
+    build_archive=False,
+    score_cache=False,
+):
+    """
+    Process the source CSV, enforce business rules, and export per-country CSVs.
+
+    With cross_key_dedup=True, near-duplicate branch names filed under different
+    vendor codes (or normalized names for Grubtech) are also merged, using a
+    BranchBlockingIndex to keep the number of fuzzy comparisons close to linear.
+
+    With workers > 1, integrators are processed in a pool of that many processes;
+    the summary and console log keep the serial order.
+
+    The cleaned source frame is reused from the ingest snapshot cache unless
+    use_cache=False.
+
+    Every run saves a fingerprint of each integrator's input rows and rule config
+    in exports/<year>_<month>/.billing_state.json. With incremental=True,
+    integrators whose fingerprint is unchanged are skipped and their previous
+    summary rows are reused.
+
+    progress, if given, is called with a dict per step: {"stage": "started",
+    "total": <integrators>} once the integrators are known, then
+    {"stage": "integrator", "integrator", "done", "total", "branches",
+    "reused"} as each one finishes, in summary order.
+
+    With build_archive=True, the period's CSVs are also zipped once into
+    exports/archives/exports_<year>_<month>.zip, which the dashboard serves
+    as a static file for period downloads.
+
+    With score_cache=True, fuzzy scores of branch name pairs are kept in
+    .score_cache.sqlite3 (see similarity_cache.SimilarityCache), so a run only
+    scores pairs that earlier runs have not seen.
+
+    Every integrator's exported rows are also recorded in the billing ledger,
+    exports/.billing_ledger.sqlite3, replacing its rows for the period (see
+    billing_ledger.BillingLedger).
+
+    Each run (failed ones included) appends a run record to
+    exports/.run_metrics.jsonl: wall time, rows in/out and peak RSS per stage,
+    and per integrator the rows excluded per rule, fuzzy comparisons, files and
+    bytes written (see run_metrics.RunMetrics).
+
+    To bill several periods, use process_billing_batch, which shares the
+    loading and deduplication between them.
+    """
 
     if billing_month is None:
         billing_month = datetime.now().strftime("%B")
     if billing_year is None:
         billing_year = datetime.now().year
 
+    summaries = _run_with_metrics(
+        csv_path, [(billing_month, billing_year)], cross_key_dedup, workers, use_cache, incremental, progress,
+        build_archive, score_cache,
+    )
+    return summaries[billing_period_label(billing_month, billing_year)]
+
+
+def process_billing_batch(
+    periods,
+    csv_path=None,
+    cross_key_dedup=False,
+    workers=None,
+    use_cache=True,
+    incremental=False,
+    build_archive=False,
+    score_cache=False,
+):
+    """
+    Bill several periods (re-billing, audits, back-fills) in one pass per source.
+
+    Each distinct source CSV (by content hash) is loaded, filtered and
+    deduplicated once, and its cleaned rows are written to
+    exports/<year>_<month>/ for every period billed from it. Options are as for
+    process_csv_and_generate_invoices; each source gets one run record.
+
+    Args:
+        periods: List of (billing_month, billing_year) or
+            (csv_path, billing_month, billing_year) tuples
+        csv_path: Source CSV for periods that don't name their own
+
+    Returns:
+        dict mapping each period label ("2025_september") to its summary
+        DataFrame, in the order the periods were given
+
+    Raises:
+        ValueError: A period has no source, or is billed from two different sources
+    """
+    sources = {}
+    source_of_period = {}
+    for period in periods:
+        if len(period) == 3:
+            period_csv, billing_month, billing_year = period
+        else:
+            (billing_month, billing_year), period_csv = period, csv_path
+        if period_csv is None:
+            raise ValueError(f"No source CSV given for {billing_month} {billing_year}")
+
+        content_hash = file_content_hash(period_csv)
+        label = billing_period_label(billing_month, billing_year)
+        if source_of_period.setdefault(label, content_hash) != content_hash:
+            raise ValueError(f"{billing_month} {billing_year} is billed from two different source files")
+        source = sources.setdefault(content_hash, {"csv_path": period_csv, "periods": {}})
+        source["periods"].setdefault(label, (billing_month, billing_year))
+
+    summaries = {}
+    for source in sources.values():
+        summaries.update(
+            _run_with_metrics(
+                source["csv_path"], list(source["periods"].values()), cross_key_dedup, workers, use_cache,
+                incremental, None, build_archive, score_cache,
+            )
+        )
+    return {label: summaries[label] for label in source_of_period}
+
+
+def billing_period_label(billing_month, billing_year):
+    """Export folder name of a billing period, e.g. "2025_september"."""
+    return f"{billing_year}_{slugify(billing_month)}"
+
+
+def parse_billing_period(spec):
+    """
+    Parse a period given as "September 2025" or "2025-09".
+
+    Returns:
+        (billing_month, billing_year) with the full month name
+
+    Raises:
+        ValueError: Unrecognised period
+    """
+    for period_format in ("%B %Y", "%b %Y", "%Y-%m"):
+        try:
+            parsed = datetime.strptime(spec.strip(), period_format)
+        except ValueError:
+            continue
+        return parsed.strftime("%B"), parsed.year
+    raise ValueError(f"Unrecognised billing period: {spec!r} (use e.g. \"September 2025\" or 2025-09)")
+
+
+def billed_amount(branches_df):
+    """Amount due for a set of billed branches: the per-branch rate plus each entity's VAT."""
+    counts = branches_df["Entity ID"].value_counts()
+    return round(
+        sum(
+            count * InvoiceGenerator.RATE_PER_BRANCH * (1 + InvoiceGenerator.TAX_RATES.get(entity_id, 0.00))
+            for entity_id, count in counts.items()
+        ),
+        2,
+    )
+
+
+def sweep_dedup_thresholds(csv_path, thresholds=SWEEP_THRESHOLDS, use_cache=True, score_cache=False):
+    """
+    What-if billing at several similarity thresholds, with delivery type kept and ignored.
+
+    Exclusions run once for the whole frame. Each integrator's key groups are
+    scored once per grouping mode, and every threshold reuses those scores, so
+    a sweep costs about two dedup runs however many thresholds it covers.
+
+    Returns:
+        DataFrame with one row per integrator, grouping mode and threshold:
+        Integrator, Delivery Type ("kept" or "ignored"), Billed Mode (whether the
+        integrator's rules bill in this mode), Threshold, Branches and Amount
+    """
+    df = load_source_frame(csv_path, use_cache=use_cache)
+    df = df[df["IntegratorSlug"].isin(list(INTEGRATOR_RULES.keys()))]
+    df = df[evaluate_exclusions(df).to_numpy() == ""]
+
+    score_cache = SimilarityCache(SCORE_CACHE_PATH, BranchDeduplicator.SCORER_VERSION) if score_cache else None
+    deduplicator = BranchDeduplicator(score_cache=score_cache)
+    rows = []
+    for integrator_name, integrator_df in df.groupby("Integration Name", sort=True, observed=True):
+        rules = INTEGRATOR_RULES.get(slugify(integrator_name), set())
+        for ignore_delivery_type in (False, True):
+            results = deduplicator.sweep_thresholds(integrator_df, thresholds, ignore_delivery_type)
+            for threshold, result in results.items():
+                survivors = result.survivors(integrator_df)
+                rows.append({
+                    "Integrator": integrator_name,
+                    "Delivery Type": "ignored" if ignore_delivery_type else "kept",
+                    "Billed Mode": ignore_delivery_type == ("grubtech" in rules),
+                    "Threshold": threshold,
+                    "Branches": len(survivors),
+                    "Amount": billed_amount(survivors),
+                })
+    if score_cache is not None:
+        score_cache.close()
+    return pd.DataFrame(rows, columns=["Integrator", "Delivery Type", "Billed Mode", "Threshold", "Branches", "Amount"])
+
+
+def format_threshold_sweep(sweep):
+    """
+    Render a sweep_dedup_thresholds table as one comparison table: a row per
+    integrator and grouping mode (* marks the mode it is billed in), a column
+    per threshold, and a total of the billed modes.
+    """
+    if sweep.empty:
+        return "No billable rows to sweep."
+    thresholds = sorted(sweep["Threshold"].unique())
+    cell = sweep.assign(Cell=[f"{branches:,} (€{amount:,.2f})" for branches, amount in zip(sweep["Branches"], sweep["Amount"])])
+    table = cell.pivot(index=["Integrator", "Delivery Type"], columns="Threshold", values="Cell")
+    billed = sweep[sweep["Billed Mode"]].set_index(["Integrator", "Delivery Type"]).index.unique()
+    table.index = [
+        f"{integrator} [{mode}]" + (" *" if (integrator, mode) in billed else "")
+        for integrator, mode in table.index
+    ]
+    totals = sweep[sweep["Billed Mode"]].groupby("Threshold")[["Branches", "Amount"]].sum()
+    table.loc["TOTAL (billed modes)"] = [
+        f"{totals.loc[threshold, 'Branches']:,} (€{totals.loc[threshold, 'Amount']:,.2f})" for threshold in thresholds
+    ]
+    table.columns = [f"threshold {threshold}" for threshold in thresholds]
+    return table.to_string()
+
+
+def _run_with_metrics(csv_path, periods, cross_key_dedup, workers, use_cache, incremental, progress, build_archive,
+                      score_cache):
+    """Run _process_billing_run and append its run record, whether it succeeds or fails."""
+    run_metrics = RunMetrics(
+        period=", ".join(billing_period_label(month, year) for month, year in periods),
+        source=str(csv_path),
+        options={
+            "workers": workers,
+            "incremental": incremental,
+            "cross_key_dedup": cross_key_dedup,
+            "use_cache": use_cache,
+            "score_cache": score_cache,
+        },
+    )
+    try:
+        summaries = _process_billing_run(
+            csv_path, periods, cross_key_dedup, workers, use_cache, incremental, progress, build_archive,
+            score_cache, run_metrics,
+        )
+    except Exception as e:
+        run_metrics.finish("failed", str(e))
+        append_run_record(OUTPUT_DIR / RUN_METRICS_FILENAME, run_metrics.record)
+        raise
+    run_metrics.finish()
+    append_run_record(OUTPUT_DIR / RUN_METRICS_FILENAME, run_metrics.record)
+    return summaries
+
+
+def _process_billing_run(csv_path, periods, cross_key_dedup, workers, use_cache, incremental, progress,
+                         build_archive, score_cache, run_metrics):
+    """
+    Bill one source for a list of distinct (billing_month, billing_year) periods.
+
+    Returns:
+        dict mapping each period label to its summary DataFrame
+    """
+    labels = [billing_period_label(month, year) for month, year in periods]
+    single_period = len(periods) == 1
+
     print(f"\n{'='*70}")
     print("POS BILLING DATA EXPORTER")
     print(f"{'='*70}")
-    print(f"Billing Period : {billing_month} {billing_year}")
+    if single_period:
+        print(f"Billing Period : {periods[0][0]} {periods[0][1]}")
+    else:
+        print(f"Billing Periods: {', '.join(f'{month} {year}' for month, year in periods)}")
     print(f"Source CSV    : {csv_path}")
     print(f"Output Folder : {OUTPUT_DIR.resolve()}")
     print(f"{'='*70}\n")
 
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    df = process_uploaded_csv(csv_path)
+    with run_metrics.stage("ingest") as stage:
+        df = load_source_frame(csv_path, use_cache=use_cache)
+        stage["rows_out"] = len(df)
     if df.empty:
-        return pd.DataFrame(columns=["Integrator", "Country", "Branches", "CSV"])
-
-    allowed_integrators = list(INTEGRATOR_RULES.keys())
-    df["IntegratorSlug"] = df["Integration Name"].apply(slugify)
-    df = df[df["IntegratorSlug"].isin(allowed_integrators)]
-
-    deduplicator = BranchDeduplicator(similarity_threshold=85)
-
-    exports = []
-    integrator_groups = df.groupby("Integration Name", sort=True)
-
-    for integrator_name, integrator_df in integrator_groups:
-        # Apply business rules and get the cleaned DataFrame
-        cleaned_df = apply_business_rules(integrator_name, integrator_df, deduplicator)
-
-        if cleaned_df.empty:
-            continue
-
-        # Generate per-country CSVs from the cleaned data
-        for country_name, country_df in cleaned_df.groupby("Country", sort=True):
-            if not country_name or country_df.empty:
-                continue
-
-            csv_output_path = generate_integrator_csv(
-                integrator_name,
-                country_name,
-                country_df,
-                OUTPUT_DIR,
-                billing_month,
-                billing_year,
-            )
+        return {label: pd.DataFrame(columns=["Integrator", "Country", "Branches", "CSV"]) for label in labels}
+
+    with run_metrics.stage("filter", rows_in=len(df)) as stage:
+        allowed_integrators = list(INTEGRATOR_RULES.keys())
+        df = df[df["IntegratorSlug"].isin(allowed_integrators)]
+        stage["rows_out"] = len(df)
+
+    with run_metrics.stage("exclusions", rows_in=len(df)) as stage:
+        df = df.assign(ExcludedBy=evaluate_exclusions(df))
+        excluded = df["ExcludedBy"] != ""
+        stage["rows_excluded"] = int(excluded.sum())
+        stage["excluded_by_rule"] = {
+            reason: int(count) for reason, count in df["ExcludedBy"][excluded].value_counts().sort_index().items()
+        }
+
+    blocking_index = BranchBlockingIndex() if cross_key_dedup else None
+    score_cache = SimilarityCache(SCORE_CACHE_PATH, BranchDeduplicator.SCORER_VERSION) if score_cache else None
+    deduplicator = BranchDeduplicator(similarity_threshold=85, blocking_index=blocking_index, score_cache=score_cache)
+    ledger = BillingLedger(OUTPUT_DIR / LEDGER_FILENAME)
+
+    state_paths = {label: OUTPUT_DIR / label / BILLING_STATE_FILENAME for label in labels}
+    with run_metrics.stage("planning") as stage:
+        integrator_groups = list(df.groupby("Integration Name", sort=True, observed=True))
+        previous_states = {
+            label: load_billing_state(state_path) if incremental else {} for label, state_path in state_paths.items()
+        }
+        billing_states = {label: {} for label in labels}
+        reused_exports = {label: {} for label in labels}
+        pending_periods = {}  # integrator -> periods it has to be written for
+        ledger_integrators = {label: ledger.billed_integrators(label) if incremental else set() for label in labels}
+        for integrator_name, integrator_df in integrator_groups:
+            fingerprint = integrator_fingerprint(integrator_name, integrator_df, deduplicator)
+            for period, label in zip(periods, labels):
+                billing_states[label][integrator_name] = {"fingerprint": fingerprint}
+                previous_exports = _reusable_exports(
+                    previous_states[label].get(integrator_name), fingerprint, OUTPUT_DIR,
+                    in_ledger=integrator_name in ledger_integrators[label],
+                )
+                if previous_exports is None:
+                    pending_periods.setdefault(integrator_name, []).append(period)
+                else:
+                    reused_exports[label][integrator_name] = previous_exports
+        pending_groups = [group for group in integrator_groups if group[0] in pending_periods]
+        stage.update(integrators=len(integrator_groups), reused=len(integrator_groups) - len(pending_groups))
+
+    if progress is not None:
+        progress({"stage": "started", "total": len(integrator_groups)})
+
+    parallel = bool(workers and workers > 1 and len(pending_groups) > 1)
+    exports = {label: [] for label in labels}
+    written_exports = {label: [] for label in labels}
+    with (
+        run_metrics.stage("integrators", rows_in=len(df), parallel=parallel) as stage,
+        ProcessPoolExecutor(max_workers=workers) if parallel else contextlib.nullcontext() as pool,
+    ):
+        futures = (
+            submit_integrators(pool, pending_groups, deduplicator, pending_periods, ledger) if parallel else {}
+        )
 
+        for done, (integrator_name, integrator_df) in enumerate(integrator_groups, start=1):
+            reused = integrator_name not in pending_periods
+            written = {}
+            if reused:
+                reused_count = sum(len(reused_exports[label][integrator_name]) for label in labels)
+                print(f"Processing integrator: {integrator_name} ({len(integrator_df)} rows)")
+                print(f"  • Input unchanged since last run, reusing {reused_count} export(s)\n")
+                integrator_metrics = {
+                    "integrator": integrator_name,
+                    "reused": True,
+                    "seconds": 0,
+                    "rows_in": len(integrator_df),
+                    "rows_out": sum(
+                        export["Branches"] for label in labels for export in reused_exports[label][integrator_name]
+                    ),
+                }
+            elif integrator_name in futures:
+                written, log, integrator_metrics = futures[integrator_name].result()
+                print(log, end="")
+            else:
+                integrator_metrics = {}
+                written = export_integrator_periods(
+                    integrator_name, integrator_df, deduplicator, OUTPUT_DIR, pending_periods[integrator_name],
+                    metrics=integrator_metrics, ledger=ledger,
+                )
+
+            run_metrics.add_integrator(integrator_metrics)
+            branches = 0
+            for period, label in zip(periods, labels):
+                if period in written:
+                    integrator_exports = written[period]
+                    written_exports[label].extend(integrator_exports)
+                else:
+                    integrator_exports = reused_exports[label][integrator_name]
+                billing_states[label][integrator_name]["exports"] = integrator_exports
+                exports[label].extend(integrator_exports)
+                branches += sum(export["Branches"] for export in integrator_exports)
+            if progress is not None:
+                progress({
+                    "stage": "integrator",
+                    "integrator": integrator_name,
+                    "done": done,
+                    "total": len(integrator_groups),
+                    "branches": branches,
+                    "reused": reused,
+                })
+        stage["rows_out"] = sum(export["Branches"] for label in labels for export in exports[label])
+        stage["files"] = sum(len(written_exports[label]) for label in labels)
+        if score_cache is not None:
+            # Worker processes use their own connection, so count from the integrator metrics
+            for key in ("score_cache_hits", "score_cache_misses"):
+                stage[key] = sum(item.get(key, 0) for item in run_metrics.record["integrators"])
+            score_cache.close()
             print(
-                f"    - {country_name}: {len(country_df)} branches -> {csv_output_path.relative_to(OUTPUT_DIR)}"
+                f"🗃️  Score cache: {stage['score_cache_hits']} pairs reused, "
+                f"{stage['score_cache_misses']} scored ({SCORE_CACHE_PATH.name})\n"
             )
 
-            exports.append(
-                {
-                    "Integrator": integrator_name,
-                    "Country": country_name,
-                    "Branches": len(country_df),
-                    "CSV": str(csv_output_path.relative_to(OUTPUT_DIR)),
-                }
-            )
-        
-        print()
+    with run_metrics.stage("finalize"):
+        for label, state_path in state_paths.items():
+            state_path.parent.mkdir(parents=True, exist_ok=True)
+            save_billing_state(state_path, billing_states[label])
+
+        # Reused exports are already in the manifest; only files written this run are recorded
+        manifest = ArtifactManifest(OUTPUT_DIR)
+        manifest.record(
+            artifact_entry(OUTPUT_DIR, OUTPUT_DIR / export["CSV"], export["Integrator"], export["Country"], label)
+            for label in labels
+            for export in written_exports[label]
+        )
+        ledger.close()
 
-    summary_df = pd.DataFrame(exports, columns=["Integrator", "Country", "Branches", "CSV"])
+    summaries = {}
+    for (billing_month, billing_year), label in zip(periods, labels):
+        summary_df = pd.DataFrame(exports[label], columns=["Integrator", "Country", "Branches", "CSV"])
+        summaries[label] = summary_df
+        period_note = "" if single_period else f" for {billing_month} {billing_year}"
 
-    if summary_df.empty:
-        print("❗ No exports were generated. Check input data and rules.\n")
-        return summary_df
+        if summary_df.empty:
+            print(f"❗ No exports were generated{period_note}. Check input data and rules.\n")
+            continue
 
-    print(f"\n{'='*70}")
-    print("EXPORT SUMMARY")
-    print(f"{'='*70}")
-    print(summary_df.to_string(index=False))
-    print(f"{'='*70}\n")
+        print(f"\n{'='*70}")
+        print(f"EXPORT SUMMARY{period_note.upper()}")
+        print(f"{'='*70}")
+        print(summary_df.to_string(index=False))
+        print(f"{'='*70}\n")
+
+        if build_archive:
+            with run_metrics.stage("archive"):
+                archive_path = build_period_archive(manifest, "csv", label)
+            if archive_path is not None:
+                print(f"📦 Period archive: {archive_path.relative_to(OUTPUT_DIR)}\n")
 
-    return summary_df
+    return summaries
 
 
 if __name__ == "__main__":
     # Default CSV file path
     default_csv = "POS Dashboard_Vendor Status Overview(CHECKIN)_Table.csv"
-    
-    # Check if CSV path provided as argument
-    if len(sys.argv) > 1:
-        csv_path = sys.argv[1]
-    else:
-        csv_path = default_csv
+
+    parser = argparse.ArgumentParser(description="Generate monthly POS billing exports.")
+    parser.add_argument("csv_path", nargs="?", default=default_csv, help="Source CSV file path")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Process integrators in a pool of N worker processes",
+    )
+    parser.add_argument(
+        "--cross-key-dedup",
+        action="store_true",
+        help="Also merge near-duplicate branch names filed under different vendor codes "
+             "(candidate pairs come from a token blocking index)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Skip integrators whose input rows and rules are unchanged since the last run",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always re-parse the CSV instead of using the ingest snapshot cache",
+    )
+    parser.add_argument(
+        "--build-archive",
+        action="store_true",
+        help="Also zip the period's CSVs into exports/archives/ for download",
+    )
+    parser.add_argument(
+        "--score-cache",
+        action="store_true",
+        help="Reuse fuzzy branch-name scores from earlier runs (.score_cache.sqlite3)",
+    )
+    parser.add_argument(
+        "--sweep-thresholds",
+        nargs="*",
+        type=int,
+        metavar="THRESHOLD",
+        help="Print billed branches and amounts per integrator at these similarity thresholds "
+             f"(default {' '.join(map(str, SWEEP_THRESHOLDS))}), with delivery type kept and ignored; "
+             "writes no exports",
+    )
+    parser.add_argument(
+        "--period",
+        action="append",
+        metavar="PERIOD[=CSV]",
+        help='Bill this period, e.g. "July 2025" or 2025-07, optionally from its own CSV '
+             "(repeat to bill several periods in one batch)",
+    )
+    args = parser.parse_args()
+    if args.cross_key_dedup and args.sweep_thresholds is not None:
+        parser.error("--sweep-thresholds only sweeps the exact-key dedup; drop --cross-key-dedup")
+    csv_path = args.csv_path
+
+    batch_periods = []
+    for spec in args.period or []:
+        period_spec, _, period_csv = spec.partition("=")
+        try:
+            billing_month, billing_year = parse_billing_period(period_spec)
+        except ValueError as e:
+            print(f"❌ Error: {e}")
+            sys.exit(1)
+        batch_periods.append((period_csv or csv_path, billing_month, billing_year))
     
     # Check if file exists
-    if not Path(csv_path).exists():
-        print(f"❌ Error: CSV file not found: {csv_path}")
-        print(f"\nUsage: python generate_invoices.py [csv_file_path]")
-        sys.exit(1)
+    for source_csv in {csv_path} if not batch_periods else {period[0] for period in batch_periods}:
+        if not Path(source_csv).exists():
+            print(f"❌ Error: CSV file not found: {source_csv}")
+            print(f"\nUsage: python generate_invoices.py [csv_file_path] [--period PERIOD[=CSV] ...] [--workers N] [--cross-key-dedup] [--incremental] [--no-cache] [--build-archive] [--score-cache] [--sweep-thresholds [T ...]]")
+            sys.exit(1)
+    
+    if args.sweep_thresholds is not None:
+        try:
+            sweep = sweep_dedup_thresholds(
+                csv_path,
+                args.sweep_thresholds or SWEEP_THRESHOLDS,
+                use_cache=not args.no_cache,
+                score_cache=args.score_cache,
+            )
+        except Exception as e:
+            print(f"\n❌ Error: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
+        print(format_threshold_sweep(sweep))
+        sys.exit(0)
+
+    if batch_periods:
+        try:
+            process_billing_batch(
+                batch_periods,
+                cross_key_dedup=args.cross_key_dedup,
+                workers=args.workers,
+                use_cache=not args.no_cache,
+                incremental=args.incremental,
+                build_archive=args.build_archive,
+                score_cache=args.score_cache,
+            )
+        except Exception as e:
+            print(f"\n❌ Error: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
+        sys.exit(0)
     
     # Optional: specify billing month and year
     billing_month = None  # Will default to current month
@@ -694,7 +2163,17 @@ if __name__ == "__main__":
     
     # Generate invoices
     try:
-        summary = process_csv_and_generate_invoices(csv_path, billing_month, billing_year)
+        summary = process_csv_and_generate_invoices(
+            csv_path,
+            billing_month,
+            billing_year,
+            cross_key_dedup=args.cross_key_dedup,
+            workers=args.workers,
+            use_cache=not args.no_cache,
+            incremental=args.incremental,
+            build_archive=args.build_archive,
+            score_cache=args.score_cache,
+        )
     except Exception as e:
         print(f"\n❌ Error: {str(e)}")
         import traceback
@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""
+Low-level canvas renderer for InvoiceGenerator.
+
+Draws the same page layout as the platypus path (SimpleDocTemplate + Table +
+Paragraph) without building flowables per invoice. The fixed pieces of the
+invoice - title block and detail labels, branch table header, ruled row
+backgrounds and the payment-terms footer - are defined once per PDF as form
+XObjects and stamped with doForm; only the variable text is written with
+direct canvas calls. Layout metrics (paragraph heights, column positions,
+header-block placement) are worked out once per generator and reused for
+every invoice.
+
+Page flow follows platypus' Frame rules: space-before is dropped at the top
+of a page and overlaps the previous space-after, a flowable that does not fit
+moves to the next page, and tables split between rows with the branch table
+header repeated on each continuation page.
+"""
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import inch
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Paragraph
+
+
+FUZZ = 1e-6  # same tolerance platypus frames use for layout arithmetic
+
+TEXT_COLOR = colors.HexColor('#333333')
+HEADER_FILL = colors.HexColor('#2c3e50')
+SHADED_ROW_FILL = colors.HexColor('#f8f9fa')
+GRID_COLOR = colors.HexColor('#dee2e6')
+TOTAL_FILL = colors.HexColor('#e8f4f8')
+
+
+class _PageFlow:
+    """Cursor down one frame per page, placing blocks the way a platypus Frame does."""
+
+    def __init__(self, top, bottom, on_new_page=None):
+        self.top = top
+        self.bottom = bottom
+        self.on_new_page = on_new_page
+        self.start_frame()
+
+    def start_frame(self):
+        self.y = self.top
+        self.at_top = True
+        self.prev_space_after = 0
+
+    def new_page(self):
+        if self.on_new_page is not None:
+            self.on_new_page()
+        self.start_frame()
+
+    def state(self):
+        return self.y, self.at_top, self.prev_space_after
+
+    def restore(self, state):
+        self.y, self.at_top, self.prev_space_after = state
+
+    def _space_before(self, space_before):
+        if self.at_top:
+            return 0
+        return max(space_before - self.prev_space_after, 0)
+
+    def _advance(self, y, space_after):
+        y -= space_after
+        self.prev_space_after = space_after
+        if y != self.y:
+            self.at_top = False
+        self.y = y
+
+    def place(self, height, space_before=0, space_after=0):
+        """Reserve an unsplittable block (paragraph or spacer); return its bottom edge."""
+        s = self._space_before(space_before)
+        if self.y - self.bottom - s <= 0 or self.y - s - height < self.bottom - FUZZ:
+            self.new_page()
+            s = 0
+        bottom = self.y - s - height
+        self._advance(bottom, space_after)
+        return bottom
+
+    def place_table(self, header_height, row_heights):
+        """
+        Split a table across pages between rows, like Table.split.
+
+        header_height is None for a table without a repeating header row.
+        Yields (top, start, stop) per page segment; the header (if any) is
+        drawn at the top of every segment, followed by rows[start:stop].
+        """
+        header = [] if header_height is None else [header_height]
+        repeat_rows = len(header)
+        remaining = sum(row_heights)
+        start = 0
+        while True:
+            avail = self.y - self.bottom
+            # Cheap estimate first; the exact height is only summed when it may fit
+            if avail > 0 and sum(header) + remaining <= avail + 1:
+                height = _table_height(header + row_heights[start:])
+                if avail > 0 and self.y - height >= self.bottom - FUZZ:
+                    top = self.y
+                    self._advance(top - height, 0)
+                    yield top, start, len(row_heights)
+                    return
+            # Last row boundary that fits, counting the header as row 0
+            used = 0
+            stop = start
+            if avail > 0 and (not header or header[0] <= avail):
+                used = sum(header)
+                while stop < len(row_heights) and used + row_heights[stop] <= avail:
+                    used += row_heights[stop]
+                    stop += 1
+            if stop == start:
+                self.new_page()
+                continue
+            top = self.y
+            self._advance(top - _table_height(header + row_heights[start:stop]), 0)
+            yield top, start, stop
+            remaining -= sum(row_heights[start:stop])
+            start = stop
+
+
+def _table_height(row_heights):
+    """Table height summed the way platypus does it (compensated, last row first)."""
+    height = compensation = 0
+    for row_height in reversed(row_heights):
+        y = row_height - compensation
+        total = height + y
+        compensation = (total - height) - y
+        height = total
+    return height
+
+
+class CanvasInvoiceRenderer:
+    """Renders InvoiceGenerator invoices straight onto a reportlab canvas."""
+
+    # Page geometry of the platypus document (SimpleDocTemplate defaults plus our margins)
+    PAGE_SIZE = letter
+    LEFT_MARGIN = 72
+    RIGHT_MARGIN = 72
+    TOP_MARGIN = 72
+    BOTTOM_MARGIN = 18
+    FRAME_PADDING = 6
+
+    # Cell metrics mirrored from the TableStyles in InvoiceGenerator
+    DETAILS_COL_WIDTHS = [2*inch, 4*inch]
+    DETAILS_PADDING = 6
+    BRANCH_PADDING = (6, 8)  # (left/right, top/bottom)
+    SUMMARY_COL_WIDTHS = [4.5*inch, 2*inch]
+    SUMMARY_PADDING = (12, 8)
+
+    def __init__(self, generator):
+        """
+        Args:
+            generator: InvoiceGenerator whose styles, rates and table settings are rendered
+        """
+        self.generator = generator
+        page_width, page_height = self.PAGE_SIZE
+        self.frame_left = self.LEFT_MARGIN + self.FRAME_PADDING
+        self.frame_width = page_width - self.LEFT_MARGIN - self.RIGHT_MARGIN - 2 * self.FRAME_PADDING
+        self.frame_top = page_height - self.TOP_MARGIN - self.FRAME_PADDING
+        self.frame_bottom = self.BOTTOM_MARGIN + self.FRAME_PADDING
+
+        styles = generator.styles
+        self.title = Paragraph(generator.INVOICE_TITLE, styles['CustomTitle'])
+        self.section_header = Paragraph(generator.BRANCH_SECTION_TITLE, styles['SectionHeader'])
+        self.footer = Paragraph(generator.PAYMENT_TERMS, styles['Normal'])
+        self.footer_height = self.footer.wrap(self.frame_width, page_height)[1]
+
+        # Column edges of the centred tables
+        self.branch_cols = self._column_edges(generator.BRANCH_COL_WIDTHS)
+        self.details_cols = self._column_edges(self.DETAILS_COL_WIDTHS)
+        self.summary_cols = self._column_edges(self.SUMMARY_COL_WIDTHS)
+
+        # Everything down to the branch table sits at fixed positions on page 1
+        flow = _PageFlow(self.frame_top, self.frame_bottom)
+        self.title_y = flow.place(
+            self.title.wrap(self.frame_width, page_height)[1],
+            self.title.getSpaceBefore(), self.title.getSpaceAfter(),
+        )
+        flow.place(0.3*inch)
+        self.details_row_height = 10 * 1.2 + 2 * self.DETAILS_PADDING
+        self.details_top = flow.place(4 * self.details_row_height) + 4 * self.details_row_height
+        flow.place(0.5*inch)
+        self.section_header_y = flow.place(
+            self.section_header.wrap(self.frame_width, page_height)[1],
+            self.section_header.getSpaceBefore(), self.section_header.getSpaceAfter(),
+        )
+        self.body_start = flow.state()
+
+        lr_pad, tb_pad = self.BRANCH_PADDING
+        self.header_row_height = 10 * 1.2 + 2 * tb_pad
+        self.branch_line_height = 9 * 1.2
+        self.branch_text_x = [
+            (left + right) / 2 if align == 'CENTER' else right - lr_pad if align == 'RIGHT' else left + lr_pad
+            for (left, right), align in zip(
+                zip(self.branch_cols, self.branch_cols[1:]),
+                ['CENTER', 'CENTER', 'LEFT', 'CENTER', 'RIGHT'],
+            )
+        ]
+
+    def _column_edges(self, col_widths):
+        """x positions of the column boundaries of a table centred in the frame."""
+        x = self.frame_left + (self.frame_width - sum(col_widths)) / 2
+        edges = [x]
+        for width in col_widths:
+            x += width
+            edges.append(x)
+        return edges
+
+    def render(self, filepath, integrator_name, branches_df, billing_month, billing_year):
+        """Write one invoice PDF to filepath."""
+        generator = self.generator
+        canv = canvas.Canvas(str(filepath), pagesize=self.PAGE_SIZE)
+        self._segment_forms = {}
+        self._widths = {}
+        self._define_static_forms(canv)
+
+        flow = _PageFlow(self.frame_top, self.frame_bottom, on_new_page=canv.showPage)
+        flow.restore(self.body_start)
+
+        # Header block: one form, plus the detail values
+        canv.doForm('invoice_header')
+        self._draw_details(canv, generator.invoice_details(integrator_name, billing_month, billing_year))
+
+        # Branch table: a single table, or fixed-size chunks in large-invoice mode
+        columns = generator.branch_columns(branches_df)
+        rows = [[str(value) for value in column] for column in columns]
+        rate = f"€{generator.RATE_PER_BRANCH}"
+        row_lines = self._branch_row_lines(rows)
+        row_heights = [lines * self.branch_line_height + 2 * self.BRANCH_PADDING[1] for lines in row_lines]
+        if generator.use_chunked_tables(branches_df):
+            chunk_size = generator.rows_per_chunk
+            chunks = [(start, min(start + chunk_size, len(row_heights))) for start in range(0, len(row_heights), chunk_size)]
+        else:
+            chunks = [(0, len(row_heights))]
+        for chunk_start, chunk_stop in chunks:
+            for top, start, stop in flow.place_table(self.header_row_height, row_heights[chunk_start:chunk_stop]):
+                self._draw_branch_rows(
+                    canv, top, rows, rate, row_lines, row_heights, chunk_start + start, chunk_start + stop,
+                )
+        flow.place(0.4*inch)
+
+        # Summary table, then the footer
+        entity_breakdown = branches_df.groupby("Entity ID", observed=True).size().to_dict()
+        summary_rows = self._summary_rows(generator.summary_data(branches_df, entity_breakdown))
+        for top, start, stop in flow.place_table(None, [row[3] for row in summary_rows]):
+            self._draw_summary_rows(canv, top, summary_rows[start:stop])
+        flow.place(0.5*inch)
+        footer_y = flow.place(self.footer_height)
+        canv.saveState()
+        canv.translate(self.frame_left, footer_y)
+        canv.doForm('footer')
+        canv.restoreState()
+
+        canv.showPage()
+        canv.save()
+
+    def _define_static_forms(self, canv):
+        """Form XObjects shared by every page of the document."""
+        page_height = self.PAGE_SIZE[1]
+
+        # Title, detail labels and the "Branch Details" heading at their page-1 positions
+        canv.beginForm('invoice_header')
+        self.title.drawOn(canv, self.frame_left, self.title_y)
+        canv.setFillColor(TEXT_COLOR)
+        canv.setFont('Helvetica-Bold', 10, 12)
+        label_x = self.details_cols[1] - self.DETAILS_PADDING
+        for row, (label, _) in enumerate(self.generator.invoice_details('', '', '')):
+            canv.drawRightString(label_x, self._details_baseline(row), label)
+        self.section_header.drawOn(canv, self.frame_left, self.section_header_y)
+        canv.endForm()
+
+        # Payment terms, positioned by translating to the footer's frame position
+        canv.beginForm('footer', lowerx=0, lowery=0, upperx=self.frame_width, uppery=page_height)
+        self.footer.drawOn(canv, 0, 0)
+        canv.endForm()
+
+    def _segment_form(self, canv, row_heights):
+        """
+        Name of the form for one page segment of the branch table: header row,
+        alternating row fills and the grid, for the given data row heights.
+
+        Segments are cached per document, so every full continuation page is
+        a single doForm.
+        """
+        key = tuple(row_heights)
+        name = self._segment_forms.get(key)
+        if name is not None:
+            return name
+        name = f"branch_segment_{len(self._segment_forms)}"
+        self._segment_forms[key] = name
+
+        x0 = self.branch_cols[0]
+        width = self.branch_cols[-1] - x0
+        height = self.header_row_height + sum(row_heights)
+        canv.beginForm(name, lowerx=-1, lowery=-1, upperx=width + 1, uppery=height + 1)
+
+        # Fills first, as Table draws backgrounds before cells and rules
+        y = height - self.header_row_height
+        canv.setFillColor(HEADER_FILL)
+        canv.rect(0, y, width, self.header_row_height, stroke=0, fill=1)
+        boundaries = [height, y]
+        for row, row_height in enumerate(row_heights):
+            canv.setFillColor(SHADED_ROW_FILL if row % 2 else colors.white)
+            canv.rect(0, y, width, -row_height, stroke=0, fill=1)
+            y -= row_height
+            boundaries.append(y)
+
+        canv.setFillColor(colors.whitesmoke)
+        canv.setFont('Helvetica-Bold', 10, 12)
+        baseline = height - self.header_row_height + self.BRANCH_PADDING[1] + 12 - 10
+        for left, right, title in zip(self.branch_cols, self.branch_cols[1:], self.generator.BRANCH_TABLE_HEADER):
+            canv.drawCentredString((left + right) / 2 - x0, baseline, title)
+
+        # 0.5pt grid, each rule drawn once across the whole segment
+        canv.setStrokeColor(GRID_COLOR)
+        canv.setLineWidth(0.5)
+        canv.setLineCap(1)  # Table line commands default to round caps
+        for y in boundaries:
+            canv.line(0, y, width, y)
+        for x in self.branch_cols:
+            canv.line(x - x0, 0, x - x0, height)
+        canv.endForm()
+        return name
+
+    def _details_baseline(self, row):
+        """Baseline of a details-grid row (cells are vertically centred)."""
+        row_bottom = self.details_top - (row + 1) * self.details_row_height
+        pad = self.DETAILS_PADDING
+        return row_bottom + (pad + self.details_row_height - pad + 12) / 2 - 10
+
+    def _draw_details(self, canv, details):
+        canv.setFillColor(TEXT_COLOR)
+        canv.setFont('Helvetica', 10, 12)
+        value_x = self.details_cols[1] + self.DETAILS_PADDING
+        for row, (_, value) in enumerate(details):
+            canv.drawString(value_x, self._details_baseline(row), value)
+
+    def _branch_row_lines(self, rows):
+        """Text lines per branch row; cells with embedded newlines make taller rows."""
+        lines = [1] * len(rows[0])
+        for column in rows:
+            for position, value in enumerate(column):
+                if '\n' in value:
+                    lines[position] = max(lines[position], value.count('\n') + 1)
+        return lines
+
+    def _draw_branch_rows(self, canv, top, rows, rate, row_lines, row_heights, start, stop):
+        """Header plus rows[start:stop] of the branch table, hanging from y=top."""
+        segment_heights = row_heights[start:stop]
+        form = self._segment_form(canv, segment_heights)
+        y = top - self.header_row_height
+        canv.saveState()
+        canv.translate(self.branch_cols[0], y - sum(segment_heights))
+        canv.doForm(form)
+        canv.restoreState()
+
+        # One text object per segment; centred/right-aligned cells are offset by their width
+        text = canv.beginText()
+        text.setFillColor(TEXT_COLOR)
+        text.setFont('Helvetica', 9, self.branch_line_height)
+        width = self._text_width
+        centre_number, centre_vendor, left_name, centre_delivery, right_rate = self.branch_text_x
+        rate_x = right_rate - width(rate)
+        padding = self.BRANCH_PADDING[1]
+        numbers, vendor_codes, branch_names, delivery_types = rows
+        for position in range(start, stop):
+            y -= row_heights[position]
+            if row_lines[position] == 1:
+                baseline = y + padding + self.branch_line_height - 9
+                cells = (
+                    (centre_number - width(numbers[position]) / 2, numbers[position]),
+                    (centre_vendor - width(vendor_codes[position]) / 2, vendor_codes[position]),
+                    (left_name, branch_names[position]),
+                    (centre_delivery - width(delivery_types[position]) / 2, delivery_types[position]),
+                    (rate_x, rate),
+                )
+                for x, value in cells:
+                    text.setTextOrigin(x, baseline)
+                    text.textOut(value)
+            else:
+                cells = (
+                    (centre_number, 0.5, numbers[position]),
+                    (centre_vendor, 0.5, vendor_codes[position]),
+                    (left_name, 0, branch_names[position]),
+                    (centre_delivery, 0.5, delivery_types[position]),
+                    (right_rate, 1, rate),
+                )
+                for x, shift, value in cells:
+                    lines = value.split('\n')
+                    baseline = y + padding + len(lines) * self.branch_line_height - 9
+                    for line in lines:
+                        text.setTextOrigin(x - shift * width(line), baseline)
+                        text.textOut(line)
+                        baseline -= self.branch_line_height
+        canv.drawText(text)
+
+    def _text_width(self, value):
+        """Width of a 9pt Helvetica branch cell, memoised per document (delivery types repeat)."""
+        width = self._widths.get(value)
+        if width is None:
+            width = self._widths[value] = stringWidth(value, 'Helvetica', 9)
+        return width
+
+    def _summary_rows(self, summary_data):
+        """(label, value, font size, row height, is-total) for each summary row."""
+        rows = []
+        last = len(summary_data) - 1
+        for position, (label, value) in enumerate(summary_data):
+            if position == last:
+                size = 14
+            elif position <= 1:
+                size = 11
+            else:
+                size = 10
+            height = size * 1.2 + 2 * self.SUMMARY_PADDING[1]
+            rows.append((label, value, size, height, position == last))
+        return rows
+
+    def _draw_summary_rows(self, canv, top, rows):
+        """A page segment of the summary table, hanging from y=top."""
+        left, middle, right = self.summary_cols
+        lr_pad, tb_pad = self.SUMMARY_PADDING
+        y = top
+        positions = []
+        for row in rows:
+            y -= row[3]
+            positions.append(y)
+        for (label, value, size, height, is_total), row_bottom in zip(rows, positions):
+            if is_total:
+                canv.setFillColor(TOTAL_FILL)
+                canv.rect(left, row_bottom, right - left, height, stroke=0, fill=1)
+        for (label, value, size, height, is_total), row_bottom in zip(rows, positions):
+            bold = is_total or size == 11
+            canv.setFillColor(HEADER_FILL if is_total else colors.black)
+            baseline = row_bottom + tb_pad + size * 1.2 - size
+            canv.setFont('Helvetica-Bold' if bold else 'Helvetica', size, size * 1.2)
+            canv.drawRightString(middle - lr_pad, baseline, label)
+            if size == 11:
+                canv.setFont('Helvetica', size, size * 1.2)
+            canv.drawRightString(right - lr_pad, baseline, value)
+        for (label, value, size, height, is_total), row_bottom in zip(rows, positions):
+            if is_total:
+                canv.setStrokeColor(HEADER_FILL)
+                canv.setLineWidth(2)
+                canv.setLineCap(1)
+                canv.line(left, row_bottom + height, right, row_bottom + height)
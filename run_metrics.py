@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Structured metrics for billing runs.
+
+process_csv_and_generate_invoices fills a RunMetrics record as it goes: wall
+time, rows in/out and peak RSS per stage, plus one entry per integrator with
+rows excluded per rule, fuzzy comparisons, files and bytes written. Finished
+records are appended to exports/.run_metrics.jsonl as one JSON line each; once
+the file grows past RUN_HISTORY_TRIM_BYTES it is cut back to the last
+RUN_HISTORY_LIMIT runs. The dashboard serves the history at /api/metrics and
+the scheduler logs it after each run.
+"""
+
+import contextlib
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+
+RUN_METRICS_FILENAME = ".run_metrics.jsonl"
+RUN_HISTORY_LIMIT = 100
+RUN_HISTORY_TRIM_BYTES = 8 * 1024 * 1024
+RUN_HISTORY_READ_BLOCK_BYTES = 64 * 1024
+RSS_SAMPLE_SECONDS = 0.01
+
+
+def current_rss_mb():
+    """Resident set size of this process (Linux /proc; peak RSS so far elsewhere)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / (1024 * 1024)
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RSSSampler:
+    """Tracks the peak RSS on a background thread while a block runs."""
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak_mb = current_rss_mb()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+
+@contextlib.contextmanager
+def measure(record):
+    """Add the block's wall time ("seconds") and peak RSS ("peak_rss_mb") to record."""
+    start = time.perf_counter()
+    with RSSSampler() as sampler:
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(record.get("seconds", 0) + time.perf_counter() - start, 4)
+    record["peak_rss_mb"] = round(max(record.get("peak_rss_mb", 0), sampler.peak_mb), 1)
+
+
+class RunMetrics:
+    """The metrics record of one billing run."""
+
+    def __init__(self, **details):
+        """
+        Args:
+            **details: Run description stored at the top of the record
+                (period, source, options, ...)
+        """
+        self._start = time.perf_counter()
+        self.record = {
+            "run_id": uuid.uuid4().hex,
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            **details,
+            "status": "running",
+            "stages": {},
+            "integrators": [],
+        }
+
+    def stage(self, name, **counts):
+        """Context manager timing one pipeline stage; yields its record for row counts."""
+        return measure(self.record["stages"].setdefault(name, dict(counts)))
+
+    def add_integrator(self, integrator_metrics):
+        self.record["integrators"].append(integrator_metrics)
+
+    def finish(self, status="succeeded", error=None):
+        """Close the record: status, wall time, overall peak RSS and integrator totals."""
+        record = self.record
+        integrators = record["integrators"]
+        record.update(
+            status=status,
+            error=error,
+            finished_at=datetime.now().isoformat(timespec="seconds"),
+            wall_seconds=round(time.perf_counter() - self._start, 4),
+            peak_rss_mb=max(
+                [stage.get("peak_rss_mb", 0) for stage in record["stages"].values()]
+                + [integrator.get("peak_rss_mb", 0) for integrator in integrators],
+                default=0,
+            ),
+            totals={
+                key: sum(integrator.get(key, 0) for integrator in integrators)
+                for key in ("rows_in", "rows_excluded", "rows_out", "fuzzy_comparisons", "files", "bytes_written")
+            },
+        )
+        return record
+
+
+def append_run_record(path, record, limit=RUN_HISTORY_LIMIT, trim_bytes=RUN_HISTORY_TRIM_BYTES):
+    """
+    Append a finished run to the JSON Lines history as a single line. The
+    history is only re-read, and cut back to the last `limit` runs, once the
+    file is larger than trim_bytes.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as history:
+        history.write(json.dumps(record) + "\n")
+        size = history.tell()
+    if size <= trim_bytes:
+        return
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False
+    ) as temp:
+        temp.write("\n".join(lines[-limit:]) + "\n")
+    try:
+        os.replace(temp.name, path)
+    except OSError:
+        Path(temp.name).unlink(missing_ok=True)
+        raise
+
+
+def _reversed_lines(path, block_size=RUN_HISTORY_READ_BLOCK_BYTES):
+    """Yield the lines of a file last first, reading it backwards in blocks."""
+    with open(path, "rb") as history:
+        position = history.seek(0, 2)
+        partial = b""
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            history.seek(position)
+            lines = (history.read(step) + partial).split(b"\n")
+            partial = lines.pop(0)  # may continue in the previous block
+            yield from reversed(lines)
+        yield partial
+
+
+def load_run_records(path, limit=None):
+    """
+    The most recent run records, newest first ([] if there is no history yet).
+
+    The history is read backwards from its end, so fetching the last `limit`
+    runs costs the same however long the file is.
+    """
+    records = []
+    try:
+        for line in _reversed_lines(path):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+            if limit is not None and len(records) >= limit:
+                break
+    except OSError:
+        return []
+    return records
+
+
+def _change(current, previous):
+    if not previous:
+        return ""
+    return f" ({(current - previous) / previous:+.0%} vs previous run)"
+
+
+def format_run_summary(record, previous=None, top_integrators=10):
+    """
+    Human-readable lines for a run record, for logs: overall numbers, each
+    stage, and the slowest integrators, with the change against `previous`
+    (an earlier record of the same pipeline) where there is one.
+    """
+    previous = previous or {}
+    previous_stages = previous.get("stages", {})
+    previous_integrators = {item["integrator"]: item for item in previous.get("integrators", [])}
+    totals = record.get("totals", {})
+
+    lines = [
+        f"Run {record['run_id'][:8]} {record.get('period', '')}: {record['status']} in "
+        f"{record.get('wall_seconds', 0):.2f}s{_change(record.get('wall_seconds', 0), previous.get('wall_seconds'))}, "
+        f"peak RSS {record.get('peak_rss_mb', 0):.0f} MB",
+        f"Rows in {totals.get('rows_in', 0)}, excluded {totals.get('rows_excluded', 0)}, "
+        f"billed {totals.get('rows_out', 0)}; {totals.get('fuzzy_comparisons', 0)} fuzzy comparisons; "
+        f"{totals.get('files', 0)} files, {totals.get('bytes_written', 0) / 1024:.0f} KB written",
+    ]
+    for name, stage in record.get("stages", {}).items():
+        seconds = stage.get("seconds", 0)
+        lines.append(
+            f"  stage {name:<12} {seconds:>8.3f}s  peak RSS {stage.get('peak_rss_mb', 0):.0f} MB"
+            f"{_change(seconds, previous_stages.get(name, {}).get('seconds'))}"
+        )
+
+    integrators = sorted(record.get("integrators", []), key=lambda item: -item.get("seconds", 0))
+    for item in integrators[:top_integrators]:
+        seconds = item.get("seconds", 0)
+        lines.append(
+            f"  {item['integrator']:<30} {seconds:>8.3f}s  rows {item.get('rows_in', 0)} -> {item.get('rows_out', 0)}"
+            f"{' (reused)' if item.get('reused') else ''}"
+            f"{_change(seconds, previous_integrators.get(item['integrator'], {}).get('seconds'))}"
+        )
+    return lines
@@ -8,7 +8,8 @@ import schedule
 import time
 from datetime import datetime
 from pathlib import Path
-from generate_invoices import process_csv_and_generate_invoices
+from generate_invoices import process_csv_and_generate_invoices, OUTPUT_DIR
+from run_metrics import RUN_METRICS_FILENAME, format_run_summary, load_run_records
 import logging
 
 # Setup logging
@@ -28,6 +29,17 @@ CSV_FILE = "POS Dashboard_Vendor Status Overview(CHECKIN)_Table.csv"
 RUN_DAY = 5  # 5th of each month
 
 
+def log_run_metrics():
+    """Log the metrics of the latest billing run, compared with the run before it."""
+    runs = load_run_records(OUTPUT_DIR / RUN_METRICS_FILENAME, limit=2)
+    if not runs:
+        return
+    previous = runs[1] if len(runs) > 1 else None
+    logger.info("Run metrics:")
+    for line in format_run_summary(runs[0], previous):
+        logger.info(line)
+
+
 def run_monthly_invoicing():
     """Run the invoice generation process."""
     logger.info("="*60)
@@ -56,6 +68,8 @@ def run_monthly_invoicing():
         
     except Exception as e:
         logger.error(f"Error during invoice generation: {str(e)}", exc_info=True)
+    else:
+        log_run_metrics()
     
     logger.info("="*60)
 
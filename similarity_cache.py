@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Persistent cache of fuzzy similarity scores between branch names.
+
+Most branches are the same from one month's export to the next, so the same
+name pairs are scored again every run. SimilarityCache keeps each score in a
+local SQLite file. The key is the normalized (token-sorted) pair and the
+scorer version, so a change to the scorer never reuses old scores.
+BranchDeduplicator looks a whole batch of pairs up in one query and only
+scores the misses.
+
+The cache is bounded: every hit refreshes an entry's last-used stamp, and
+once the file holds more than max_entries scores the least recently used are
+evicted. Scores looked up or stored by this process are also kept in memory
+for the rest of the run.
+"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+DEFAULT_MAX_ENTRIES = 1_000_000
+EVICTION_SLACK = 0.1  # evict this much below the cap, so eviction doesn't run on every insert
+SQLITE_BATCH_ROWS = 10_000
+SQLITE_TIMEOUT_SECONDS = 30
+
+
+class SimilarityCache:
+    """Size-bounded, least-recently-used cache of pair scores in a SQLite file."""
+
+    def __init__(self, path, scorer_version, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            path: SQLite file (created on first use)
+            scorer_version: Label of the scoring function; scores of other versions are ignored
+            max_entries: Scores kept on disk before the least recently used are evicted
+        """
+        self.path = Path(path)
+        self.scorer_version = scorer_version
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._connection = None
+        self._entries = None
+
+    def __getstate__(self):
+        # Worker processes open their own connection; counters and memory start empty there
+        return {"path": self.path, "scorer_version": self.scorer_version, "max_entries": self.max_entries}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _connect(self):
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT_SECONDS, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                " version TEXT NOT NULL, first TEXT NOT NULL, second TEXT NOT NULL,"
+                " score INTEGER NOT NULL, last_used INTEGER NOT NULL,"
+                " PRIMARY KEY (version, first, second)) WITHOUT ROWID"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)")
+            connection.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS wanted (first TEXT NOT NULL, second TEXT NOT NULL)"
+            )
+            self._connection = connection
+            self._entries = connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        return self._connection
+
+    @staticmethod
+    def pair_key(first, second):
+        """Scores are symmetric, so each pair is stored once, in sorted order."""
+        return (first, second) if first <= second else (second, first)
+
+    def get_many(self, pairs):
+        """
+        Look up scores for pair keys (see pair_key).
+
+        Returns:
+            dict of pair key -> score for the pairs in the cache
+        """
+        pairs = list(dict.fromkeys(pairs))
+        found = {}
+        wanted = []
+        for pair in pairs:
+            score = self._memory.get(pair)
+            if score is None:
+                wanted.append(pair)
+            else:
+                found[pair] = score
+
+        if wanted:
+            with self._lock:
+                connection = self._connect()
+                with connection:
+                    connection.execute("DELETE FROM wanted")
+                    connection.executemany("INSERT INTO wanted VALUES (?, ?)", wanted)
+                    rows = connection.execute(
+                        "SELECT s.first, s.second, s.score FROM wanted w JOIN scores s"
+                        " ON s.version = ? AND s.first = w.first AND s.second = w.second",
+                        (self.scorer_version,),
+                    ).fetchall()
+                    connection.execute(
+                        "UPDATE scores SET last_used = ? WHERE version = ? AND (first, second) IN"
+                        " (SELECT first, second FROM wanted)",
+                        (int(time.time()), self.scorer_version),
+                    )
+            for first, second, score in rows:
+                found[(first, second)] = score
+                self._memory[(first, second)] = score
+
+        self.hits += len(found)
+        self.misses += len(pairs) - len(found)
+        return found
+
+    def put_many(self, scores):
+        """Store scores (a dict of pair key -> score), evicting the least recently used beyond max_entries."""
+        if not scores:
+            return
+        self._memory.update(scores)
+        now = int(time.time())
+        rows = [(self.scorer_version, first, second, int(score), now) for (first, second), score in scores.items()]
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                for start in range(0, len(rows), SQLITE_BATCH_ROWS):
+                    cursor = connection.executemany(
+                        "INSERT OR IGNORE INTO scores VALUES (?, ?, ?, ?, ?)", rows[start:start + SQLITE_BATCH_ROWS]
+                    )
+                    self._entries += cursor.rowcount
+                if self._entries > self.max_entries:
+                    self._evict(connection)
+
+    def _evict(self, connection):
+        """Drop the least recently used scores down to EVICTION_SLACK below the cap."""
+        self._entries = connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        excess = self._entries - int(self.max_entries * (1 - EVICTION_SLACK))
+        if excess <= 0:
+            return
+        connection.execute(
+            "DELETE FROM scores WHERE (version, first, second) IN"
+            " (SELECT version, first, second FROM scores ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self._entries -= excess
+
+    def stats(self):
+        """Counters for logs and run metrics."""
+        return {"hits": self.hits, "misses": self.misses, "entries": self._entries}
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
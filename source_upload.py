@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Streaming upload of the source CSV.
+
+The upload is copied to a temporary file next to the source in fixed-size
+chunks, so it is never held in memory. Each upload gets its own temporary
+file, so concurrent uploads cannot overwrite each other before the replace. The SHA-256 of the content is computed
+along the way, and the header row is checked as soon as it has arrived, so a
+wrong file is rejected without reading the rest of it. Only a complete, valid
+upload replaces the source, atomically.
+
+The hash of the current source is kept in a small state file next to it
+(.source_upload.json). An upload with the same hash as the current source is
+a duplicate: it is discarded and the source, its ingest snapshot and the
+generated exports are left as they are.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+from generate_invoices import file_content_hash, resolve_source_columns
+
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_HEADER_BYTES = 64 * 1024  # a header row longer than this is not a billing export
+SOURCE_STATE_FILENAME = ".source_upload.json"
+
+# Without these, process_uploaded_csv would drop or be unable to bill every row
+REQUIRED_SOURCE_COLUMNS = ["Entity ID", "Integration Name", "Branch Name"]
+
+
+class UploadError(ValueError):
+    """The upload is not a usable source CSV (the current source is kept)."""
+
+
+def validate_header(header_bytes):
+    """
+    Parse the header row and check it has the REQUIRED_SOURCE_COLUMNS
+    (matched the same way as process_uploaded_csv matches them).
+
+    Returns:
+        List of header names
+
+    Raises:
+        UploadError: Undecodable header or missing required columns
+    """
+    try:
+        header_line = header_bytes.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise UploadError("The header row is not valid UTF-8 text")
+    columns = next(csv.reader([header_line.rstrip("\r\n")]), [])
+    resolved = resolve_source_columns(columns)
+    missing = [column for column in REQUIRED_SOURCE_COLUMNS if column not in resolved]
+    if missing:
+        raise UploadError(f"CSV is missing required columns: {', '.join(missing)}")
+    return columns
+
+
+def _state_path(source_path):
+    return Path(source_path).parent / SOURCE_STATE_FILENAME
+
+
+def _unique_temp_path(target_path, suffix):
+    """A new, empty temporary file next to target_path (same filesystem, so os.replace is atomic)."""
+    target_path = Path(target_path)
+    with tempfile.NamedTemporaryFile(
+        dir=target_path.parent, prefix=f".{target_path.name}-", suffix=suffix, delete=False
+    ) as handle:
+        return Path(handle.name)
+
+
+def _write_state(source_path, state):
+    state_path = _state_path(source_path)
+    temp_path = _unique_temp_path(state_path, ".tmp")
+    try:
+        temp_path.write_text(json.dumps(state, indent=2, sort_keys=True))
+        os.replace(temp_path, state_path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+def current_source_hash(source_path):
+    """
+    SHA-256 of the current source, from the state file while the source's size
+    and mtime still match it (hashed and recorded otherwise; None if there is
+    no source).
+    """
+    source_path = Path(source_path)
+    try:
+        stat = source_path.stat()
+    except FileNotFoundError:
+        return None
+    try:
+        state = json.loads(_state_path(source_path).read_text())
+    except (OSError, ValueError):
+        state = {}
+    if (
+        state.get("filename") == source_path.name
+        and state.get("size") == stat.st_size
+        and state.get("mtime_ns") == stat.st_mtime_ns
+    ):
+        return state["sha256"]
+
+    content_hash = file_content_hash(source_path)
+    _write_state(source_path, {
+        "filename": source_path.name,
+        "sha256": content_hash,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "uploaded_at": None,
+        "original_filename": None,
+    })
+    return content_hash
+
+
+def receive_source_upload(stream, source_path, original_filename=None, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Stream an uploaded CSV into place as the new source.
+
+    Only a raw request body is read straight off the socket. A multipart
+    upload has already been spooled to a temporary file by werkzeug by the
+    time its file stream is passed in, so it is copied once more from there.
+
+    Args:
+        stream: Binary file-like object with the upload body (read in chunks)
+        source_path: Path of the source CSV to replace
+        original_filename: Name the client uploaded, kept in the state file
+        chunk_size: Bytes read and written at a time
+
+    Returns:
+        dict with sha256, size, columns and duplicate (True when the upload is
+        identical to the current source, which is then left untouched)
+
+    Raises:
+        UploadError: Empty upload or invalid header row
+    """
+    source_path = Path(source_path)
+    temp_path = _unique_temp_path(source_path, ".upload")
+    digest = hashlib.sha256()
+    size = 0
+    header = b""
+    columns = None
+    try:
+        with open(temp_path, "wb") as target:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                target.write(chunk)
+                if columns is None:
+                    header += chunk
+                    newline = header.find(b"\n")
+                    if newline >= 0:
+                        columns = validate_header(header[:newline + 1])
+                    elif len(header) > MAX_HEADER_BYTES:
+                        raise UploadError("The file does not start with a CSV header row")
+        if size == 0:
+            raise UploadError("The uploaded file is empty")
+        if columns is None:
+            columns = validate_header(header)  # header-only file without a trailing newline
+
+        content_hash = digest.hexdigest()
+        result = {"sha256": content_hash, "size": size, "columns": columns, "duplicate": False}
+        if content_hash == current_source_hash(source_path):
+            result["duplicate"] = True
+            return result
+
+        os.replace(temp_path, source_path)
+        stat = source_path.stat()
+        _write_state(source_path, {
+            "filename": source_path.name,
+            "sha256": content_hash,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "uploaded_at": datetime.now().isoformat(timespec="seconds"),
+            "original_filename": original_filename,
+        })
+        return result
+    finally:
+        temp_path.unlink(missing_ok=True)
@@ -57,6 +57,11 @@ function showAlert(message, type = 'success') {
     }, 5000);
 }
 
+function setLoadingMessage(message) {
+    const label = document.getElementById('loading-message');
+    if (label) label.textContent = message;
+}
+
 function generateInvoices() {
     const month = document.getElementById('billing-month')?.value || 'October';
     const year = document.getElementById('billing-year')?.value || '2025';
@@ -66,6 +71,7 @@ function generateInvoices() {
     }
     
     showLoading();
+    setLoadingMessage('Queueing invoice generation...');
     
     fetch('/generate', {
         method: 'POST',
@@ -79,13 +85,12 @@ function generateInvoices() {
     })
     .then(response => response.json())
     .then(data => {
-        hideLoading();
         if (data.success) {
-            showAlert(data.message, 'success');
-            setTimeout(() => {
-                window.location.reload();
-            }, 1500);
+            // The server returns at once; follow the background job until it finishes
+            setLoadingMessage(data.message);
+            watchJob(data.job_id);
         } else {
+            hideLoading();
             showAlert('Error: ' + data.error, 'error');
         }
     })
@@ -95,6 +100,69 @@ function generateInvoices() {
     });
 }
 
+function describeProgress(event) {
+    if (event.stage === 'started') {
+        return `Processing ${event.total} integrators...`;
+    }
+    const note = event.reused ? ' (unchanged, reused)' : '';
+    return `${event.done}/${event.total}: ${event.integrator} - ${event.branches} branches${note}`;
+}
+
+function finishJob(job) {
+    hideLoading();
+    if (job.status === 'succeeded') {
+        showAlert(job.result.message, 'success');
+        setTimeout(() => {
+            window.location.reload();
+        }, 1500);
+    } else {
+        showAlert('Error: ' + job.error, 'error');
+    }
+}
+
+function watchJob(jobId) {
+    // Server-Sent Events for live per-integrator progress; poll the status endpoint if unavailable
+    if (!window.EventSource) {
+        pollJob(jobId);
+        return;
+    }
+    
+    const events = new EventSource(`/jobs/${jobId}/events`);
+    events.addEventListener('progress', message => {
+        setLoadingMessage(describeProgress(JSON.parse(message.data)));
+    });
+    events.addEventListener('done', message => {
+        events.close();
+        finishJob(JSON.parse(message.data));
+    });
+    events.onerror = () => {
+        events.close();
+        pollJob(jobId);
+    };
+}
+
+function pollJob(jobId) {
+    fetch(`/jobs/${jobId}`)
+    .then(response => response.json())
+    .then(job => {
+        if (!job.success) {
+            hideLoading();
+            showAlert('Error: ' + job.error, 'error');
+        } else if (job.status === 'queued' || job.status === 'running') {
+            if (job.current) {
+                setLoadingMessage(`${job.done}/${job.total}: ${job.current}`);
+            }
+            setTimeout(() => pollJob(jobId), 2000);
+        } else {
+            finishJob(job);
+        }
+    })
+    .catch(error => {
+        hideLoading();
+        showAlert('Error checking job status: ' + error, 'error');
+    });
+}
+
 function downloadAll() {
     window.location.href = '/download-all';
 }
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests for artifact_manifest: a manifest rebuilt by scanning a tree must
+describe the files the same way the writers recorded them.
+
+Run with: python -m unittest test_artifact_manifest  (or pytest test_artifact_manifest.py)
+"""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from artifact_manifest import MANIFEST_FILENAME, ArtifactManifest, artifact_entry
+from generate_invoices import billing_period_label, export_csv_path
+
+
+EXPORTS = [
+    ("TLBT UrbanPiper Plugin", "Jordan", "TB_JO"),
+    ("TLBT UrbanPiper Plugin", "UAE", "TB_AE"),
+    ("Mcd Kuwait", "Kuwait", "TB_KW"),
+]
+
+
+class ScannedManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tempdir.name)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def record_tree(self):
+        """Write a small exports/ and invoices/ tree and record it the way the pipeline does."""
+        period = billing_period_label("September", 2025)
+        exports = ArtifactManifest(self.root / "exports")
+        entries = []
+        for integrator, country, entity_id in EXPORTS:
+            path = export_csv_path(self.root / "exports", integrator, country, "September", 2025)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            pd.DataFrame({
+                "Entity ID": [entity_id], "vendor_code": [1], "Branch Name": ["Branch"],
+                "Integration Name": [integrator], "Country": [country],
+            }).to_csv(path, index=False)
+            entries.append(artifact_entry(exports.root, path, integrator, country, period))
+        exports.record(entries)
+
+        invoices = ArtifactManifest(self.root / "invoices")
+        invoices.root.mkdir()
+        for integrator in sorted({integrator for integrator, _, _ in EXPORTS}):
+            path = invoices.root / f"{integrator.replace(' ', '_')}_2025_September.pdf"
+            path.write_bytes(b"%PDF")
+            invoices.record_file(path, integrator=integrator, period=period)
+        return exports, invoices
+
+    def test_scanned_tree_has_recorded_facets(self):
+        for recorded in self.record_tree():
+            expected = recorded.facets()
+            recorded.path.unlink()
+
+            scanned = ArtifactManifest(recorded.root)
+            self.assertFalse((scanned.root / MANIFEST_FILENAME).exists())
+            self.assertEqual(scanned.facets(), expected)
+            self.assertEqual(
+                scanned.query(integrator="TLBT UrbanPiper Plugin")["total"],
+                recorded.query(integrator="TLBT UrbanPiper Plugin")["total"],
+            )
+
+    def test_scan_falls_back_to_path_for_unreadable_exports(self):
+        exports, _ = self.record_tree()
+        path = export_csv_path(exports.root, "Mcd Kuwait", "Kuwait", "September", 2025)
+        path.write_text("")
+        exports.path.unlink()
+
+        entry = next(
+            entry for entry in ArtifactManifest(exports.root).entries()
+            if entry["path"] == path.relative_to(exports.root).as_posix()
+        )
+        self.assertEqual((entry["integrator"], entry["country"]), ("mcd_kuwait", "Kuwait"))
+
+
+if __name__ == "__main__":
+    unittest.main()
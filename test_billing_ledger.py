@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Tests for billing_ledger.BillingLedger on a temporary SQLite file.
+
+Run with: python -m unittest test_billing_ledger  (or pytest test_billing_ledger.py)
+"""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from billing_ledger import LEDGER_FILENAME, BillingLedger
+from generate_invoices import export_csv_path
+
+
+def export_rows(integrator, country, entity_id, vendor_codes):
+    return pd.DataFrame({
+        "Entity ID": entity_id,
+        "vendor_code": pd.array(vendor_codes, dtype="Int64"),
+        "remote_id": [f"r{code}" for code in vendor_codes],
+        "Branch Name": [f"Branch {code}" for code in vendor_codes],
+        "Integration Name": integrator,
+        "Chain ID": pd.array([1] * len(vendor_codes), dtype="Int64"),
+        "Chain Name": "Chain",
+        "Delivery Type": "OWN_DELIVERY",
+        "Orders": pd.array([10] * len(vendor_codes), dtype="Int64"),
+        "Country": country,
+    })
+
+
+class BillingLedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tempdir.name)
+        self.ledger = BillingLedger(self.root / LEDGER_FILENAME)
+
+    def tearDown(self):
+        self.ledger.close()
+        self.tempdir.cleanup()
+
+    def test_rerun_replaces_integrator_rows(self):
+        self.ledger.replace_integrator_period(
+            "2025_september", "Mcd Kuwait", export_rows("Mcd Kuwait", "Kuwait", "TB_KW", [1, 2, 3])
+        )
+        self.ledger.replace_integrator_period(
+            "2025_september", "Mcd UAE", export_rows("Mcd UAE", "UAE", "TB_AE", [7])
+        )
+        written = self.ledger.replace_integrator_period(
+            "2025_september", "Mcd Kuwait", export_rows("Mcd Kuwait", "Kuwait", "TB_KW", [2, 4])
+        )
+
+        self.assertEqual(written, 2)
+        rows = self.ledger.query(period="2025_september", integrator="Mcd Kuwait")
+        self.assertEqual([row["vendor_code"] for row in rows], [2, 4])
+        self.assertEqual(len(self.ledger.query(integrator="Mcd UAE")), 1)
+
+    def test_rejects_unknown_period(self):
+        with self.assertRaises(ValueError):
+            self.ledger.replace_integrator_period(
+                "latest", "Mcd Kuwait", export_rows("Mcd Kuwait", "Kuwait", "TB_KW", [1])
+            )
+        self.assertEqual(self.ledger.periods(), [])
+
+    def test_first_billed(self):
+        for period, codes in (("2025_august", [1]), ("2025_september", [1, 2]), ("2025_october", [2])):
+            self.ledger.replace_integrator_period(
+                period, "Mcd Kuwait", export_rows("Mcd Kuwait", "Kuwait", "TB_KW", codes)
+            )
+
+        history = {row["vendor_code"]: row for row in self.ledger.first_billed(integrator="Mcd Kuwait")}
+        self.assertEqual(
+            (history[1]["first_period"], history[1]["last_period"], history[1]["periods"]),
+            ("2025_august", "2025_september", 2),
+        )
+        self.assertEqual(
+            (history[2]["first_period"], history[2]["last_period"], history[2]["periods"]),
+            ("2025_september", "2025_october", 2),
+        )
+
+    def test_backfill_matches_recorded_summary(self):
+        exports_dir = self.root / "exports"
+        billed = {}
+        for month, year, integrator, country, entity_id, codes in (
+            ("September", 2025, "Mcd Kuwait", "Kuwait", "TB_KW", [1, 2]),
+            ("September", 2025, "TLBT UrbanPiper Plugin", "UAE", "TB_AE", [5, 6, 7]),
+            ("September", 2025, "TLBT UrbanPiper Plugin", "Jordan", "TB_JO", [8]),
+            ("October", 2025, "Mcd Kuwait", "Kuwait", "TB_KW", [1, 2, 3]),
+        ):
+            rows = export_rows(integrator, country, entity_id, codes)
+            path = export_csv_path(exports_dir, integrator, country, month, year)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            rows.to_csv(path, index=False)
+            billed.setdefault((path.parts[-3], integrator), []).append(rows)
+        # Like the pipeline: one call per integrator and period, every country at once
+        for (period, integrator), frames in billed.items():
+            self.ledger.replace_integrator_period(period, integrator, pd.concat(frames, ignore_index=True))
+        # Folders that aren't billing periods are skipped
+        (exports_dir / "archives" / "old").mkdir(parents=True)
+        (exports_dir / "archives" / "old" / "notes.csv").write_text("Integration Name\nMcd Kuwait\n")
+
+        backfilled = BillingLedger(self.root / "backfilled.sqlite3")
+        try:
+            stats = backfilled.backfill(exports_dir)
+            self.assertEqual(stats, {"periods": 2, "integrators": 3, "rows": 9})
+            self.assertEqual(backfilled.summary(), self.ledger.summary())
+            self.assertEqual(backfilled.query(), self.ledger.query())
+
+            # Backfilling again replaces rows instead of duplicating them
+            backfilled.backfill(exports_dir)
+            self.assertEqual(backfilled.summary(), self.ledger.summary())
+        finally:
+            backfilled.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests for BranchDeduplicator: batched matrix scoring must keep exactly the
+branches the pairwise reference path keeps.
+
+Run with: python -m unittest test_branch_dedup  (or pytest test_branch_dedup.py)
+"""
+
+import unittest
+
+import pandas as pd
+
+from generate_invoices import BranchDeduplicator
+
+
+BRANCHES = pd.DataFrame(
+    [
+        (101, "Papa Kanafa, Al Warqa 1", "OWN_DELIVERY"),
+        (101, "Papa Kanafa Al-Warqa 1", "VENDOR_DELIVERY"),
+        (101, "Papa Kanafa, Deira", "OWN_DELIVERY"),
+        (101, "PAPA KANAFA - AL WARQA 1", "OWN_DELIVERY"),
+        (202, "McDonald's, JLT", "OWN_DELIVERY"),
+        (202, "Mcdonalds JLT", "OWN_DELIVERY"),
+        (202, "McDonald's, Dubai Marina", "OWN_DELIVERY"),
+        (202, "McDonald's Marina Dubai", "VENDOR_DELIVERY"),
+        (303, "Al Baik, Mall of the Emirates", "OWN_DELIVERY"),
+        (303, "Al Baik Mall Emirates", "OWN_DELIVERY"),
+        (303, "Al Baik, Mall of the Emirates", "VENDOR_DELIVERY"),
+        (404, "Shawarma Station, Khalifa City", "OWN_DELIVERY"),
+        (None, "Papa Kanafa, Al Warqa 1", "OWN_DELIVERY"),
+        (None, "Unknown Kitchen", "OWN_DELIVERY"),
+        (505, "Jap 2.0, (DH Kitchen) Forsan Mall", "OWN_DELIVERY"),
+        (505, "Jap 2.0,(DH Kitchen),Forsan Mall", "OWN_DELIVERY"),
+        (505, "Jap 2.0, (DH Kitchen), JLT", "OWN_DELIVERY"),
+    ],
+    columns=["vendor_code", "Branch Name", "Delivery Type"],
+    index=range(100, 117),
+).astype({"vendor_code": "Int64"})
+
+
+class BatchScoringTest(unittest.TestCase):
+    def dedup(self, batch_scoring, threshold, ignore_delivery_type):
+        deduplicator = BranchDeduplicator(similarity_threshold=threshold, batch_scoring=batch_scoring)
+        return deduplicator.deduplicate(BRANCHES, ignore_delivery_type)
+
+    def test_batched_matches_pairwise(self):
+        for ignore_delivery_type in (False, True):
+            for threshold in (70, 80, 85, 90, 95):
+                with self.subTest(ignore_delivery_type=ignore_delivery_type, threshold=threshold):
+                    batched = self.dedup(True, threshold, ignore_delivery_type)
+                    pairwise = self.dedup(False, threshold, ignore_delivery_type)
+                    self.assertEqual(list(batched.keep_positions), list(pairwise.keep_positions))
+                    self.assertEqual(batched.duplicate_of, pairwise.duplicate_of)
+
+    def test_near_duplicates_merge_into_first_kept_branch(self):
+        # Guards the test above against a fixture where nothing is ever merged
+        result = self.dedup(True, 85, ignore_delivery_type=False)
+        self.assertEqual(result.duplicate_of, {1: 0, 3: 0, 5: 4, 7: 6, 9: 8, 10: 8, 15: 14})
+        self.assertEqual(
+            list(result.survivors(BRANCHES)["Branch Name"]),
+            ["Papa Kanafa, Al Warqa 1", "Papa Kanafa, Deira", "McDonald's, JLT", "McDonald's, Dubai Marina",
+             "Al Baik, Mall of the Emirates", "Shawarma Station, Khalifa City", "Papa Kanafa, Al Warqa 1",
+             "Unknown Kitchen", "Jap 2.0, (DH Kitchen) Forsan Mall", "Jap 2.0, (DH Kitchen), JLT"],
+        )
+
+    def test_comparisons_count_distinct_pairs(self):
+        deduplicator = BranchDeduplicator(batch_scoring=True)
+        deduplicator.deduplicate(BRANCHES, ignore_delivery_type=False)
+        group_sizes = BRANCHES["vendor_code"].value_counts()
+        self.assertEqual(deduplicator.comparisons, int((group_sizes * (group_sizes - 1) // 2).sum()))
+
+
+if __name__ == "__main__":
+    unittest.main()
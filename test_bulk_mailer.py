@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Tests for bulk_mailer against an in-process SMTP stand-in.
+
+Run with: python -m unittest test_bulk_mailer  (or pytest test_bulk_mailer.py)
+"""
+
+import email
+import socket
+import socketserver
+import tempfile
+import threading
+import unittest
+from email import policy
+from pathlib import Path
+
+from bulk_mailer import BulkMailer, SMTPConnectionPool
+
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP and QUIT."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.sessions.append(self.connection)
+            server.opened += 1
+        self.reply("220 stub ESMTP")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.reply("250-stub")
+                self.reply("250 8BITMIME")
+            elif verb == "HELO":
+                self.reply("250 stub")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                address = command.split(":", 1)[1].strip().strip("<>")
+                if address in server.refused:
+                    self.reply("550 No such user")
+                else:
+                    recipients.append(address)
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                for data_line in iter(self.rfile.readline, b""):
+                    if data_line == b".\r\n":
+                        break
+                    data.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                message = email.message_from_bytes(b"".join(data), policy=policy.default)
+                with server.lock:
+                    server.messages.append((recipients, message))
+                self.reply("250 OK queued")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, refused=()):
+        super().__init__(("127.0.0.1", 0), StubSMTPHandler)
+        self.lock = threading.Lock()
+        self.refused = set(refused)
+        self.sessions = []
+        self.messages = []
+        self.opened = 0
+
+    def drop_sessions(self):
+        """Close every open session from the server side, like an idle timeout."""
+        with self.lock:
+            sessions, self.sessions = self.sessions, []
+        for session in sessions:
+            try:
+                session.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class BulkMailerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StubSMTPServer(refused={"nobody@example.com"})
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.pool = SMTPConnectionPool("127.0.0.1", self.server.server_address[1], timeout=5)
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.files = []
+        for index in range(3):
+            path = Path(self.tempdir.name) / f"invoice_{index}.pdf"
+            path.write_bytes(b"%PDF" + bytes(96))  # 100 bytes each
+            self.files.append(path)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tempdir.cleanup()
+
+    def delivery(self, recipient, attachments):
+        return {"recipient": recipient, "subject": "Invoices", "body": "Attached.", "attachments": attachments}
+
+    def test_per_recipient_status(self):
+        mailer = BulkMailer(self.pool, "billing@example.com", workers=2)
+        results = mailer.send([
+            self.delivery("ops@example.com", self.files),
+            self.delivery("nobody@example.com", self.files[:1]),
+            self.delivery("missing@example.com", [Path(self.tempdir.name) / "missing.pdf"]),
+        ])
+
+        self.assertEqual([result["status"] for result in results], ["sent", "failed", "failed"])
+        self.assertEqual(results[0]["sent"], 1)
+        self.assertEqual(results[0]["bytes"], 300)
+        self.assertIn("nobody@example.com", results[1]["errors"][0])
+        self.assertEqual([recipients for recipients, _ in self.server.messages], [["ops@example.com"]])
+
+    def test_attachments_split_across_messages(self):
+        mailer = BulkMailer(self.pool, "billing@example.com", workers=2, max_attachment_bytes=250)
+        results = mailer.send([self.delivery("ops@example.com", self.files)])
+
+        self.assertEqual(results[0]["status"], "sent")
+        self.assertEqual((results[0]["messages"], results[0]["sent"]), (2, 2))
+        received = {
+            message["Subject"]: [part.get_filename() for part in message.iter_attachments()]
+            for _, message in self.server.messages
+        }
+        self.assertEqual(received, {
+            "Invoices (part 1 of 2)": ["invoice_0.pdf", "invoice_1.pdf"],
+            "Invoices (part 2 of 2)": ["invoice_2.pdf"],
+        })
+
+    def test_reconnects_when_idle_sessions_were_closed(self):
+        # Two idle sessions in the pool, both closed by the server in the meantime
+        with self.pool.connection() as first, self.pool.connection() as second:
+            first.noop()
+            second.noop()
+        self.server.drop_sessions()
+
+        mailer = BulkMailer(self.pool, "billing@example.com", workers=1)
+        results = mailer.send([self.delivery("ops@example.com", self.files[:1])])
+
+        self.assertEqual(results[0]["status"], "sent", results[0]["errors"])
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual(self.pool.opened, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,11 +4,11 @@ Test script to verify GrubTech special deduplication logic
 """
 
 import pandas as pd
-from generate_invoices import BranchDeduplicator
+from generate_invoices import BranchDeduplicator, load_source_frame
 
-# Read CSV
+# Read CSV (cleaned frame, reused from the ingest snapshot cache)
 csv_path = "POS Dashboard_Vendor Status Overview(CHECKIN)_Table.csv"
-df = pd.read_csv(csv_path)
+df = load_source_frame(csv_path)
 
 print("\n" + "="*70)
 print("GRUBTECH DEDUPLICATION TEST")
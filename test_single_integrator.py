@@ -4,11 +4,11 @@ Test script to check a single integrator's invoice details
 """
 
 import pandas as pd
-from generate_invoices import BranchDeduplicator
+from generate_invoices import BranchDeduplicator, load_source_frame
 
-# Read CSV
+# Read CSV (cleaned frame, reused from the ingest snapshot cache)
 csv_path = "POS Dashboard_Vendor Status Overview(CHECKIN)_Table.csv"
-df = pd.read_csv(csv_path)
+df = load_source_frame(csv_path)
 
 # Test with Mcd Kuwait
 integrator_name = "Mcd Kuwait"